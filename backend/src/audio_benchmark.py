@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Audio Conversion Benchmark
+音频转换基准测试
+
+Measures single-core throughput of audio_convert.AudioConverter for the
+conversions a call needs: WebRTC 48 kHz stereo in to 16 kHz STT audio, TTS
+24 kHz back out to 48 kHz, and the float32 variants. Input arrives in 20 ms
+transport frames, as from a live call; results are frames/sec on one core and
+how many realtime streams that core could carry.
+衡量 AudioConverter 的单核吞吐：按 20 ms 传输帧输入，报告每核每秒帧数与可承载的实时流数。
+
+Usage:
+    python audio_benchmark.py --seconds 30
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from audio_convert import AudioConverter
+
+INPUT_FRAME_MS = 20
+
+# name, in_rate, out_rate, in_channels, in_format, out_format
+SCENARIOS = [
+    ("webrtc_48k_stereo_to_stt_16k", 48000, 16000, 2, "s16", "s16"),
+    ("webrtc_48k_mono_to_stt_16k", 48000, 16000, 1, "s16", "s16"),
+    ("tts_24k_to_webrtc_48k", 24000, 48000, 1, "s16", "s16"),
+    ("stt_16k_to_webrtc_48k", 16000, 48000, 1, "s16", "s16"),
+    ("webrtc_48k_f32_to_stt_16k", 48000, 16000, 1, "f32", "s16"),
+    ("webrtc_48k_to_vad_16k_f32", 48000, 16000, 1, "s16", "f32"),
+]
+
+
+def input_frames(rate: int, channels: int, sample_format: str, seconds: float) -> list:
+    """20 ms frames of a speech-band test signal in the given input format."""
+    t = np.arange(int(rate * seconds)) / rate
+    signal = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.sin(2 * np.pi * 3100 * t)
+    if sample_format == "s16":
+        samples = (signal * 32767).astype("<i2")
+    else:
+        samples = signal.astype("<f4")
+    interleaved = np.repeat(samples, channels).tobytes()
+    step = rate * INPUT_FRAME_MS // 1000 * channels * samples.itemsize
+    return [interleaved[i:i + step] for i in range(0, len(interleaved) - step + 1, step)]
+
+
+def measure(scenario: tuple, seconds: float) -> dict:
+    """Run one scenario and return its throughput."""
+    name, in_rate, out_rate, channels, in_format, out_format = scenario
+    frames = input_frames(in_rate, channels, in_format, seconds)
+    converter = AudioConverter(
+        in_rate, out_rate, in_channels=channels, in_format=in_format, out_format=out_format,
+        frame_ms=INPUT_FRAME_MS,
+    )
+    # Warm up buffers and caches outside the timed loop
+    for frame in frames[:50]:
+        converter.process(frame)
+
+    start = time.perf_counter()
+    for frame in frames:
+        converter.process(frame)
+    elapsed = time.perf_counter() - start
+
+    frames_per_second = len(frames) / elapsed
+    return {
+        "scenario": name,
+        "frames": len(frames),
+        "us_per_frame": round(elapsed / len(frames) * 1e6, 2),
+        "frames_per_second": round(frames_per_second),
+        # A realtime stream needs 1000 / INPUT_FRAME_MS frames per second
+        "realtime_streams_per_core": round(frames_per_second * INPUT_FRAME_MS / 1000),
+    }
+
+
+def run_audio_benchmark(seconds: float = 10.0) -> list:
+    """
+    Measure every scenario.
+    运行全部转换场景
+
+    Args:
+        seconds: Audio duration fed through each scenario
+
+    Returns:
+        One result dict per scenario
+    """
+    return [measure(scenario, seconds) for scenario in SCENARIOS]
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Audio conversion throughput benchmark")
+    parser.add_argument("--seconds", type=float, default=30.0, help="Audio seconds per scenario")
+    args = parser.parse_args()
+
+    print(f"{'scenario':32s} {'us/frame':>10s} {'frames/s':>10s} {'streams/core':>13s}")
+    for result in run_audio_benchmark(args.seconds):
+        print(
+            f"{result['scenario']:32s} {result['us_per_frame']:10.2f} "
+            f"{result['frames_per_second']:10d} {result['realtime_streams_per_core']:13d}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Audio Conversion
+音频格式转换
+
+Downmixing, sample-rate conversion (48 kHz <-> 16/24 kHz), int16/float32
+conversion and re-chunking into fixed 10/20 ms frames between WebRTC
+transports and the Doubao services. All work is vectorized NumPy over
+buffers allocated once per converter: the per-frame path has no Python-level
+per-sample loops and allocates no sample data (buffers only grow when a chunk
+larger than any before arrives).
+WebRTC 传输与豆包服务之间的音频转换：下混、重采样（48k <-> 16k/24k）、int16/float32
+互转、按 10/20 ms 重新分帧。全部为 NumPy 向量运算，缓冲区按转换器预分配，
+逐帧路径无逐采样 Python 循环、无数据分配。
+"""
+
+import math
+from typing import List
+
+import numpy as np
+from loguru import logger
+
+from audio_format import AudioBuffer
+
+SAMPLE_FORMATS = {"s16": np.dtype("<i2"), "f32": np.dtype("<f4")}
+
+# Filter zero crossings on each side of the centre tap; more is sharper and slower
+RESAMPLE_HALF_TAPS = 8
+# Passband edge as a fraction of the lower Nyquist frequency
+RESAMPLE_CUTOFF = 0.9
+RESAMPLE_KAISER_BETA = 8.0
+
+# Input assumed per call until a larger chunk arrives
+DEFAULT_MAX_INPUT_MS = 100
+
+
+def design_filters(up: int, down: int, half_taps: int = RESAMPLE_HALF_TAPS) -> np.ndarray:
+    """
+    Polyphase low-pass filter bank for rational resampling by ``up / down``.
+    设计有理数重采样用的多相低通滤波器组
+
+    Returns:
+        float32 array of shape (up, taps); row ``p`` is the phase-``p`` filter,
+        reversed so it lines up with an ascending window of input samples
+    """
+    factor = max(up, down)
+    taps = math.ceil(2 * half_taps * factor / up)
+    length = taps * up
+    cutoff = RESAMPLE_CUTOFF / factor
+    n = np.arange(length) - (length - 1) / 2
+    prototype = cutoff * np.sinc(cutoff * n) * np.kaiser(length, RESAMPLE_KAISER_BETA)
+    # Each phase sums to one, so DC passes at unity gain
+    prototype *= up / prototype.sum()
+    filters = prototype.reshape(taps, up).T
+    return np.ascontiguousarray(filters[:, ::-1], dtype=np.float32)
+
+
+class Resampler:
+    """
+    Streaming polyphase resampler for mono float32 audio.
+    流式多相重采样器（单声道 float32）
+
+    Output sample ``n`` sits at input position ``n * down / up``. Outputs
+    ``n, n + up, n + 2 * up, ...`` share one phase filter and their input
+    windows are ``down`` samples apart, so each phase is a single strided view
+    over the input times one filter vector: ``up`` matrix-vector products per
+    chunk, never a loop over samples. Input history carries across calls, so
+    chunk boundaries do not change the output.
+    """
+
+    def __init__(self, in_rate: int, out_rate: int, max_input: int = 4800):
+        common = math.gcd(in_rate, out_rate)
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.up = out_rate // common
+        self.down = in_rate // common
+        self.filters = design_filters(self.up, self.down)
+        self.taps = self.filters.shape[1]
+
+        # Position of the next output in units of 1/up input samples, relative
+        # to the start of the history buffer; history starts as silence
+        self._history = self.taps - 1
+        self._fill = self._history
+        self._position = self._history * self.up
+        self._max_input = 0
+        self._allocate(max_input)
+
+    def _allocate(self, max_input: int) -> None:
+        max_output = max_input * self.up // self.down + 2
+        old = self._x[:self._fill] if self._max_input else None
+        self._x = np.zeros(self._history + max_input + self.down, dtype=np.float32)
+        if old is not None:
+            self._x[:len(old)] = old
+        self._y = np.empty(max_output, dtype=np.float32)
+        self._phase_y = np.empty(max_output // self.up + 1, dtype=np.float32)
+        self._max_input = max_input
+
+    def process(self, x: np.ndarray) -> np.ndarray:
+        """
+        Resample a chunk of mono float32 samples.
+        重采样一段单声道 float32 音频
+
+        Returns:
+            Output samples; a view into an internal buffer, valid until the next call
+        """
+        n = len(x)
+        if n > self._max_input:
+            logger.debug(f"Resampler {self.in_rate}->{self.out_rate} growing to {n} input samples")
+            self._allocate(n)
+        self._x[self._fill:self._fill + n] = x
+        self._fill += n
+
+        # Outputs whose window ends inside the buffered input
+        last = (self._fill - 1) * self.up - self._position
+        if last < 0:
+            return self._y[:0]
+        count = last // self.down + 1
+
+        y = self._y[:count]
+        itemsize = self._x.itemsize
+        for first in range(min(self.up, count)):
+            position = self._position + first * self.down
+            start = position // self.up - self._history
+            outputs = (count - first + self.up - 1) // self.up
+            windows = np.ndarray(
+                (outputs, self.taps), np.float32, buffer=self._x,
+                offset=start * itemsize, strides=(self.down * itemsize, itemsize),
+            )
+            if self.up == 1:
+                np.einsum("ij,j->i", windows, self.filters[0], out=y)
+            else:
+                out = self._phase_y[:outputs]
+                np.einsum("ij,j->i", windows, self.filters[position % self.up], out=out)
+                y[first::self.up] = out
+
+        # Keep only the input later windows still reach
+        self._position += count * self.down
+        start = self._position // self.up - self._history
+        keep = self._fill - start
+        self._x[:keep] = self._x[start:self._fill]
+        self._fill = keep
+        self._position -= start * self.up
+        return y
+
+
+class AudioConverter:
+    """
+    Converts transport audio to service audio (or back) and re-chunks it.
+    转换音频格式并重新分帧
+
+    Interleaved input of any channel count is downmixed to mono, resampled,
+    converted to the output sample format and, through ``process()``, cut into
+    fixed frames. Returned memoryviews point into the converter's buffers and
+    are valid until the next call; copy them if they must outlive it.
+
+    Example:
+        converter = AudioConverter(48000, 16000, in_channels=2, frame_ms=20)
+        for frame in converter.process(webrtc_pcm):
+            await stream.send_audio(frame)
+    """
+
+    def __init__(
+        self,
+        in_rate: int,
+        out_rate: int,
+        in_channels: int = 1,
+        in_format: str = "s16",
+        out_format: str = "s16",
+        frame_ms: int = 20,
+        max_input_ms: int = DEFAULT_MAX_INPUT_MS,
+    ):
+        """
+        Args:
+            in_rate: Input sample rate
+            out_rate: Output sample rate (output is always mono)
+            in_channels: Interleaved input channels
+            in_format: "s16" (16-bit little-endian) or "f32" (float32 in [-1, 1])
+            out_format: "s16" or "f32"
+            frame_ms: Output frame duration for ``process()``
+            max_input_ms: Largest chunk expected per call; larger chunks grow the buffers
+        """
+        if in_format not in SAMPLE_FORMATS or out_format not in SAMPLE_FORMATS:
+            raise Exception(f"Unsupported sample format: {in_format} -> {out_format}")
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.in_channels = in_channels
+        self.in_dtype = SAMPLE_FORMATS[in_format]
+        self.out_dtype = SAMPLE_FORMATS[out_format]
+        self.frame_samples = out_rate * frame_ms // 1000
+        self.frame_bytes = self.frame_samples * self.out_dtype.itemsize
+        # Scale to [-1, 1] folded into the downmix
+        self._scale = np.float32((1.0 / 32768.0 if in_format == "s16" else 1.0) / in_channels)
+
+        max_input = in_rate * max_input_ms // 1000
+        self.resampler = Resampler(in_rate, out_rate, max_input) if in_rate != out_rate else None
+        self._max_input = 0
+        self._pending = 0
+        self._emitted = 0
+        self._allocate(max_input)
+        self._stats = {"calls": 0, "samples_in": 0, "samples_out": 0, "frames": 0}
+
+    def _allocate(self, max_input: int) -> None:
+        max_output = max_input * self.out_rate // self.in_rate + 2
+        old = self._out[self._emitted:self._pending] if self._max_input else None
+        self._mono = np.empty(max_input, dtype=np.float32)
+        self._out = np.empty(max_output + self.frame_samples, dtype=self.out_dtype)
+        self._out_bytes = memoryview(self._out).cast("B")
+        self._pending = self._emitted = 0
+        if old is not None:
+            self._out[:len(old)] = old
+            self._pending = len(old)
+        self._max_input = max_input
+
+    def convert(self, data: AudioBuffer) -> memoryview:
+        """
+        Convert a chunk without re-chunking it.
+        转换一段音频（不重新分帧）
+
+        Args:
+            data: Interleaved samples in the input format, whole sample frames only
+
+        Returns:
+            The converted audio as bytes-like memoryview, valid until the next call
+        """
+        self._compact()
+        self._write(data)
+        start = self._emitted * self.out_dtype.itemsize
+        self._emitted = self._pending
+        return self._out_bytes[start:self._pending * self.out_dtype.itemsize]
+
+    def process(self, data: AudioBuffer) -> List[memoryview]:
+        """
+        Convert a chunk and return every complete output frame.
+        转换音频并返回完整的输出帧
+
+        A partial frame is carried over to the next call (see ``flush()``).
+
+        Returns:
+            Frames of exactly ``frame_ms``, valid until the next call
+        """
+        self._compact()
+        self._write(data)
+        frames = []
+        while self._pending - self._emitted >= self.frame_samples:
+            start = self._emitted * self.out_dtype.itemsize
+            frames.append(self._out_bytes[start:start + self.frame_bytes])
+            self._emitted += self.frame_samples
+        self._stats["frames"] += len(frames)
+        return frames
+
+    def flush(self) -> memoryview:
+        """Return the trailing partial frame (possibly empty)."""
+        start = self._emitted * self.out_dtype.itemsize
+        self._emitted = self._pending
+        return self._out_bytes[start:self._pending * self.out_dtype.itemsize]
+
+    def get_stats(self) -> dict:
+        return dict(self._stats)
+
+    def _compact(self) -> None:
+        # Move the carried-over partial frame to the front; this invalidates earlier views
+        leftover = self._pending - self._emitted
+        if self._emitted:
+            self._out[:leftover] = self._out[self._emitted:self._pending]
+        self._pending, self._emitted = leftover, 0
+
+    def _write(self, data: AudioBuffer) -> None:
+        samples = np.frombuffer(data, dtype=self.in_dtype)
+        count = len(samples) // self.in_channels
+        if count > self._max_input:
+            logger.debug(f"Audio converter growing to {count} input samples")
+            self._allocate(count)
+        self._stats["calls"] += 1
+        self._stats["samples_in"] += count
+
+        # Downmix and scale to float32 in one pass into the preallocated buffer
+        mono = self._mono[:count]
+        interleaved = samples[:count * self.in_channels].reshape(count, self.in_channels)
+        if self.in_channels == 1:
+            np.multiply(interleaved[:, 0], self._scale, out=mono)
+        else:
+            # One add per channel; np.sum over a short axis is several times slower.
+            # Accumulate in float32: an int16 loop would wrap loud samples before scaling
+            np.add(interleaved[:, 0], interleaved[:, 1], out=mono, dtype=np.float32)
+            for channel in range(2, self.in_channels):
+                np.add(mono, interleaved[:, channel], out=mono)
+            np.multiply(mono, self._scale, out=mono)
+
+        y = self.resampler.process(mono) if self.resampler is not None else mono
+        out = self._out[self._pending:self._pending + len(y)]
+        if self.out_dtype.kind == "i":
+            np.multiply(y, np.float32(32768.0), out=y)
+            np.clip(y, -32768.0, 32767.0, out=y)
+            np.rint(y, out=y)
+        np.copyto(out, y, casting="unsafe")
+        self._pending += len(y)
+        self._stats["samples_out"] += len(y)
@@ -0,0 +1,133 @@
+"""
+Audio Format Detection
+音频格式识别
+
+Reads format, codec, sample rate, bit depth and channel count from the
+header of in-memory audio (WAV, Ogg Opus, MP3), so recognition requests
+describe the actual input instead of a hardcoded format. Headerless input is
+treated as 16-bit PCM at the caller's sample rate.
+从内存音频（WAV、Ogg Opus、MP3）的头部读取格式、编码、采样率、位深与声道数，
+无头部的数据视为 16 位 PCM。
+"""
+
+import os
+import struct
+from dataclasses import dataclass
+from typing import Optional, Union
+
+AudioBuffer = Union[bytes, bytearray, memoryview]
+
+# MPEG audio sample rates by version bits (index 3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5)
+_MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+
+# Format implied by a file extension, for URLs that cannot be sniffed
+_EXTENSION_FORMATS = {
+    ".wav": ("wav", "raw"),
+    ".pcm": ("pcm", "raw"),
+    ".ogg": ("ogg", "opus"),
+    ".opus": ("ogg", "opus"),
+    ".mp3": ("mp3", "mp3"),
+}
+
+
+@dataclass
+class AudioFormat:
+    """Audio parameters as the Doubao recognition API expects them."""
+    format: str = "pcm"
+    codec: str = "raw"
+    rate: int = 16000
+    bits: int = 16
+    channels: int = 1
+
+    def to_request(self) -> dict:
+        """Fields for the ``audio`` object of a recognition request."""
+        return {
+            "format": self.format,
+            "codec": self.codec,
+            "rate": self.rate,
+            "bits": self.bits,
+            "channel": self.channels,
+        }
+
+
+def sniff_audio(data: AudioBuffer, default_rate: int = 16000, default_channels: int = 1) -> AudioFormat:
+    """
+    Detect the format of in-memory audio from its header.
+    根据头部识别内存音频格式
+
+    Args:
+        data: Audio bytes or any buffer over them (only the header is read)
+        default_rate: Sample rate assumed for headerless PCM
+        default_channels: Channel count assumed for headerless PCM
+
+    Returns:
+        AudioFormat describing the input
+    """
+    view = memoryview(data).cast("B")
+    head = bytes(view[:512])
+
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        detected = _sniff_wav(head)
+        if detected is not None:
+            return detected
+    if head[:4] == b"OggS":
+        return _sniff_ogg(head)
+    if head[:3] == b"ID3" or (len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return _sniff_mp3(view)
+    return AudioFormat(rate=default_rate, channels=default_channels)
+
+
+def format_from_url(url: str, default: Optional[AudioFormat] = None) -> AudioFormat:
+    """
+    Guess the format of hosted audio from its file extension.
+    根据 URL 扩展名推断音频格式
+    """
+    extension = os.path.splitext(url.split("?", 1)[0])[1].lower()
+    audio_format = AudioFormat(**vars(default)) if default is not None else AudioFormat(format="mp3", codec="mp3")
+    if extension in _EXTENSION_FORMATS:
+        audio_format.format, audio_format.codec = _EXTENSION_FORMATS[extension]
+    return audio_format
+
+
+def _sniff_wav(head: bytes) -> Optional[AudioFormat]:
+    # Walk the chunks up to "fmt "; it is normally the first one
+    offset = 12
+    while offset + 8 <= len(head):
+        chunk_id, size = head[offset:offset + 4], struct.unpack_from("<I", head, offset + 4)[0]
+        if chunk_id == b"fmt " and offset + 24 <= len(head):
+            _, channels, rate, _, _, bits = struct.unpack_from("<HHIIHH", head, offset + 8)
+            return AudioFormat(format="wav", codec="raw", rate=rate, bits=bits, channels=channels)
+        offset += 8 + size + (size & 1)
+    return None
+
+
+def _sniff_ogg(head: bytes) -> AudioFormat:
+    index = head.find(b"OpusHead")
+    if index < 0 or index + 16 > len(head):
+        return AudioFormat(format="ogg", codec="opus")
+    channels = head[index + 9]
+    # Original input rate; Opus itself always decodes at 48 kHz
+    rate = struct.unpack_from("<I", head, index + 12)[0] or 48000
+    return AudioFormat(format="ogg", codec="opus", rate=rate, channels=channels)
+
+
+def _sniff_mp3(view: memoryview) -> AudioFormat:
+    offset = 0
+    if bytes(view[:3]) == b"ID3" and len(view) >= 10:
+        # Synchsafe tag size; the first frame header follows the tag
+        size = (view[6] << 21) | (view[7] << 14) | (view[8] << 7) | view[9]
+        offset = 10 + size
+    header = bytes(view[offset:offset + 4])
+    audio_format = AudioFormat(format="mp3", codec="mp3")
+    if len(header) == 4 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0:
+        version = (header[1] >> 3) & 0x03
+        rate_index = (header[2] >> 2) & 0x03
+        if version in _MP3_SAMPLE_RATES and rate_index < 3:
+            audio_format.rate = _MP3_SAMPLE_RATES[version][rate_index]
+        # Channel mode 3 is mono
+        audio_format.channels = 1 if (header[3] >> 6) == 3 else 2
+    return audio_format
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Batch Transcription
+批量离线转写
+
+Re-transcribes audio archives with the Doubao file recognition API:
+submits URLs from a manifest with bounded concurrency, waits on all tasks
+through one shared ResultPoller, and appends one JSON line per file to the
+output as soon as it finishes. Submitted task IDs are checkpointed, so an
+interrupted run resumes where it stopped without resubmitting or redoing
+finished files. Runs at batch priority, behind live turns and pre-warming.
+使用豆包录音文件识别批量转写音频归档：限并发提交、共享轮询器等待结果、逐条写出 JSONL；
+已提交任务写入检查点，中断后可续跑，不重复提交或重复转写。以批处理优先级运行。
+
+Manifest lines are either a URL or a JSON object with ``url`` and optional
+``id`` (plus any other fields, copied to the output).
+清单每行为一个 URL，或包含 url（及可选 id 等字段）的 JSON 对象。
+
+Usage:
+    python batch_transcribe.py manifest.txt --output results.jsonl
+    python batch_transcribe.py manifest.jsonl --output results.jsonl --concurrency 64
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, Optional, Set
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from doubao_stt import DoubaoSTTService
+from http_client import close_pool
+from rate_limiter import PRIORITY_BATCH, request_priority
+
+# Load environment variables
+load_dotenv()
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "32"))
+# Seconds to wait for one file's result
+BATCH_DEADLINE = float(os.getenv("BATCH_DEADLINE", "600"))
+BATCH_SUBMIT_RETRIES = int(os.getenv("BATCH_SUBMIT_RETRIES", "2"))
+
+# Progress is logged every this many finished files
+PROGRESS_EVERY = 100
+
+
+def read_manifest(path: str) -> Iterator[dict]:
+    """
+    Yield manifest items lazily as ``{"id", "url", ...}`` dicts.
+    逐条读取清单
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                item = json.loads(line)
+                if "url" not in item:
+                    raise ValueError(f"{path}:{line_no}: manifest entry has no url")
+            else:
+                item = {"url": line}
+            item.setdefault("id", item["url"])
+            yield item
+
+
+def _read_jsonl(path: str) -> Iterator[dict]:
+    """Records of a JSONL file; a line cut off by a crash is skipped."""
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping truncated line in {path}")
+
+
+class BatchTranscriber:
+    """Bounded-concurrency batch transcription with checkpoint/resume and JSONL output."""
+
+    def __init__(
+        self,
+        output_path: str,
+        checkpoint_path: Optional[str] = None,
+        stt: Optional[DoubaoSTTService] = None,
+        concurrency: int = BATCH_CONCURRENCY,
+        deadline: float = BATCH_DEADLINE,
+        submit_retries: int = BATCH_SUBMIT_RETRIES,
+        retry_failed: bool = False,
+    ):
+        """Initialize batch transcriber.
+
+        Args:
+            output_path: JSONL results file, appended to
+            checkpoint_path: Submitted-task checkpoint (default: ``<output>.checkpoint``)
+            stt: STT service (default: a new DoubaoSTTService)
+            concurrency: Max files submitted but not yet finished
+            deadline: Seconds to wait for one file's result
+            submit_retries: Extra submit attempts after a failure
+            retry_failed: Redo files whose earlier result was an error
+        """
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+        self.stt = stt or DoubaoSTTService()
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.submit_retries = submit_retries
+        self.retry_failed = retry_failed
+
+        self._done: Set[str] = set()
+        self._task_ids: Dict[str, str] = {}
+        self._output = None
+        self._checkpoint = None
+        self._stats = {"total": 0, "skipped": 0, "resumed": 0, "succeeded": 0, "failed": 0}
+
+    def load_checkpoint(self) -> None:
+        """Restore finished files from the output and submitted tasks from the checkpoint."""
+        for record in _read_jsonl(self.output_path):
+            if record.get("error") is None or not self.retry_failed:
+                self._done.add(record["id"])
+        for record in _read_jsonl(self.checkpoint_path):
+            self._task_ids[record["id"]] = record["task_id"]
+        if self._done or self._task_ids:
+            logger.info(f"Resuming: {len(self._done)} files finished, {len(self._task_ids)} tasks submitted")
+
+    async def run(self, items) -> dict:
+        """
+        Transcribe every manifest item not finished yet.
+        转写清单中尚未完成的条目
+
+        Args:
+            items: Iterable of ``{"id", "url", ...}`` dicts (see read_manifest)
+
+        Returns:
+            Run statistics
+        """
+        self.load_checkpoint()
+        started = time.monotonic()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                await self._transcribe(item)
+                finished = self._stats["succeeded"] + self._stats["failed"]
+                if finished % PROGRESS_EVERY == 0:
+                    logger.info(f"Batch progress: {finished} transcribed, {self._stats['failed']} failed")
+
+        with request_priority(PRIORITY_BATCH), \
+                open(self.output_path, "a", encoding="utf-8") as self._output, \
+                open(self.checkpoint_path, "a", encoding="utf-8") as self._checkpoint:
+            # Workers inherit the batch priority from this context
+            workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+            try:
+                for item in items:
+                    self._stats["total"] += 1
+                    if item["id"] in self._done:
+                        self._stats["skipped"] += 1
+                        continue
+                    self._done.add(item["id"])  # Duplicate manifest entries run once
+                    await queue.put(item)
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+        return self.get_stats(time.monotonic() - started)
+
+    def get_stats(self, elapsed: Optional[float] = None) -> dict:
+        """Get run counters plus the shared poller's metrics."""
+        stats = dict(self._stats)
+        if elapsed is not None:
+            stats["elapsed_seconds"] = round(elapsed, 2)
+            done = stats["succeeded"] + stats["failed"]
+            stats["files_per_second"] = round(done / elapsed, 2) if elapsed else None
+        stats["poller"] = self.stt.poller.get_stats()
+        return stats
+
+    async def _transcribe(self, item: dict) -> None:
+        record = dict(item)
+        started = time.monotonic()
+        try:
+            task_id = self._task_ids.pop(item["id"], None)
+            result = None
+            if task_id is not None:
+                self._stats["resumed"] += 1
+                try:
+                    result = await self.stt.poller.wait(task_id, self.deadline)
+                except Exception as e:
+                    # Expired or unknown upstream; submit again
+                    logger.warning(f"Resumed task {task_id} for {item['id']} failed ({e}), resubmitting")
+            if result is None:
+                task_id = await self._submit(item["url"])
+                self._write(self._checkpoint, {"id": item["id"], "task_id": task_id})
+                result = await self.stt.poller.wait(task_id, self.deadline)
+            record.update(task_id=task_id, text=result.get("text", ""), utterances=result.get("utterances", []))
+            self._stats["succeeded"] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            record["error"] = str(e) or type(e).__name__
+            self._stats["failed"] += 1
+            logger.error(f"Batch transcription failed for {item['id']}: {record['error']}")
+        record["seconds"] = round(time.monotonic() - started, 3)
+        self._write(self._output, record)
+
+    async def _submit(self, url: str) -> str:
+        for attempt in range(self.submit_retries + 1):
+            try:
+                return await self.stt.submit_task(url)
+            except Exception:
+                if attempt == self.submit_retries:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+
+    @staticmethod
+    def _write(f, record: dict) -> None:
+        # One flushed line per record, so a crash loses at most the line being written
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+
+
+async def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Batch transcription of audio archives")
+    parser.add_argument("manifest", help="File with one URL or JSON object per line")
+    parser.add_argument("--output", required=True, help="JSONL results file (appended, used to resume)")
+    parser.add_argument("--checkpoint", help="Submitted-task checkpoint (default: <output>.checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Files in flight")
+    parser.add_argument("--deadline", type=float, default=BATCH_DEADLINE, help="Seconds to wait per file")
+    parser.add_argument("--retry-failed", action="store_true", help="Redo files that failed in an earlier run")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    transcriber = BatchTranscriber(
+        args.output, args.checkpoint, concurrency=args.concurrency,
+        deadline=args.deadline, retry_failed=args.retry_failed,
+    )
+    try:
+        stats = await transcriber.run(read_manifest(args.manifest))
+    finally:
+        await close_pool()
+    logger.info(f"Batch transcription finished: {json.dumps(stats)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+VoiceAI Load Test / Benchmark
+VoiceAI 压测 / 基准测试
+
+Drives N concurrent simulated conversations through the real STT, LLM and
+TTS service classes against the local mock upstream (mock_servers.py), so
+pooling, pipelining, caching and session changes can be measured offline.
+Reports turns/sec, failures, per-stage p50/p95/p99 and memory per session.
+对本地模拟上游运行 N 路并发对话，离线衡量吞吐、各阶段延迟分位数与每会话内存。
+
+Usage:
+    python benchmark.py --sessions 50 --turns 5
+    python benchmark.py --sessions 20 --error-rate 0.05 --json results.json
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Optional
+
+from loguru import logger
+
+from doubao_stt import DoubaoSTTService
+from doubao_tts import DoubaoTTSService
+from http_client import close_pool, get_pool
+from metrics import LatencyTracker, TurnTracker
+from mock_servers import MockConfig, MockUpstream
+from rate_limiter import get_stats as get_rate_limit_stats
+from response_cache import ResponseCache
+from session_manager import SessionManager, VoiceSession
+from tts_cache import TTSAudioCache
+from zhipu_llm import ZhipuGLMService
+
+# The mock STT ignores the audio itself; any URL will do
+BENCHMARK_AUDIO_URL = "http://benchmark.local/utterance.wav"
+
+
+class Benchmark:
+    """Runs simulated conversations and collects throughput and latency figures."""
+
+    def __init__(
+        self,
+        upstream: MockUpstream,
+        sessions: int = 10,
+        turns: int = 3,
+        think_time: float = 0.0,
+        tts_cache: bool = False,
+        response_cache: bool = False,
+    ):
+        """Initialize benchmark.
+
+        Args:
+            upstream: Started mock upstream the services are pointed at
+            sessions: Number of concurrent conversations
+            turns: Turns per conversation
+            think_time: Seconds each simulated user pauses between turns
+            tts_cache: Share the process-wide TTS cache instead of disabling it
+            response_cache: Cache LLM replies across simulated sessions (every question repeats)
+        """
+        self.upstream = upstream
+        self.sessions = sessions
+        self.turns = turns
+        self.think_time = think_time
+        self.tracker = LatencyTracker()
+        # A zero-byte memory tier without a disk tier never stores anything
+        self.tts_cache = None if tts_cache else TTSAudioCache(max_memory_bytes=0, disk_dir=None)
+        self.response_cache = ResponseCache(enabled=response_cache)
+        self.manager = SessionManager(self.create_session, max_sessions=sessions)
+        self._stats = {"turns": 0, "failed_turns": 0, "failed_sessions": 0}
+
+    def create_session(self, session_id: str) -> VoiceSession:
+        """Build a session whose services talk to the mock upstream."""
+        stt = DoubaoSTTService()
+        stt.api_url = self.upstream.stt_url
+        tts = DoubaoTTSService()
+        tts.api_url = self.upstream.tts_url
+        if self.tts_cache is not None:
+            tts.cache = self.tts_cache
+        llm = ZhipuGLMService(api_key="benchmark")
+        llm.base_url = self.upstream.llm_base_url
+
+        return VoiceSession(
+            session_id=session_id,
+            stt=stt,
+            llm=llm,
+            tts=tts,
+            turns=TurnTracker(session_id, tracker=self.tracker),
+            response_cache=self.response_cache,
+        )
+
+    async def run_conversation(self, session: VoiceSession) -> None:
+        """One simulated user: speak, wait for the reply, repeat."""
+        for _ in range(self.turns):
+            # Same event sequence the RTVI processor feeds the turn tracker
+            session.turns.on_event("user_started_speaking")
+            session.turns.on_event("user_stopped_speaking")
+            try:
+                text = await session.stt.transcribe(BENCHMARK_AUDIO_URL)
+                session.turns.on_event("user_transcription", text=text, final=True)
+
+                # run_turn marks first audio out and closes the turn itself
+                async for _ in session.run_turn(text):
+                    pass
+                session.turns.on_event("bot_stopped_speaking")
+                self._stats["turns"] += 1
+            except Exception as e:
+                self._stats["failed_turns"] += 1
+                session.turns.end_turn()
+                logger.debug(f"Session {session.session_id} turn failed: {e}")
+
+            if self.think_time:
+                await asyncio.sleep(self.think_time)
+
+    async def run(self) -> dict:
+        """
+        Run all conversations and return the report.
+        运行所有对话并返回报告
+        """
+        # Traced through the conversations: history, summaries and pipeline buffers
+        # only exist once sessions have talked (tracing adds some CPU overhead)
+        tracemalloc.start()
+        baseline = tracemalloc.take_snapshot()
+        sessions = [await self.manager.create(f"bench-{i}") for i in range(self.sessions)]
+
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        try:
+            results = await asyncio.gather(
+                *(session.spawn(self.run_conversation(session)) for session in sessions),
+                return_exceptions=True,
+            )
+            # Measured before close_all releases the sessions
+            talked = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+            await self.manager.close_all()
+        elapsed = time.perf_counter() - started
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+        session_bytes = sum(stat.size_diff for stat in talked.compare_to(baseline, "filename"))
+
+        self._stats["failed_sessions"] = sum(1 for result in results if isinstance(result, BaseException))
+        cpu_seconds = (usage_after.ru_utime + usage_after.ru_stime) - (usage_before.ru_utime + usage_before.ru_stime)
+
+        return {
+            "sessions": self.sessions,
+            "turns_per_session": self.turns,
+            "elapsed_seconds": round(elapsed, 3),
+            "turns_per_second": round(self._stats["turns"] / elapsed, 2) if elapsed else None,
+            "cpu_seconds": round(cpu_seconds, 3),
+            "memory_per_session_kb": round(session_bytes / self.sessions / 1024, 1) if self.sessions else None,
+            "max_rss_kb": usage_after.ru_maxrss,
+            **self._stats,
+            "stages_ms": {
+                name: {
+                    key: round(value * 1000, 1) if isinstance(value, float) else value
+                    for key, value in summary.items()
+                }
+                for name, summary in self.tracker.get_summary().items()
+            },
+            "prompt_tokens": self.tracker.get_value_summary().get("prompt_tokens"),
+            "response_cache": self.response_cache.get_stats(),
+            "upstream": dict(self.upstream.stats),
+            "http_pool": get_pool().get_stats(),
+            "rate_limits": get_rate_limit_stats(),
+        }
+
+
+def format_report(report: dict) -> str:
+    """Render a report as a plain-text table."""
+    lines = [
+        f"Sessions: {report['sessions']} x {report['turns_per_session']} turns "
+        f"in {report['elapsed_seconds']}s",
+        f"Throughput: {report['turns_per_second']} turns/s "
+        f"(failed turns: {report['failed_turns']}, failed sessions: {report['failed_sessions']})",
+        f"Memory: {report['memory_per_session_kb']} KB/session, max RSS {report['max_rss_kb']} KB, "
+        f"CPU {report['cpu_seconds']}s",
+        f"Prompt tokens: {(report.get('prompt_tokens') or {}).get('p50')} p50, "
+        f"{(report.get('prompt_tokens') or {}).get('p95')} p95",
+        f"{'stage':<18}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}",
+    ]
+    for name, summary in report["stages_ms"].items():
+        cells = [summary[key] if summary[key] is not None else "-" for key in ("p50", "p95", "p99")]
+        lines.append(f"{name:<18}{summary['count']:>7}" + "".join(f"{cell:>10}" for cell in cells))
+    return "\n".join(lines)
+
+
+async def run_benchmark(
+    sessions: int = 10,
+    turns: int = 3,
+    config: Optional[MockConfig] = None,
+    think_time: float = 0.0,
+    tts_cache: bool = False,
+    response_cache: bool = False,
+) -> dict:
+    """
+    Start the mock upstream, run the benchmark and tear everything down.
+    启动模拟上游、运行压测并清理
+    """
+    upstream = MockUpstream(config)
+    await upstream.start()
+    try:
+        benchmark = Benchmark(
+            upstream, sessions=sessions, turns=turns, think_time=think_time,
+            tts_cache=tts_cache, response_cache=response_cache,
+        )
+        return await benchmark.run()
+    finally:
+        await close_pool()
+        await upstream.stop()
+
+
+async def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="VoiceAI offline load test")
+    parser.add_argument("--sessions", type=int, default=10, help="Concurrent simulated conversations")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per conversation")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds between turns")
+    parser.add_argument("--stt-latency", type=float, default=MockConfig.stt_latency)
+    parser.add_argument("--tts-latency", type=float, default=MockConfig.tts_latency)
+    parser.add_argument("--llm-first-token-latency", type=float, default=MockConfig.llm_first_token_latency)
+    parser.add_argument("--token-rate", type=float, default=MockConfig.llm_token_rate)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--tts-cache", action="store_true", help="Use the shared TTS cache")
+    parser.add_argument("--response-cache", action="store_true", help="Cache LLM replies")
+    parser.add_argument("--json", dest="json_path", help="Also write the report to this file")
+    parser.add_argument("--log-level", default="WARNING", help="Per-request service logs are noisy under load")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    config = MockConfig(
+        stt_latency=args.stt_latency,
+        tts_latency=args.tts_latency,
+        llm_first_token_latency=args.llm_first_token_latency,
+        llm_token_rate=args.token_rate,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    report = await run_benchmark(
+        args.sessions, args.turns, config, args.think_time, args.tts_cache, args.response_cache
+    )
+
+    print(format_report(report))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logger.info(f"Report written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,200 @@
+"""
+Conversation Context Manager
+对话上下文管理
+
+Per-session message history with token budgeting. The system prompt is
+pinned first; when the history outgrows the budget the oldest turns are
+folded into a rolling summary. Compaction happens in large steps (down to a
+low watermark) so the prompt prefix stays byte-identical between compactions
+and upstream prompt caching keeps applying.
+按会话管理对话历史与 token 预算：系统提示词固定在首位，超出预算时将最早的轮次
+滚动合并为摘要；压缩一次降到低水位，保证两次压缩之间前缀不变以利用上游提示缓存。
+"""
+
+import asyncio
+import math
+import os
+from typing import Awaitable, Callable, List, Optional
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from profiler import profiled
+
+# Load environment variables
+load_dotenv()
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+# Compaction shrinks the history to this share of the budget
+CONTEXT_TARGET_RATIO = float(os.getenv("CONTEXT_TARGET_RATIO", "0.6"))
+# Most recent messages that are never summarized away
+CONTEXT_KEEP_MESSAGES = int(os.getenv("CONTEXT_KEEP_MESSAGES", "4"))
+
+# Per-message framing overhead in the chat template
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "请用简洁的中文总结以下对话中的关键信息（用户的需求、偏好、已确认的事实与未完成的事项），"
+    "不超过200字。只输出摘要。"
+)
+
+Summarizer = Callable[[Optional[str], List[dict]], Awaitable[str]]
+
+
+def _is_cjk(char: str) -> bool:
+    code = ord(char)
+    return 0x3000 <= code <= 0x9FFF or 0xF900 <= code <= 0xFAFF or 0xFF00 <= code <= 0xFFEF
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the token count of a text without a tokenizer.
+    估算文本 token 数（无需分词器）
+
+    CJK characters count as one token each; other text as one token per
+    four characters, which is close for GLM's tokenizer on mixed zh/en text.
+    """
+    cjk = sum(1 for char in text if _is_cjk(char))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def count_message_tokens(messages: List[dict]) -> int:
+    """Estimate the prompt tokens of a message list."""
+    return sum(estimate_tokens(m.get("content") or "") + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def llm_summarizer(llm) -> Summarizer:
+    """Build a summarizer that asks the LLM service to fold turns into the running summary."""
+
+    async def summarize(previous: Optional[str], messages: List[dict]) -> str:
+        lines = [f"此前摘要：{previous}"] if previous else []
+        roles = {"user": "用户", "assistant": "助手"}
+        lines += [f"{roles.get(m['role'], m['role'])}：{m['content']}" for m in messages]
+        return await llm.chat([{"role": "user", "content": "\n".join(lines)}], system_prompt=SUMMARY_PROMPT)
+
+    return summarize
+
+
+class ConversationContext:
+    """Token-budgeted conversation history for one session."""
+
+    def __init__(
+        self,
+        system_prompt: Optional[str] = None,
+        messages: Optional[List[dict]] = None,
+        max_tokens: int = CONTEXT_MAX_TOKENS,
+        target_ratio: float = CONTEXT_TARGET_RATIO,
+        keep_messages: int = CONTEXT_KEEP_MESSAGES,
+        summarizer: Optional[Summarizer] = None,
+    ):
+        """Initialize context.
+
+        Args:
+            system_prompt: Pinned system prompt
+            messages: History list to manage in place (user/assistant messages)
+            max_tokens: Prompt budget
+            target_ratio: Share of the budget the history is compacted down to
+            keep_messages: Recent messages always kept verbatim
+            summarizer: Folds old messages into the summary; None drops them instead
+        """
+        self.system_prompt = system_prompt
+        self.messages = messages if messages is not None else []
+        self.max_tokens = max_tokens
+        self.target_ratio = target_ratio
+        self.keep_messages = keep_messages
+        self.summarizer = summarizer
+        self.summary: Optional[str] = None
+
+        self._compact_lock = asyncio.Lock()
+        self._stats = {"compactions": 0, "summarized_messages": 0, "dropped_messages": 0, "summary_failures": 0}
+
+    def add_user(self, text: str) -> None:
+        self.messages.append({"role": "user", "content": text})
+
+    def add_assistant(self, text: str) -> None:
+        self.messages.append({"role": "assistant", "content": text})
+
+    def prefix(self) -> List[dict]:
+        """Pinned messages: system prompt plus the running summary, in one system message."""
+        parts = [self.system_prompt] if self.system_prompt else []
+        if self.summary:
+            parts.append(f"以下是此前对话的摘要：\n{self.summary}")
+        return [{"role": "system", "content": "\n\n".join(parts)}] if parts else []
+
+    def build(self) -> List[dict]:
+        """
+        Build the prompt for the next request, within the token budget.
+        构建下一次请求的提示消息（不超过 token 预算）
+
+        Normally the full history is sent. If a compaction has not caught up
+        yet, the oldest messages are left out of this prompt only.
+        """
+        prefix = self.prefix()
+        history = self.messages
+        budget = self.max_tokens - count_message_tokens(prefix)
+        if count_message_tokens(history) > budget:
+            start = self._fit_start(history, budget)
+            logger.debug(f"Context over budget, sending the last {len(history) - start} messages")
+            history = history[start:]
+        return prefix + list(history)
+
+    def needs_compaction(self) -> bool:
+        return count_message_tokens(self.prefix() + self.messages) > self.max_tokens
+
+    @profiled("conversation_context.compact")
+    async def compact(self) -> bool:
+        """
+        Fold the oldest messages into the summary once the budget is exceeded.
+        超出预算时将最早的消息合并进摘要
+
+        Returns:
+            True if the history was compacted
+        """
+        if not self.needs_compaction() or self._compact_lock.locked():
+            return False
+
+        async with self._compact_lock:
+            target = int(self.max_tokens * self.target_ratio) - count_message_tokens(self.prefix())
+            count = self._fit_start(self.messages, target)
+            if count <= 0:
+                return False
+            folded = self.messages[:count]
+
+            if self.summarizer is not None:
+                try:
+                    self.summary = (await self.summarizer(self.summary, folded)).strip() or self.summary
+                    self._stats["summarized_messages"] += count
+                except Exception as e:
+                    # Keep the history rather than lose it; build() still enforces the budget
+                    self._stats["summary_failures"] += 1
+                    logger.error(f"Context summarization failed: {e}")
+                    return False
+            else:
+                self._stats["dropped_messages"] += count
+
+            # Only appends happen meanwhile, so the folded messages are still the first ones
+            del self.messages[:count]
+            self._stats["compactions"] += 1
+            logger.info(f"Context compacted {count} messages, {count_message_tokens(self.build())} tokens now")
+            return True
+
+    def get_stats(self) -> dict:
+        """Get context size and compaction counters."""
+        stats = dict(self._stats)
+        stats["messages"] = len(self.messages)
+        stats["prompt_tokens"] = count_message_tokens(self.build())
+        stats["has_summary"] = self.summary is not None
+        return stats
+
+    def _fit_start(self, history: List[dict], budget: int) -> int:
+        """Index of the first message to keep so history[index:] fits the budget, at a user turn."""
+        keep_from = max(0, len(history) - self.keep_messages)
+        total = count_message_tokens(history)
+        start = 0
+        while start < keep_from and total > budget:
+            total -= count_message_tokens(history[start:start + 1])
+            start += 1
+        # Never start the kept history on an assistant reply
+        while start < keep_from and history[start].get("role") != "user":
+            start += 1
+        return start
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+RTVI Dispatch Benchmark
+RTVI 分发基准测试
+
+Measures per-frame overhead of the RTVI observer/processor path: the former
+``if/elif isinstance`` chains with ``**kwargs`` events and per-frame logging,
+against the dispatch tables and slotted events in rtvi/events.py. The frame
+mix follows a live call: mostly audio frames, a speaking transition and a
+few text frames per turn. Frame classes mirror pipecat's hierarchy so the
+benchmark runs without pipecat installed.
+衡量 RTVI 观察者/处理器路径的每帧开销：旧的 if/elif isinstance 链 + kwargs + 每帧日志，
+对比 rtvi/events.py 中的分发表与 __slots__ 事件。帧构成模拟实时通话（以音频帧为主）。
+
+Usage:
+    python dispatch_benchmark.py --frames 200000
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from loguru import logger
+
+from rtvi import events
+from rtvi.events import EventDispatcher, FrameDispatcher, RTVIEvent
+
+
+class Frame:
+    pass
+
+
+class SystemFrame(Frame):
+    pass
+
+
+class DataFrame(Frame):
+    pass
+
+
+class AudioRawFrame(DataFrame):
+    def __init__(self, audio: bytes = b""):
+        self.audio = audio
+
+
+class TextFrame(DataFrame):
+    def __init__(self, text: str = ""):
+        self.text = text
+
+
+class UserStartedSpeakingFrame(SystemFrame):
+    pass
+
+
+class UserStoppedSpeakingFrame(SystemFrame):
+    pass
+
+
+class BotStartedSpeakingFrame(SystemFrame):
+    pass
+
+
+class BotStoppedSpeakingFrame(SystemFrame):
+    pass
+
+
+class LLMTextFrame(TextFrame):
+    pass
+
+
+class UserTranscriptionFrame(TextFrame):
+    pass
+
+
+class BotTranscriptionFrame(TextFrame):
+    pass
+
+
+class LegacyProcessor:
+    """The former RTVIProcessor.handle_event: an async generator over an if/elif chain."""
+
+    async def handle_event(self, event_name: str, **kwargs):
+        if event_name == "client_ready":
+            yield None
+        elif event_name == "bot_ready":
+            yield None
+        elif event_name == "user_started_speaking":
+            logger.info("User started speaking")
+            yield UserStartedSpeakingFrame()
+        elif event_name == "user_stopped_speaking":
+            logger.info("User stopped speaking")
+            yield UserStoppedSpeakingFrame()
+        elif event_name == "bot_started_speaking":
+            logger.info("Bot started speaking")
+            yield BotStartedSpeakingFrame()
+        elif event_name == "bot_stopped_speaking":
+            logger.info("Bot stopped speaking")
+            yield BotStoppedSpeakingFrame()
+        elif event_name == "user_transcription":
+            logger.debug(f"User transcription: {kwargs}")
+            yield UserTranscriptionFrame(**kwargs)
+        elif event_name == "bot_transcription":
+            logger.debug(f"Bot transcription: {kwargs}")
+            yield BotTranscriptionFrame(**kwargs)
+        elif event_name == "llm_text":
+            logger.debug(f"LLM text: {kwargs}")
+            yield LLMTextFrame(**kwargs)
+        else:
+            logger.warning(f"Unknown event: {event_name}")
+
+
+class LegacyObserver:
+    """The former RTVIObserver.handle_frame."""
+
+    def __init__(self, rtvi):
+        self.rtvi = rtvi
+
+    async def _event(self, name, **kwargs):
+        async for _ in self.rtvi.handle_event(name, **kwargs):
+            pass
+
+    async def handle_frame(self, frame, direction):
+        if isinstance(frame, UserStartedSpeakingFrame):
+            await self._event("user_started_speaking")
+        elif isinstance(frame, UserStoppedSpeakingFrame):
+            await self._event("user_stopped_speaking")
+        elif isinstance(frame, BotStartedSpeakingFrame):
+            await self._event("bot_started_speaking")
+        elif isinstance(frame, BotStoppedSpeakingFrame):
+            await self._event("bot_stopped_speaking")
+        elif isinstance(frame, LLMTextFrame):
+            await self._event("llm_text", text=frame.text)
+        elif isinstance(frame, UserTranscriptionFrame):
+            await self._event("user_transcription", text=frame.text)
+        elif isinstance(frame, BotTranscriptionFrame):
+            await self._event("bot_transcription", text=frame.text)
+        else:
+            logger.debug(f"Unhandled frame type: {type(frame)}")
+
+
+class TableProcessor:
+    """RTVIProcessor.dispatch: one lookup by event name."""
+
+    def __init__(self):
+        self.dispatcher = EventDispatcher()
+        for name, frame_type in [
+            (events.USER_STARTED_SPEAKING, UserStartedSpeakingFrame),
+            (events.USER_STOPPED_SPEAKING, UserStoppedSpeakingFrame),
+            (events.BOT_STARTED_SPEAKING, BotStartedSpeakingFrame),
+            (events.BOT_STOPPED_SPEAKING, BotStoppedSpeakingFrame),
+        ]:
+            self.dispatcher.register(name, lambda event, frame_type=frame_type: frame_type())
+        for name, frame_type in [
+            (events.LLM_TEXT, LLMTextFrame),
+            (events.USER_TRANSCRIPTION, UserTranscriptionFrame),
+            (events.BOT_TRANSCRIPTION, BotTranscriptionFrame),
+        ]:
+            self.dispatcher.register(name, lambda event, frame_type=frame_type: frame_type(event.text))
+
+    async def dispatch(self, event: RTVIEvent):
+        frame = None
+        for handler in self.dispatcher.handlers(event.name):
+            result = handler(event)
+            if frame is None:
+                frame = result
+        return frame
+
+
+class TableObserver:
+    """RTVIObserver.handle_frame: one cached lookup by frame type."""
+
+    def __init__(self, rtvi: TableProcessor):
+        self.rtvi = rtvi
+        self.dispatcher = FrameDispatcher()
+        for frame_type, name in [
+            (UserStartedSpeakingFrame, events.USER_STARTED_SPEAKING),
+            (UserStoppedSpeakingFrame, events.USER_STOPPED_SPEAKING),
+            (BotStartedSpeakingFrame, events.BOT_STARTED_SPEAKING),
+            (BotStoppedSpeakingFrame, events.BOT_STOPPED_SPEAKING),
+        ]:
+            record = RTVIEvent(name)
+
+            async def forward(frame, direction, record=record):
+                await self.rtvi.dispatch(record)
+            self.dispatcher.register(frame_type, forward)
+        for frame_type, name in [
+            (LLMTextFrame, events.LLM_TEXT),
+            (UserTranscriptionFrame, events.USER_TRANSCRIPTION),
+            (BotTranscriptionFrame, events.BOT_TRANSCRIPTION),
+        ]:
+            async def forward_text(frame, direction, name=name):
+                await self.rtvi.dispatch(RTVIEvent(name, text=frame.text))
+            self.dispatcher.register(frame_type, forward_text)
+
+    async def handle_frame(self, frame, direction):
+        for handler in self.dispatcher.handlers(type(frame)):
+            await handler(frame, direction)
+
+
+def frame_mix(count: int) -> list:
+    """
+    A live-call frame sequence: per turn, 100 audio frames (2 s of 20 ms audio),
+    speaking transitions, a transcription and streamed LLM text.
+    模拟实时通话的帧序列
+    """
+    audio = AudioRawFrame(b"\x00" * 640)
+    turn = (
+        [UserStartedSpeakingFrame()] + [audio] * 100 + [UserStoppedSpeakingFrame(), UserTranscriptionFrame("你好")]
+        + [LLMTextFrame("好的")] * 10 + [BotStartedSpeakingFrame()] + [audio] * 100 + [BotStoppedSpeakingFrame()]
+    )
+    return (turn * (count // len(turn) + 1))[:count]
+
+
+async def measure(observer, frames: list, repeat: int = 3) -> float:
+    """Best-of-``repeat`` nanoseconds per frame."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for frame in frames:
+            await observer.handle_frame(frame, None)
+        best = min(best, (time.perf_counter_ns() - start) / len(frames))
+    return best
+
+
+async def run_dispatch_benchmark(frames: int = 100000) -> dict:
+    """
+    Compare per-frame overhead of the legacy chain and the dispatch table.
+    对比旧 if/elif 链与分发表的每帧开销
+
+    Returns:
+        ns/frame for both paths, the speedup and frames/sec capacity of each
+    """
+    mix = frame_mix(frames)
+    legacy = await measure(LegacyObserver(LegacyProcessor()), mix)
+    table = await measure(TableObserver(TableProcessor()), mix)
+    return {
+        "frames": frames,
+        "legacy_ns_per_frame": round(legacy, 1),
+        "table_ns_per_frame": round(table, 1),
+        "speedup": round(legacy / table, 2) if table else None,
+        "legacy_frames_per_second": round(1e9 / legacy),
+        "table_frames_per_second": round(1e9 / table),
+    }
+
+
+async def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="RTVI dispatch overhead benchmark")
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--log-level", default="INFO", help="Server log level; debug/info calls are filtered, not free")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level, filter=lambda record: record["name"] != __name__)
+
+    report = await run_dispatch_benchmark(args.frames)
+    for key, value in report.items():
+        print(f"{key:28s} {value}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+"""
+Doubao LLM Service (OpenAI Compatible)
+豆包大语言模型服务 - OpenAI 兼容接口
+"""
+
+import os
+from dotenv import load_dotenv
+
+from zhipu_llm import ZhipuGLMService
+
+# Load environment variables
+load_dotenv()
+
+ARK_API_KEY = os.getenv("ARK_API_KEY", "")
+DOUBAO_LLM_BASE_URL = os.getenv("DOUBAO_LLM_BASE_URL", "https://ark.cn-beijing.volces.com/api/v3")
+# Ark endpoint or model ID, e.g. doubao-1-5-pro-32k-250115
+DOUBAO_LLM_MODEL = os.getenv("DOUBAO_LLM_MODEL", "")
+
+
+class DoubaoLLMService(ZhipuGLMService):
+    """Doubao LLM via the Volcano Ark OpenAI-compatible chat completions API."""
+
+    service_name = "doubao_llm"
+
+    def __init__(self, api_key: str = None, model: str = None, base_url: str = None):
+        """Initialize Doubao LLM service.
+
+        Args:
+            api_key: Ark API key
+            model: Ark endpoint or model ID
+            base_url: Ark API base URL
+        """
+        model = model or DOUBAO_LLM_MODEL
+        if not model:
+            raise ValueError("DOUBAO_LLM_MODEL is not configured")
+        super().__init__(api_key=api_key or ARK_API_KEY, model=model, base_url=base_url or DOUBAO_LLM_BASE_URL)
+
+
+# Singleton instance
+_instance = None
+
+
+def get_service() -> "DoubaoLLMService":
+    """Get or create singleton instance of Doubao LLM Service."""
+    global _instance
+    if _instance is None:
+        _instance = DoubaoLLMService()
+    return _instance
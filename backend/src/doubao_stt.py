@@ -3,12 +3,28 @@ Doubao STT Service (Speech-to-Text)
 豆包 STT 服务（语音转文字）
 """
 
-import aiohttp
+import asyncio
+import base64
+import gzip
 import json
 import os
+import struct
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional, Union
+
+import websockets
 from dotenv import load_dotenv
 from loguru import logger
 
+from audio_convert import AudioConverter
+from audio_format import AudioBuffer, AudioFormat, format_from_url, sniff_audio
+from http_client import get_session
+from metrics import mark, track_upstream
+from profiler import profiled
+from rate_limiter import RESOURCE_STT, get_limiter
+from result_poller import ResultPoller, TaskPendingError
+from vad import EVENT_AUDIO, EVENT_STOPPED, VADProcessor
+
 # Load environment variables
 load_dotenv()
 
@@ -16,6 +32,11 @@ DOUBAO_API_KEY = os.getenv("DOUBAO_API_KEY", "")
 DOUBAO_APP_ID = os.getenv("DOUBAO_APP_ID", "25802508")
 DOUBAO_ACCESS_KEY = os.getenv("DOUBAO_ACCESS_KEY", "")
 DOUBAO_API_URL = "https://openspeech.bytedance.com/api/v3/auc/bigmodel/submit"
+# Query status codes for tasks that are still being processed
+DOUBAO_PENDING_CODES = ("20000001", "20000002")
+DOUBAO_STREAM_URL = os.getenv("DOUBAO_STREAM_URL", "wss://openspeech.bytedance.com/api/v3/sauc/bigmodel")
+# Stands in for inline audio while the request is serialized
+INLINE_DATA_PLACEHOLDER = "__inline_audio_data__"
 
 
 class DoubaoSTTService:
@@ -26,20 +47,55 @@ class DoubaoSTTService:
         self.app_id = DOUBAO_APP_ID
         self.access_key = DOUBAO_ACCESS_KEY
         self.api_url = DOUBAO_API_URL
+        self.stream_url = DOUBAO_STREAM_URL
+        self.poller = ResultPoller(self.get_result)
 
-    async def submit_task(self, audio_url: str) -> str:
+    @profiled("doubao_stt.submit_task")
+    async def submit_task(self, audio_url: str, audio_format: Optional[AudioFormat] = None) -> str:
         """
         Submit audio file for recognition.
         提交音频文件获取任务 ID
 
         Args:
             audio_url: Audio file URL
+            audio_format: Format of the file (default: guessed from the URL extension, else mp3)
 
         Returns:
             Task ID
         """
         logger.info(f"Submitting audio for recognition: {audio_url}")
+        audio = {"url": audio_url, **(audio_format or format_from_url(audio_url)).to_request()}
+        return await self._submit(audio)
+
+    @profiled("doubao_stt.submit_audio")
+    async def submit_audio(
+        self,
+        audio: AudioBuffer,
+        audio_format: Optional[AudioFormat] = None,
+        sample_rate: int = 16000,
+    ) -> str:
+        """
+        Submit in-memory audio inline (base64) for recognition, with no hosted URL.
+        直接提交内存中的音频（base64 内联），无需先上传为 URL
+
+        Args:
+            audio: WAV/Ogg Opus/MP3 bytes or raw 16-bit PCM; a memoryview over a
+                transport buffer is encoded in place without copying it first
+            audio_format: Format of the audio (default: read from its header)
+            sample_rate: Sample rate of headerless PCM
 
+        Returns:
+            Task ID
+        """
+        audio_format = audio_format or sniff_audio(audio, default_rate=sample_rate)
+        logger.info(
+            f"Submitting {memoryview(audio).nbytes} bytes of {audio_format.format} "
+            f"({audio_format.rate} Hz) for recognition"
+        )
+        return await self._submit(audio_format.to_request(), inline=audio)
+
+    async def _submit(self, audio: dict, inline: Optional[AudioBuffer] = None) -> str:
+        """Send a submit request; ``inline`` audio is spliced into the body as base64."""
         headers = {
             "Content-Type": "application/json",
             "X-Api-App-Key": self.app_id,
@@ -52,13 +108,8 @@ class DoubaoSTTService:
         data = {
             "app": {
                 "audio": {
-                    "url": audio_url,
-                    "format": "mp3",
+                    **audio,
                     "language": "zh-CN",  # Chinese
-                    "codec": "mp3",
-                    "rate": 16000,
-                    "bits": 16,
-                    "channel": 1,
                     "enable_itn": False,
                     "enable_punc": False,
                     "enable_ddc": False,
@@ -71,19 +122,30 @@ class DoubaoSTTService:
             "uid": "38880818508",  # Use your own UID
         }
 
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.post(self.api_url, json=data) as response:
-                response_json = await response.json()
-                logger.info(f"Submit task response: {response_json}")
-
-                if response_json.get("code") == "20000000":
-                    logger.info(f"Task submitted successfully, task ID: {response_json.get('task_id')}")
-                    return response_json.get("task_id")
-
-                else:
-                    logger.error(f"Task submission failed: {response_json}")
-                    raise Exception(f"Failed to submit audio task: {response_json}")
-
+        if inline is not None:
+            # Encode straight from the caller's buffer and splice the base64 bytes into
+            # the serialized JSON, skipping the str round trip through json.dumps
+            data["app"]["audio"]["data"] = INLINE_DATA_PLACEHOLDER
+            head, tail = json.dumps(data).encode("utf-8").split(INLINE_DATA_PLACEHOLDER.encode("ascii"))
+            body = b"".join((head, base64.b64encode(inline), tail))
+        else:
+            body = json.dumps(data).encode("utf-8")
+
+        session = await get_session()
+        async with get_limiter(RESOURCE_STT).slot(), track_upstream("doubao_stt"), \
+                session.post(self.api_url, data=body, headers=headers) as response:
+            response_json = await response.json()
+            logger.info(f"Submit task response: {response_json}")
+
+            if response_json.get("code") == "20000000":
+                logger.info(f"Task submitted successfully, task ID: {response_json.get('task_id')}")
+                return response_json.get("task_id")
+
+            else:
+                logger.error(f"Task submission failed: {response_json}")
+                raise Exception(f"Failed to submit audio task: {response_json}")
+
+    @profiled("doubao_stt.get_result")
     async def get_result(self, task_id: str) -> dict:
         """
         Query recognition result by task ID.
@@ -94,6 +156,9 @@ class DoubaoSTTService:
 
         Returns:
             Recognition result dict
+
+        Raises:
+            TaskPendingError: The task is queued or still being processed
         """
         logger.info(f"Querying result for task: {task_id}")
 
@@ -122,62 +187,375 @@ class DoubaoSTTService:
             },
         }
 
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.post(self.api_url, json=data) as response:
-                response_json = await response.json()
-                logger.debug(f"Query result response: {response_json}")
-
-                if response_json.get("code") == "20000000":
-                    result_data = response_json.get("result", {})
-
-                    # Parse utterances
-                    utterances = result_data.get("utterances", [])
-                    transcriptions = []
-
-                    for utterance in utterances:
-                        text = utterance.get("text", "").strip()
-                        if text:
-                            transcriptions.append({
-                                "text": text,
-                                "utterance": utterance.get("utterance", 0),
-                                "start_time": utterance.get("start_time", 0),
-                                "end_time": utterance.get("end_time", 0),
-                            })
-
-                    # Combine all text into a single result
-                    full_text = " ".join([u["text"] for u in transcriptions])
-
-                    result = {
-                        "text": full_text,
-                        "utterances": transcriptions,
-                    }
-
-                    return result
-                else:
-                    logger.error(f"Failed to query result: {response_json}")
-                    raise Exception(f"Failed to query result: {response_json}")
+        session = await get_session()
+        # A task still processing is a normal answer, not an upstream error
+        async with get_limiter(RESOURCE_STT).slot(), track_upstream("doubao_stt", (TaskPendingError,)), \
+                session.post(self.api_url, json=data, headers=headers) as response:
+            response_json = await response.json()
+            logger.debug(f"Query result response: {response_json}")
+
+            if response_json.get("code") == "20000000":
+                result_data = response_json.get("result", {})
+
+                # Parse utterances
+                utterances = result_data.get("utterances", [])
+                transcriptions = []
+
+                for utterance in utterances:
+                    text = utterance.get("text", "").strip()
+                    if text:
+                        transcriptions.append({
+                            "text": text,
+                            "utterance": utterance.get("utterance", 0),
+                            "start_time": utterance.get("start_time", 0),
+                            "end_time": utterance.get("end_time", 0),
+                        })
+
+                # Combine all text into a single result
+                full_text = " ".join([u["text"] for u in transcriptions])
+
+                result = {
+                    "text": full_text,
+                    "utterances": transcriptions,
+                }
+
+                return result
+            elif response_json.get("code") in DOUBAO_PENDING_CODES:
+                raise TaskPendingError(f"Task {task_id} still processing")
+            else:
+                logger.error(f"Failed to query result: {response_json}")
+                raise Exception(f"Failed to query result: {response_json}")
 
     def _generate_request_id(self) -> str:
         """Generate a unique request ID."""
         import uuid
         return str(uuid.uuid4())
 
-    async def transcribe(self, audio_url: str) -> str:
+    @profiled("doubao_stt.transcribe")
+    async def transcribe(self, audio: Union[str, AudioBuffer], sample_rate: int = 16000) -> str:
         """
         Transcribe audio file and return recognized text.
         转录音频并返回识别结果
 
         Args:
-            audio_url: Audio file URL
+            audio: Audio file URL, or in-memory audio submitted inline
+            sample_rate: Sample rate of headerless PCM
 
         Returns:
             Recognized text
         """
-        task_id = await self.submit_task(audio_url)
-        result = await self.get_result(task_id)
+        if isinstance(audio, str):
+            task_id = await self.submit_task(audio)
+        else:
+            task_id = await self.submit_audio(audio, sample_rate=sample_rate)
+        result = await self.poller.wait(task_id)
+        mark("stt_final")
 
         return result.get("text", "")
 
+    async def open_stream(
+        self, sample_rate: int = 16000, chunk_ms: int = 100, vad: Optional[VADProcessor] = None,
+        input_rate: Optional[int] = None, input_channels: int = 1,
+    ) -> "DoubaoStreamingSession":
+        """
+        Open a realtime recognition stream for raw PCM audio.
+        打开实时流式识别会话（原始 PCM 音频）
+
+        Args:
+            sample_rate: Sample rate of the 16-bit mono PCM that will be sent
+            chunk_ms: Audio duration buffered into each websocket packet
+            vad: Optional VAD; only speech is sent and end of turn finishes the stream
+            input_rate: Rate of the audio passed to send_audio(), e.g. 48000 from a
+                WebRTC transport; converted to ``sample_rate`` (default: no conversion)
+            input_channels: Interleaved channels of that audio; downmixed to mono
+
+        Returns:
+            Started DoubaoStreamingSession
+        """
+        session = DoubaoStreamingSession(
+            self, sample_rate=sample_rate, chunk_ms=chunk_ms, vad=vad,
+            input_rate=input_rate, input_channels=input_channels,
+        )
+        await session.start()
+        return session
+
+
+# Streaming ASR binary protocol | 流式识别二进制协议
+# Header: version/header size, message type/flags, serialization/compression, reserved
+PROTOCOL_VERSION = 0b0001
+HEADER_SIZE = 0b0001  # In units of 4 bytes
+
+MSG_FULL_CLIENT_REQUEST = 0b0001
+MSG_AUDIO_ONLY_REQUEST = 0b0010
+MSG_FULL_SERVER_RESPONSE = 0b1001
+MSG_SERVER_ERROR = 0b1111
+
+FLAG_NO_SEQUENCE = 0b0000
+FLAG_POSITIVE_SEQUENCE = 0b0001
+FLAG_LAST_PACKET = 0b0010
+FLAG_NEGATIVE_SEQUENCE = 0b0011
+
+SERIALIZATION_NONE = 0b0000
+SERIALIZATION_JSON = 0b0001
+COMPRESSION_GZIP = 0b0001
+
+
+def build_packet(
+    message_type: int,
+    flags: int,
+    payload: AudioBuffer,
+    serialization: int = SERIALIZATION_JSON,
+    sequence: Optional[int] = None,
+) -> bytes:
+    """Build a gzip-compressed protocol packet, with a sequence number if the flags call for one."""
+    header = bytes([
+        (PROTOCOL_VERSION << 4) | HEADER_SIZE,
+        (message_type << 4) | flags,
+        (serialization << 4) | COMPRESSION_GZIP,
+        0,
+    ])
+    if flags in (FLAG_POSITIVE_SEQUENCE, FLAG_NEGATIVE_SEQUENCE):
+        header += struct.pack(">i", sequence)
+    body = gzip.compress(payload)
+    return header + struct.pack(">I", len(body)) + body
+
+
+def parse_packet(packet: bytes) -> dict:
+    """
+    Parse a protocol packet.
+    解析协议数据包
+
+    Returns:
+        Dict with message_type, flags, sequence (or None), error code (or None) and payload
+    """
+    header_size = (packet[0] & 0x0F) * 4
+    message_type = packet[1] >> 4
+    flags = packet[1] & 0x0F
+    serialization = packet[2] >> 4
+    compression = packet[2] & 0x0F
+    offset = header_size
+
+    sequence = None
+    code = None
+    if message_type == MSG_SERVER_ERROR:
+        code = struct.unpack_from(">I", packet, offset)[0]
+        offset += 4
+    elif flags in (FLAG_POSITIVE_SEQUENCE, FLAG_NEGATIVE_SEQUENCE):
+        sequence = struct.unpack_from(">i", packet, offset)[0]
+        offset += 4
+
+    size = struct.unpack_from(">I", packet, offset)[0]
+    offset += 4
+    body = packet[offset:offset + size]
+    if compression == COMPRESSION_GZIP:
+        body = gzip.decompress(body)
+
+    if serialization == SERIALIZATION_JSON:
+        payload = json.loads(body) if body else {}
+    elif message_type == MSG_SERVER_ERROR:
+        payload = body.decode("utf-8", errors="replace")
+    else:
+        payload = body
+
+    return {
+        "message_type": message_type,
+        "flags": flags,
+        "sequence": sequence,
+        "code": code,
+        "payload": payload,
+    }
+
+
+@dataclass
+class StreamingTranscript:
+    """Interim or final text produced by a streaming recognition session."""
+    text: str
+    is_final: bool
+
+
+class DoubaoStreamingSession:
+    """Realtime recognition over a persistent websocket."""
+
+    def __init__(
+        self, service: DoubaoSTTService, sample_rate: int = 16000, chunk_ms: int = 100,
+        vad: Optional[VADProcessor] = None, input_rate: Optional[int] = None, input_channels: int = 1,
+    ):
+        self.service = service
+        self.sample_rate = sample_rate
+        self.vad = vad
+        # Transport audio in another rate or layout is converted before VAD and sending
+        self.converter = None
+        if (input_rate or sample_rate) != sample_rate or input_channels != 1:
+            self.converter = AudioConverter(input_rate or sample_rate, sample_rate, in_channels=input_channels)
+        # 16-bit mono PCM
+        self.chunk_bytes = sample_rate * 2 * chunk_ms // 1000
+
+        self._ws = None
+        self._buffer = bytearray()
+        self._results: asyncio.Queue = asyncio.Queue()
+        self._reader: Optional[asyncio.Task] = None
+        self._finished = False
+        self._final_keys = set()
+        self._last_interim = ""
+
+    async def start(self) -> None:
+        """Connect and send the full client request describing the audio."""
+        headers = {
+            "X-Api-App-Key": self.service.app_id,
+            "X-Api-Access-Key": self.service.access_key,
+            "X-Api-Resource-Id": "volc.bigasr.sauc.duration",
+            "X-Api-Connect-Id": self.service._generate_request_id(),
+        }
+        logger.info(f"Opening streaming recognition: {self.service.stream_url}")
+        self._ws = await websockets.connect(self.service.stream_url, additional_headers=headers)
+
+        request = {
+            "user": {"uid": "38880818508"},  # Use your own UID
+            "audio": {
+                "format": "pcm",
+                "codec": "raw",
+                "rate": self.sample_rate,
+                "bits": 16,
+                "channel": 1,
+            },
+            "request": {
+                "model_name": "bigmodel",
+                "enable_itn": False,
+                "enable_punc": True,
+                "show_utterances": True,
+                "result_type": "full",
+            },
+        }
+        await self._ws.send(build_packet(
+            MSG_FULL_CLIENT_REQUEST, FLAG_NO_SEQUENCE, json.dumps(request).encode("utf-8")
+        ))
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def send_audio(self, pcm: AudioBuffer) -> None:
+        """
+        Queue raw 16-bit PCM; a packet is sent whenever ``chunk_ms`` of audio is buffered.
+        发送原始 PCM 音频
+
+        With a VAD attached, silence is dropped and the stream is finished at end of turn.
+        """
+        if self._finished:
+            return
+        if self.converter is not None:
+            pcm = self.converter.convert(pcm)
+        if self.vad is None:
+            await self._send_pcm(pcm)
+            return
+
+        for event in self.vad.process(pcm):
+            if event.kind == EVENT_AUDIO:
+                await self._send_pcm(event.audio)
+            elif event.kind == EVENT_STOPPED:
+                # Endpoint reached: ask for the final result now instead of waiting on silence
+                await self.finish()
+                return
+
+    async def _send_pcm(self, pcm: AudioBuffer) -> None:
+        self._buffer.extend(pcm)
+        while len(self._buffer) >= self.chunk_bytes:
+            # Compress straight from the buffer; the view is released before the buffer shrinks
+            with memoryview(self._buffer) as view, view[:self.chunk_bytes] as chunk:
+                packet = build_packet(
+                    MSG_AUDIO_ONLY_REQUEST, FLAG_NO_SEQUENCE, chunk, serialization=SERIALIZATION_NONE
+                )
+            del self._buffer[:self.chunk_bytes]
+            await self._ws.send(packet)
+
+    async def finish(self) -> None:
+        """Flush buffered audio as the last packet; the server then sends final results."""
+        if self._finished:
+            return
+        self._finished = True
+        chunk = bytes(self._buffer)
+        self._buffer.clear()
+        await self._ws.send(build_packet(
+            MSG_AUDIO_ONLY_REQUEST, FLAG_LAST_PACKET, chunk, serialization=SERIALIZATION_NONE
+        ))
+
+    async def results(self) -> AsyncIterator[StreamingTranscript]:
+        """
+        Iterate interim and final transcripts until the stream ends.
+        迭代中间及最终识别结果
+        """
+        while True:
+            item = await self._results.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def transcription_frames(self):
+        """Iterate results as UserTranscriptionFrames for the pipeline."""
+        from pipecat.frames.frames import UserTranscriptionFrame
+
+        async for transcript in self.results():
+            yield UserTranscriptionFrame(text=transcript.text, final=transcript.is_final)
+
+    async def close(self) -> None:
+        """Close the websocket and stop reading."""
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+        if self._ws is not None:
+            await self._ws.close()
+
+    async def _read_loop(self) -> None:
+        """Decode server packets into transcripts."""
+        try:
+            async for message in self._ws:
+                packet = parse_packet(message)
+
+                if packet["message_type"] == MSG_SERVER_ERROR:
+                    raise Exception(f"Streaming recognition error {packet['code']}: {packet['payload']}")
+
+                is_last = packet["flags"] == FLAG_NEGATIVE_SEQUENCE
+                for transcript in self._extract_transcripts(packet["payload"], is_last):
+                    await self._results.put(transcript)
+                if is_last:
+                    break
+        except websockets.ConnectionClosed as e:
+            if not self._finished:
+                await self._results.put(Exception(f"Streaming recognition closed early: {e}"))
+        except Exception as e:
+            logger.error(f"Streaming recognition exception: {e}")
+            await self._results.put(e)
+        finally:
+            await self._results.put(None)
+
+    def _extract_transcripts(self, payload: dict, is_last: bool) -> List[StreamingTranscript]:
+        """Turn one server response into new final transcripts plus the current interim."""
+        result = payload.get("result", {})
+        transcripts = []
+        pending = []
+
+        utterances = result.get("utterances")
+        if utterances is None:
+            utterances = [{"text": result.get("text", ""), "definite": False}]
+
+        for utterance in utterances:
+            text = utterance.get("text", "").strip()
+            if not text:
+                continue
+            if utterance.get("definite") or is_last:
+                key = (utterance.get("start_time"), utterance.get("end_time"), text)
+                if key not in self._final_keys:
+                    self._final_keys.add(key)
+                    mark("stt_final")
+                    transcripts.append(StreamingTranscript(text=text, is_final=True))
+            else:
+                pending.append(text)
+
+        interim = "".join(pending)
+        if interim and interim != self._last_interim:
+            transcripts.append(StreamingTranscript(text=interim, is_final=False))
+        self._last_interim = interim
+        return transcripts
+
 
 # Singleton instance
 _instance = None
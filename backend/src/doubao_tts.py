@@ -3,11 +3,21 @@ Doubao TTS Service (Text-to-Speech)
 豆包 TTS 服务（文字转语音）
 """
 
+import asyncio
+import base64
+import codecs
+import json
 import os
-import aiohttp
+from typing import AsyncIterator, Dict, Iterable, Optional
 from loguru import logger
 from dotenv import load_dotenv
 
+from http_client import get_session
+from metrics import mark, track_upstream
+from profiler import profiled
+from rate_limiter import PRIORITY_PREWARM, RESOURCE_TTS, get_limiter, request_priority
+from tts_cache import AudioData, cache_key, get_cache
+
 # Load environment variables
 load_dotenv()
 
@@ -15,6 +25,26 @@ DOUBAO_API_KEY = os.getenv("DOUBAO_API_KEY", "")
 DOUBAO_APP_ID = os.getenv("DOUBAO_APP_ID", "25802508")
 DOUBAO_ACCESS_KEY = os.getenv("DOUBAO_ACCESS_KEY", "")
 DOUBAO_TTS_URL = "https://openspeech.bytedance.com/api/v3/tts"
+# Chunked HTTP streaming synthesis
+DOUBAO_TTS_STREAM_URL = os.getenv("DOUBAO_TTS_STREAM_URL", "https://openspeech.bytedance.com/api/v3/tts/unidirectional")
+DOUBAO_TTS_RESOURCE_ID = os.getenv("DOUBAO_TTS_RESOURCE_ID", "volc.service_type.10029")
+TTS_STREAM_SAMPLE_RATE = int(os.getenv("TTS_STREAM_SAMPLE_RATE", "24000"))
+TTS_STREAM_FRAME_MS = int(os.getenv("TTS_STREAM_FRAME_MS", "20"))
+TTS_STREAM_BUFFER_FRAMES = int(os.getenv("TTS_STREAM_BUFFER_FRAMES", "50"))
+
+# Streamed replies up to this size are also kept in the cache (greetings, fillers, short answers)
+STREAM_CACHE_MAX_BYTES = 256 * 1024
+# Stream end code
+STREAM_END_CODE = 20000000
+
+
+class _SharedRequest:
+    """One upstream synthesis shared by every caller waiting for the same audio."""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
 
 
 class DoubaoTTSService:
@@ -25,19 +55,311 @@ class DoubaoTTSService:
         self.app_id = DOUBAO_APP_ID
         self.access_key = DOUBAO_ACCESS_KEY
         self.api_url = DOUBAO_TTS_URL
+        self.stream_url = DOUBAO_TTS_STREAM_URL
+        self.resource_id = DOUBAO_TTS_RESOURCE_ID
+        self.stream_sample_rate = TTS_STREAM_SAMPLE_RATE
+        self.cache = get_cache()
+        self._in_flight: Dict[str, _SharedRequest] = {}
 
-    async def synthesize(self, text: str, voice: str = "zh_female_qingxin") -> bytes:
+    @profiled("doubao_tts.synthesize")
+    async def synthesize(
+        self,
+        text: str,
+        voice: str = "zh_female_qingxin",
+        speed_ratio: float = 1.0,
+        volume_ratio: float = 1.0,
+        pitch_ratio: float = 1.0,
+        encoding: str = "mp3",
+        use_cache: bool = True,
+    ) -> AudioData:
         """
-        Synthesize speech from text.
-        将文字转换为语音
+        Synthesize speech from text, serving repeated requests from the cache.
+        将文字转换为语音（重复请求走缓存）
 
         Args:
             text: Text to synthesize
             voice: Voice type (default: zh_female_qingxin)
+            speed_ratio: Speech speed
+            volume_ratio: Speech volume
+            pitch_ratio: Speech pitch
+            encoding: Audio encoding
+            use_cache: Set False to always call the API
 
         Returns:
-            Audio data as bytes
+            Audio data (bytes, or a read-only memoryview for disk cache hits)
         """
+        mark("tts_request")
+        audio = await self._synthesize(text, voice, speed_ratio, volume_ratio, pitch_ratio, encoding, use_cache)
+        mark("tts_first_audio")
+        return audio
+
+    async def _synthesize(
+        self,
+        text: str,
+        voice: str,
+        speed_ratio: float,
+        volume_ratio: float,
+        pitch_ratio: float,
+        encoding: str,
+        use_cache: bool,
+    ) -> AudioData:
+        """Serve from the cache or synthesize remotely, sharing concurrent identical requests."""
+        if not use_cache:
+            return await self._synthesize_remote(text, voice, speed_ratio, volume_ratio, pitch_ratio, encoding)
+
+        key = cache_key(text, voice, speed_ratio, volume_ratio, pitch_ratio, encoding)
+        audio = self.cache.get(key)
+        if audio is not None:
+            logger.debug(f"TTS cache hit for text: {text[:50]}")
+            return audio
+
+        # Concurrent requests for the same audio share one upstream call, run in
+        # its own task so one caller's barge-in does not cancel it for the others
+        shared = self._in_flight.get(key)
+        if shared is None:
+            task = asyncio.create_task(
+                self._fetch(key, text, voice, speed_ratio, volume_ratio, pitch_ratio, encoding)
+            )
+            shared = self._in_flight[key] = _SharedRequest(task)
+            task.add_done_callback(lambda _: self._release(key, shared))
+
+        shared.waiters += 1
+        try:
+            return await asyncio.shield(shared.task)
+        except asyncio.CancelledError:
+            # Only the last caller to give up cancels the upstream request
+            if shared.waiters == 1:
+                shared.task.cancel()
+            raise
+        finally:
+            shared.waiters -= 1
+
+    async def _fetch(
+        self,
+        key: str,
+        text: str,
+        voice: str,
+        speed_ratio: float,
+        volume_ratio: float,
+        pitch_ratio: float,
+        encoding: str,
+    ) -> AudioData:
+        audio = await self._synthesize_remote(text, voice, speed_ratio, volume_ratio, pitch_ratio, encoding)
+        self.cache.put(key, audio)
+        return audio
+
+    def _release(self, key: str, shared: _SharedRequest) -> None:
+        if self._in_flight.get(key) is shared:
+            del self._in_flight[key]
+        # Avoid "exception never retrieved" when every caller had already left
+        if not shared.task.cancelled():
+            shared.task.exception()
+
+    @profiled("doubao_tts.synthesize_stream")
+    async def synthesize_stream(
+        self,
+        text: str,
+        voice: str = "zh_female_qingxin",
+        speed_ratio: float = 1.0,
+        encoding: str = "pcm",
+        sample_rate: Optional[int] = None,
+        frame_ms: int = TTS_STREAM_FRAME_MS,
+        max_buffered_frames: int = TTS_STREAM_BUFFER_FRAMES,
+        use_cache: bool = True,
+    ) -> AsyncIterator[bytes]:
+        """
+        Synthesize speech and yield audio chunks as they arrive.
+        流式合成语音，边接收边输出音频块
+
+        PCM (16-bit mono) is re-cut into fixed ``frame_ms`` frames; compressed
+        encodings such as ``ogg_opus`` are yielded as received. At most
+        ``max_buffered_frames`` chunks are held between the network and the
+        consumer, so memory stays flat regardless of reply length.
+
+        Args:
+            text: Text to synthesize
+            voice: Voice type
+            speed_ratio: Speech speed
+            encoding: "pcm" or a compressed encoding ("ogg_opus", "mp3")
+            sample_rate: Output sample rate (default: TTS_STREAM_SAMPLE_RATE)
+            frame_ms: PCM frame duration in milliseconds
+            max_buffered_frames: Chunks read ahead of the consumer
+            use_cache: Set False to always call the API
+
+        Yields:
+            Audio chunks in playback order
+        """
+        sample_rate = sample_rate or self.stream_sample_rate
+        frame_bytes = sample_rate * 2 * frame_ms // 1000 if encoding == "pcm" else 0
+        key = cache_key(text, voice, speed_ratio, 1.0, 1.0, f"{encoding}_{sample_rate}") if use_cache else None
+
+        mark("tts_request")
+        cached = self.cache.get(key) if key else None
+        if cached is not None:
+            logger.debug(f"TTS cache hit for streamed text: {text[:50]}")
+            mark("tts_first_audio")
+            step = frame_bytes or len(cached)
+            for offset in range(0, len(cached), step):
+                yield bytes(cached[offset:offset + step])
+            return
+
+        frames: asyncio.Queue = asyncio.Queue(maxsize=max_buffered_frames)
+
+        async def produce():
+            collected: Optional[list] = [] if key else None
+            collected_bytes = 0
+            pending = bytearray()
+            try:
+                async for chunk in self._stream_remote(text, voice, speed_ratio, encoding, sample_rate):
+                    if collected is not None:
+                        collected_bytes += len(chunk)
+                        if collected_bytes <= STREAM_CACHE_MAX_BYTES:
+                            collected.append(chunk)
+                        else:
+                            collected = None
+                    if not frame_bytes:
+                        await frames.put(chunk)
+                        continue
+                    pending += chunk
+                    while len(pending) >= frame_bytes:
+                        await frames.put(bytes(pending[:frame_bytes]))
+                        del pending[:frame_bytes]
+                if pending:
+                    await frames.put(bytes(pending))
+                if collected:
+                    self.cache.put(key, b"".join(collected))
+            except Exception as e:
+                await frames.put(e)
+                return
+            await frames.put(None)
+
+        producer = asyncio.create_task(produce())
+        first = True
+        try:
+            while True:
+                item = await frames.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if first:
+                    mark("tts_first_audio")
+                    first = False
+                yield item
+        finally:
+            # Consumer stopped early (barge-in, cancellation): drop the upstream stream
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+    async def _stream_remote(
+        self,
+        text: str,
+        voice: str,
+        speed_ratio: float,
+        encoding: str,
+        sample_rate: int,
+    ) -> AsyncIterator[bytes]:
+        """Call the chunked streaming TTS API and yield decoded audio as it arrives."""
+        logger.info(f"Streaming speech for text: {text[:50]}...")
+
+        headers = {
+            "Content-Type": "application/json",
+            "X-Api-App-Id": self.app_id,
+            "X-Api-Access-Key": self.access_key,
+            "X-Api-Resource-Id": self.resource_id,
+            "X-Api-Request-Id": self._generate_request_id(),
+        }
+
+        data = {
+            "user": {
+                "uid": "38880818508",  # Use your own UID
+            },
+            "req_params": {
+                "text": text,
+                "speaker": voice,
+                "audio_params": {
+                    "format": encoding,
+                    "sample_rate": sample_rate,
+                    # Streaming API takes a rate offset in [-50, 100] instead of a ratio
+                    "speech_rate": max(-50, min(100, round((speed_ratio - 1.0) * 100))),
+                },
+            },
+        }
+
+        session = await get_session()
+        async with get_limiter(self.resource_id).slot(), track_upstream("doubao_tts"), \
+                session.post(self.stream_url, json=data, headers=headers) as response:
+            if response.status != 200:
+                body = await response.text()
+                raise Exception(f"TTS stream error: HTTP {response.status}: {body[:200]}")
+
+            # The body is a sequence of JSON objects; chunk boundaries do not follow them
+            decoder = json.JSONDecoder()
+            utf8 = codecs.getincrementaldecoder("utf-8")()
+            buffer = ""
+            async for raw in response.content.iter_any():
+                buffer += utf8.decode(raw)
+                while True:
+                    buffer = buffer.lstrip()
+                    if not buffer:
+                        break
+                    try:
+                        message, end = decoder.raw_decode(buffer)
+                    except json.JSONDecodeError:
+                        break  # Incomplete object, wait for more data
+                    buffer = buffer[end:]
+
+                    code = message.get("code", 0)
+                    if code == STREAM_END_CODE:
+                        return
+                    if code != 0:
+                        logger.error(f"TTS stream failed: {message}")
+                        raise Exception(f"TTS stream error: {message}")
+                    if message.get("data"):
+                        yield base64.b64decode(message["data"])
+
+        raise Exception("TTS stream ended without a completion message")
+
+    async def prewarm(self, phrases: Iterable[str], voice: str = "zh_female_qingxin", max_concurrency: int = 4) -> int:
+        """
+        Synthesize phrases ahead of time so later requests hit the cache.
+        预先合成常用短语以填充缓存
+
+        Args:
+            phrases: Phrases to synthesize
+            voice: Voice type
+            max_concurrency: Max concurrent synthesis requests
+
+        Returns:
+            Number of phrases now cached
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def warm(phrase: str) -> bool:
+            # Queued behind live turns at the upstream limiter
+            with request_priority(PRIORITY_PREWARM):
+                async with semaphore:
+                    try:
+                        await self.synthesize(phrase, voice=voice)
+                        return True
+                    except Exception as e:
+                        logger.warning(f"TTS pre-warm failed for '{phrase}': {e}")
+                        return False
+
+        results = await asyncio.gather(*(warm(phrase) for phrase in phrases))
+        logger.info(f"TTS cache pre-warmed {sum(results)}/{len(results)} phrases for voice {voice}")
+        return sum(results)
+
+    async def _synthesize_remote(
+        self,
+        text: str,
+        voice: str,
+        speed_ratio: float,
+        volume_ratio: float,
+        pitch_ratio: float,
+        encoding: str,
+    ) -> bytes:
+        """Call the TTS API and return the decoded audio."""
         logger.info(f"Synthesizing speech for text: {text[:50]}...")
 
         headers = {
@@ -60,10 +382,10 @@ class DoubaoTTSService:
             },
             "audio": {
                 "voice_type": voice,
-                "encoding": "mp3",
-                "speed_ratio": 1.0,
-                "volume_ratio": 1.0,
-                "pitch_ratio": 1.0,
+                "encoding": encoding,
+                "speed_ratio": speed_ratio,
+                "volume_ratio": volume_ratio,
+                "pitch_ratio": pitch_ratio,
             },
             "request": {
                 "reqid": self._generate_request_id(),
@@ -74,30 +396,32 @@ class DoubaoTTSService:
         }
 
         try:
-            async with aiohttp.ClientSession(headers=headers) as session:
-                async with session.post(self.api_url, json=data) as response:
-                    response_json = await response.json()
-                    logger.debug(f"TTS response: {response_json}")
-
-                    if response_json.get("code") == "0" or response_json.get("code") == "20000000":
-                        # Get the audio data URL or data
-                        if "data" in response_json:
-                            audio_data = response_json["data"]
+            session = await get_session()
+            async with get_limiter(RESOURCE_TTS).slot(), track_upstream("doubao_tts"), \
+                    session.post(self.api_url, json=data, headers=headers) as response:
+                response_json = await response.json()
+                logger.debug(f"TTS response: {response_json}")
+
+                if response_json.get("code") == "0" or response_json.get("code") == "20000000":
+                    # Get the audio data URL or data
+                    if "data" in response_json:
+                        # Inline audio is base64 encoded
+                        audio_data = base64.b64decode(response_json["data"])
+                        logger.success(f"TTS synthesis successful")
+                        return audio_data
+                    elif "url" in response_json:
+                        # Download audio from URL
+                        audio_url = response_json["url"]
+                        async with session.get(audio_url) as audio_response:
+                            audio_data = await audio_response.read()
                             logger.success(f"TTS synthesis successful")
                             return audio_data
-                        elif "url" in response_json:
-                            # Download audio from URL
-                            audio_url = response_json["url"]
-                            async with session.get(audio_url) as audio_response:
-                                audio_data = await audio_response.read()
-                                logger.success(f"TTS synthesis successful")
-                                return audio_data
-                        else:
-                            logger.error(f"TTS response missing audio data: {response_json}")
-                            raise Exception("TTS response missing audio data")
                     else:
-                        logger.error(f"TTS synthesis failed: {response_json}")
-                        raise Exception(f"TTS synthesis error: {response_json}")
+                        logger.error(f"TTS response missing audio data: {response_json}")
+                        raise Exception("TTS response missing audio data")
+                else:
+                    logger.error(f"TTS synthesis failed: {response_json}")
+                    raise Exception(f"TTS synthesis error: {response_json}")
         except Exception as e:
             logger.error(f"TTS synthesis exception: {e}")
             raise Exception(f"TTS synthesis error: {e}")
@@ -0,0 +1,197 @@
+"""
+Shared HTTP Client Pool
+共享 HTTP 连接池
+
+All Doubao / Zhipu service clients share one aiohttp session so that
+DNS lookups, TCP connections and TLS handshakes are reused across turns.
+所有豆包/智谱服务客户端共享一个 aiohttp 会话，跨轮次复用 DNS、TCP 和 TLS 连接。
+"""
+
+import asyncio
+import os
+from collections import defaultdict
+from typing import Dict, Optional
+
+import aiohttp
+from dotenv import load_dotenv
+from loguru import logger
+
+# Load environment variables
+load_dotenv()
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", "60"))
+
+
+class HTTPClientPool:
+    """Lifecycle-managed aiohttp session with per-host connection pooling."""
+
+    def __init__(
+        self,
+        limit: int = HTTP_POOL_LIMIT,
+        limit_per_host: int = HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT,
+        dns_cache_ttl: int = HTTP_DNS_CACHE_TTL,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        total_timeout: float = HTTP_TOTAL_TIMEOUT,
+    ):
+        """Initialize the pool. The session itself is created lazily.
+
+        Args:
+            limit: Max open connections across all hosts
+            limit_per_host: Max open connections per (host, port, ssl)
+            keepalive_timeout: Seconds an idle connection is kept alive
+            dns_cache_ttl: Seconds resolved addresses are cached
+            connect_timeout: Connection establishment timeout in seconds
+            total_timeout: Whole-request timeout in seconds
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = asyncio.Lock()
+        self._stats: Dict[str, int] = defaultdict(int)
+        self._host_requests: Dict[str, int] = defaultdict(int)
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """
+        Get the shared session, creating it on first use.
+        获取共享会话（首次使用时创建）
+
+        Returns:
+            Shared aiohttp.ClientSession bound to the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._loop is loop:
+            return self._session
+
+        if self._loop is not loop:
+            # The lock is loop-bound as well, so it cannot be shared across loops
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if self._session is None or self._session.closed or self._loop is not loop:
+                self._session = self._create_session()
+                self._loop = loop
+                self._stats["sessions_created"] += 1
+                logger.info(
+                    f"HTTP pool session created (limit={self.limit}, "
+                    f"limit_per_host={self.limit_per_host}, dns_ttl={self.dns_cache_ttl}s)"
+                )
+        return self._session
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        """Build a new session with a pooled connector and stats tracing."""
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+            enable_cleanup_closed=True,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            trace_configs=[self._create_trace_config()],
+        )
+
+    def _create_trace_config(self) -> aiohttp.TraceConfig:
+        """Count connection and DNS events for pool statistics."""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self._stats["requests"] += 1
+            self._host_requests[params.url.host] += 1
+
+        async def on_request_exception(session, ctx, params):
+            self._stats["request_errors"] += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self._stats["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self._stats["connections_reused"] += 1
+
+        async def on_connection_queued_start(session, ctx, params):
+            self._stats["connections_queued"] += 1
+
+        async def on_dns_cache_hit(session, ctx, params):
+            self._stats["dns_cache_hits"] += 1
+
+        async def on_dns_cache_miss(session, ctx, params):
+            self._stats["dns_cache_misses"] += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_connection_queued_start.append(on_connection_queued_start)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace_config
+
+    def get_stats(self) -> dict:
+        """
+        Get pool statistics for monitoring.
+        获取连接池统计信息
+
+        Returns:
+            Stats dict with counters, per-host request counts and live connection counts
+        """
+        stats = dict(self._stats)
+        stats["requests_per_host"] = dict(self._host_requests)
+        stats["open"] = self._session is not None and not self._session.closed
+
+        connector = self._session.connector if self._session is not None else None
+        if connector is not None and not connector.closed:
+            # aiohttp does not expose these publicly; they are stable across 3.x releases
+            idle = getattr(connector, "_conns", {})
+            stats["idle_connections"] = sum(len(conns) for conns in idle.values())
+            stats["active_connections"] = len(getattr(connector, "_acquired", ()))
+        else:
+            stats["idle_connections"] = 0
+            stats["active_connections"] = 0
+        return stats
+
+    async def close(self) -> None:
+        """
+        Close the shared session and release all pooled connections.
+        关闭共享会话并释放所有连接
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP pool session closed")
+        self._session = None
+        self._loop = None
+
+
+# Singleton instance
+_instance = None
+
+
+def get_pool() -> "HTTPClientPool":
+    """Get or create the singleton instance of HTTPClientPool."""
+    global _instance
+    if _instance is None:
+        _instance = HTTPClientPool()
+    return _instance
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Get the shared aiohttp session from the singleton pool."""
+    return await get_pool().get_session()
+
+
+async def close_pool() -> None:
+    """Close the singleton pool, e.g. on server shutdown."""
+    if _instance is not None:
+        await _instance.close()
@@ -0,0 +1,82 @@
+"""
+Barge-in / Interruption Handling
+打断处理
+
+Tracks whether the bot is speaking and, when the user starts speaking over
+it, cancels the in-flight reply (LLM stream and TTS synthesis) and flushes
+audio that is queued but not yet played.
+跟踪机器人是否在说话；用户插话时取消进行中的回复（LLM 流与 TTS 合成）并清空待播音频。
+"""
+
+import asyncio
+from typing import Awaitable, Callable, List, Set
+
+from loguru import logger
+
+
+class InterruptionController:
+    """Per-session barge-in state: cancellable reply work plus audio flush handlers."""
+
+    def __init__(self, session_id: str = ""):
+        self.session_id = session_id
+        self.bot_speaking = False
+        self._tasks: Set[asyncio.Task] = set()
+        self._flush_handlers: List[Callable[[], Awaitable[None]]] = []
+        self._stats = {"interruptions": 0, "cancelled_tasks": 0, "ignored": 0}
+
+    def register(self, task: asyncio.Task) -> asyncio.Task:
+        """Track reply work that an interruption should cancel."""
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def add_flush_handler(self, handler: Callable[[], Awaitable[None]]) -> None:
+        """Register a coroutine function that drops queued, unplayed audio."""
+        self._flush_handlers.append(handler)
+
+    def bot_started_speaking(self) -> None:
+        self.bot_speaking = True
+
+    def bot_stopped_speaking(self) -> None:
+        self.bot_speaking = False
+
+    async def user_started_speaking(self) -> bool:
+        """
+        Handle user speech; interrupts the bot if it is speaking.
+        处理用户开口；若机器人正在说话则打断
+
+        Returns:
+            True if the bot was interrupted
+        """
+        if not self.bot_speaking:
+            self._stats["ignored"] += 1
+            return False
+        await self.interrupt()
+        return True
+
+    async def interrupt(self) -> None:
+        """
+        Cancel in-flight reply work and flush queued audio.
+        取消进行中的回复并清空待播音频
+        """
+        tasks = [task for task in self._tasks if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for handler in self._flush_handlers:
+            try:
+                await handler()
+            except Exception as e:
+                logger.error(f"Session {self.session_id} audio flush failed: {e}")
+
+        self.bot_speaking = False
+        self._stats["interruptions"] += 1
+        self._stats["cancelled_tasks"] += len(tasks)
+        logger.info(f"Session {self.session_id} interrupted by user, cancelled {len(tasks)} reply task(s)")
+
+    def get_stats(self) -> dict:
+        """Get interruption counters for monitoring."""
+        stats = dict(self._stats)
+        stats["in_flight"] = len(self._tasks)
+        return stats
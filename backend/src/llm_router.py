@@ -0,0 +1,392 @@
+"""
+LLM Router
+LLM 路由
+
+Routes chat requests across several LLM backends (Zhipu GLM, GLM through an
+OpenAI client, Doubao) with a circuit breaker per provider, latency-aware
+selection, optional hedged requests once the primary is slower than its
+p95, failover before the first token and automatic failback when a
+provider recovers. Exposes the same ``chat_stream`` / ``chat`` interface as
+the individual services.
+在多个 LLM 后端之间路由：按提供方熔断、按延迟选择、超过 p95 时对冲请求、
+首 token 前自动切换、恢复后自动回切；接口与单个服务一致。
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from metrics import Histogram, mark, track_upstream
+from profiler import profiled
+from rate_limiter import RESOURCE_CHAT, get_limiter
+
+# Load environment variables
+load_dotenv()
+
+# Provider names in preference order (a single legacy LLM_PROVIDER still works)
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS") or os.getenv("LLM_PROVIDER", "glm")
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+LLM_FIRST_TOKEN_TIMEOUT = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT", "8"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "off").lower() == "on"
+# Fixed hedge delay in seconds; 0 uses the primary's first-token p95
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Weight of the newest sample in the first-token latency average
+LATENCY_EWMA_ALPHA = 0.2
+
+
+class CircuitBreaker:
+    """Closed → open after consecutive failures → half-open probe after a cool-down."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def available(self) -> bool:
+        """Whether ``allow`` would currently admit a request (without claiming the probe)."""
+        state = self.state
+        return state == self.CLOSED or (state == self.HALF_OPEN and not self._probing)
+
+    def allow(self) -> bool:
+        """Whether a request may be sent; half-open admits one probe at a time."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """A probe ended without a verdict (cancelled)."""
+        self._probing = False
+
+
+class OpenAIClientLLM:
+    """``chat_stream`` over an ``openai.AsyncOpenAI`` client, e.g. the one inside pipecat's OpenAILLMService."""
+
+    def __init__(self, client, model: str, service_name: str = "openai_llm"):
+        self.client = client
+        self.model = model
+        # Upstream name in request metrics
+        self.service_name = service_name
+
+    @classmethod
+    def from_service(cls, service, service_name: str = "openai_llm") -> "OpenAIClientLLM":
+        """Reuse the client and model of a pipecat OpenAILLMService."""
+        model = getattr(service, "model_name", None) or getattr(service, "_model", None)
+        return cls(service._client, model, service_name)
+
+    async def chat_stream(self, messages: list, system_prompt: str = None) -> AsyncIterator[str]:
+        if system_prompt and not (messages and messages[0].get("role") == "system"):
+            messages = [{"role": "system", "content": system_prompt}] + list(messages)
+        mark("llm_request")
+        async with get_limiter(RESOURCE_CHAT).slot(), track_upstream(self.service_name):
+            stream = await self.client.chat.completions.create(model=self.model, messages=messages, stream=True)
+            try:
+                async for chunk in stream:
+                    for choice in chunk.choices:
+                        if choice.delta and choice.delta.content:
+                            mark("llm_first_token")
+                            yield choice.delta.content
+                mark("llm_last_token")
+            finally:
+                await stream.close()
+
+
+@dataclass
+class LLMProvider:
+    """One routed backend and its health/latency state."""
+    name: str
+    service: object
+    priority: int = 0
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+    first_token: Histogram = field(default_factory=lambda: Histogram("llm_first_token"))
+    latency_ewma: Optional[float] = None
+    requests: int = 0
+    failures: int = 0
+
+    def observe(self, first_token_latency: float) -> None:
+        self.first_token.observe(first_token_latency)
+        if self.latency_ewma is None:
+            self.latency_ewma = first_token_latency
+        else:
+            self.latency_ewma += LATENCY_EWMA_ALPHA * (first_token_latency - self.latency_ewma)
+
+    def observe_lost(self, elapsed: float) -> None:
+        """A hedge loser took at least ``elapsed``; keeps an unmeasured slow provider from staying preferred."""
+        if self.latency_ewma is None or self.latency_ewma < elapsed:
+            self.latency_ewma = elapsed
+
+
+class _Attempt:
+    """A provider request raced up to its first token."""
+
+    def __init__(self, provider: LLMProvider, stream: AsyncIterator[str], timeout: float):
+        self.provider = provider
+        self.stream = stream
+        self.started_at = time.monotonic()
+        self.task = asyncio.ensure_future(asyncio.wait_for(stream.__anext__(), timeout))
+
+
+class LLMRouter:
+    """Circuit-broken, latency-aware, optionally hedged routing over LLM providers."""
+
+    def __init__(
+        self,
+        providers: List[LLMProvider],
+        hedge: bool = LLM_HEDGE,
+        hedge_after: float = LLM_HEDGE_AFTER,
+        hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        first_token_timeout: float = LLM_FIRST_TOKEN_TIMEOUT,
+    ):
+        """Initialize router.
+
+        Args:
+            providers: Backends; lower ``priority`` wins when latencies are unknown or equal
+            hedge: Start a second provider when the first is slow to answer
+            hedge_after: Fixed hedge delay in seconds (0 = the primary's first-token p95)
+            hedge_min_samples: Samples needed before the p95 is trusted for hedging
+            first_token_timeout: Seconds before a provider without a first token counts as failed
+        """
+        if not providers:
+            raise ValueError("LLMRouter needs at least one provider")
+        self.providers = providers
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.hedge_min_samples = hedge_min_samples
+        self.first_token_timeout = first_token_timeout
+        self._stats = {"requests": 0, "failovers": 0, "hedged": 0, "hedge_wins": 0, "rejected": 0}
+
+    @property
+    def model(self) -> str:
+        """Model of the currently preferred provider (for RTVI config)."""
+        candidates = self._ranked()
+        return getattr((candidates or self.providers)[0].service, "model", "")
+
+    def select(self) -> List[LLMProvider]:
+        """
+        Providers to try, best first: a recovering (half-open) provider gets the
+        probe, then closed providers ranked by first-token latency.
+        按优先顺序返回可用提供方（半开状态的优先试探）
+        """
+        ranked = self._ranked()
+        probes = [p for p in ranked if p.breaker.state == CircuitBreaker.HALF_OPEN and p.breaker.available()]
+        return probes + [p for p in ranked if p.breaker.state == CircuitBreaker.CLOSED]
+
+    @profiled("llm_router.chat_stream")
+    async def chat_stream(self, messages: list, system_prompt: str = None) -> AsyncIterator[str]:
+        """
+        Stream a chat completion from the best available provider.
+        从最优可用提供方流式获取回复
+
+        Fails over to the next provider if one errors or times out before its
+        first token; once text has been yielded the stream is not switched.
+        """
+        self._stats["requests"] += 1
+        winner, first = await self._race(self.select(), messages, system_prompt)
+        provider = winner.provider
+        completed = False
+        try:
+            yield first
+            async for delta in winner.stream:
+                yield delta
+            completed = True
+        except Exception as e:
+            provider.failures += 1
+            provider.breaker.record_failure()
+            logger.error(f"LLM provider {provider.name} failed mid-stream: {e}")
+            raise
+        finally:
+            if completed:
+                provider.breaker.record_success()
+            elif provider.breaker.state != CircuitBreaker.OPEN:
+                provider.breaker.release()
+            await winner.stream.aclose()
+
+    async def chat(self, messages: list, system_prompt: str = None) -> str:
+        """Send chat request through the router and wait for the full reply."""
+        parts = []
+        async for delta in self.chat_stream(messages, system_prompt):
+            parts.append(delta)
+        return "".join(parts)
+
+    def get_stats(self) -> dict:
+        """Get routing counters and per-provider breaker/latency state."""
+        stats = dict(self._stats)
+        stats["providers"] = {
+            provider.name: {
+                "state": provider.breaker.state,
+                "requests": provider.requests,
+                "failures": provider.failures,
+                "latency_ewma": provider.latency_ewma,
+                "first_token": provider.first_token.summary(),
+            }
+            for provider in self.providers
+        }
+        return stats
+
+    def _ranked(self) -> List[LLMProvider]:
+        # Measured providers by latency, then unmeasured ones in configured priority order;
+        # a cold backup gets measured through hedging and failover, not live traffic
+        return sorted(self.providers, key=lambda p: (p.latency_ewma is None, p.latency_ewma or 0.0, p.priority))
+
+    def _hedge_delay(self, provider: LLMProvider) -> Optional[float]:
+        if not self.hedge:
+            return None
+        if self.hedge_after > 0:
+            return self.hedge_after
+        if provider.first_token.count < self.hedge_min_samples:
+            return None
+        return provider.first_token.percentile(95)
+
+    def _start_next(self, queue: List[LLMProvider], messages: list, system_prompt: Optional[str]) -> Optional[_Attempt]:
+        """Start the next queued provider its breaker still admits."""
+        while queue:
+            provider = queue.pop(0)
+            if not provider.breaker.allow():
+                continue
+            provider.requests += 1
+            stream = provider.service.chat_stream(messages, system_prompt=system_prompt)
+            return _Attempt(provider, stream, self.first_token_timeout)
+        return None
+
+    async def _race(self, candidates: List[LLMProvider], messages: list, system_prompt: Optional[str]):
+        """Run attempts until one yields a first token; hedges and fails over as needed."""
+        queue = list(candidates)
+        attempts: Dict[asyncio.Future, _Attempt] = {}
+        attempt = self._start_next(queue, messages, system_prompt)
+        if attempt is None:
+            self._stats["rejected"] += 1
+            raise Exception("No LLM provider available (all circuit breakers open)")
+        attempts[attempt.task] = attempt
+        hedge_delay = self._hedge_delay(attempt.provider)
+        hedged = False
+        errors = []
+
+        try:
+            while attempts:
+                timeout = None
+                if hedge_delay is not None and not hedged and queue:
+                    timeout = max(0.0, attempt.started_at + hedge_delay - time.monotonic())
+                done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # Primary is slower than its p95: race a second provider
+                    hedged = True
+                    backup = self._start_next(queue, messages, system_prompt)
+                    if backup is None:
+                        continue
+                    self._stats["hedged"] += 1
+                    attempts[backup.task] = backup
+                    logger.info(f"Hedging LLM request on {backup.provider.name} after {hedge_delay:.2f}s")
+                    continue
+
+                for task in done:
+                    finished = attempts.pop(task)
+                    provider = finished.provider
+                    error = task.exception()
+                    if error is None:
+                        provider.observe(time.monotonic() - finished.started_at)
+                        if finished is not attempt:
+                            self._stats["hedge_wins"] += 1
+                        for loser in attempts.values():
+                            loser.provider.observe_lost(time.monotonic() - loser.started_at)
+                        return finished, task.result()
+
+                    if isinstance(error, StopAsyncIteration):
+                        error = Exception("empty reply")
+                    elif isinstance(error, asyncio.TimeoutError):
+                        error = Exception(f"no first token within {self.first_token_timeout}s")
+                    provider.failures += 1
+                    provider.breaker.record_failure()
+                    errors.append(f"{provider.name}: {error}")
+                    logger.warning(f"LLM provider {provider.name} failed before first token: {error}")
+                    await finished.stream.aclose()
+
+                if not attempts:
+                    attempt = self._start_next(queue, messages, system_prompt)
+                    if attempt is not None:
+                        self._stats["failovers"] += 1
+                        attempts[attempt.task] = attempt
+                        hedge_delay = self._hedge_delay(attempt.provider)
+        finally:
+            # Losers (or everything, on cancellation) are abandoned
+            for task, loser in attempts.items():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await loser.stream.aclose()
+                loser.provider.breaker.release()
+
+        raise Exception(f"All LLM providers failed: {'; '.join(errors)}")
+
+
+def create_providers(names: str = LLM_PROVIDERS) -> List[LLMProvider]:
+    """
+    Build providers from a comma-separated list of names (glm, glm_openai, doubao).
+    根据逗号分隔的名称列表创建提供方
+    """
+    providers = []
+    for priority, name in enumerate(n.strip() for n in names.split(",") if n.strip()):
+        if name == "glm":
+            from zhipu_llm import ZhipuGLMService
+            service = ZhipuGLMService()
+        elif name == "glm_openai":
+            from pipecat.services.openai.llm import OpenAILLMService
+            from zhipu_llm import GLM_MODEL, ZHIPU_API_KEY, ZHIPU_BASE_URL
+            service = OpenAIClientLLM.from_service(
+                OpenAILLMService(api_key=ZHIPU_API_KEY, base_url=ZHIPU_BASE_URL, model=GLM_MODEL),
+                service_name="zhipu_llm",
+            )
+        elif name == "doubao":
+            from doubao_llm import DoubaoLLMService
+            service = DoubaoLLMService()
+        else:
+            raise ValueError(f"Unknown LLM provider: {name}")
+        providers.append(LLMProvider(name=name, service=service, priority=priority))
+    return providers
+
+
+# Singleton instance
+_instance = None
+
+
+def get_router() -> "LLMRouter":
+    """Get or create the singleton instance of LLMRouter."""
+    global _instance
+    if _instance is None:
+        _instance = LLMRouter(create_providers())
+    return _instance
@@ -0,0 +1,312 @@
+"""
+Turn Latency Metrics
+轮次延迟指标
+
+Timing spans for each stage of a conversational turn (VAD end → STT final,
+LLM request → first/last token, TTS request → first audio, mouth-to-ear)
+with per-stage p50/p95/p99 histograms.
+对话轮次各阶段的计时（VAD 结束→STT 终稿、LLM 首/末 token、TTS 首包、端到端），
+并按阶段统计 p50/p95/p99。
+"""
+
+import asyncio
+import itertools
+import json
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Optional, Sequence, Tuple, Type
+
+from loguru import logger
+
+# Stage name -> (start mark, end mark)
+STAGES: Dict[str, Tuple[str, str]] = {
+    "stt": ("vad_end", "stt_final"),
+    "llm_first_token": ("llm_request", "llm_first_token"),
+    "llm_total": ("llm_request", "llm_last_token"),
+    "tts_first_audio": ("tts_request", "tts_first_audio"),
+    "mouth_to_ear": ("vad_end", "first_audio_out"),
+}
+
+# Marks that keep their latest value instead of their first
+OVERWRITE_MARKS = {"llm_last_token"}
+
+# Histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)
+# Bucket upper bounds for per-turn sizes (e.g. prompt tokens)
+SIZE_BUCKETS = (256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+class Histogram:
+    """Cumulative bucket counts plus a sliding window for percentiles."""
+
+    def __init__(self, name: str, buckets: Sequence[float] = DEFAULT_BUCKETS, window: int = 2048):
+        self.name = name
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._window: deque = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        """Record one observation."""
+        self.count += 1
+        self.sum += value
+        self._window.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Percentile (0-100) over the recent window, or None when empty."""
+        if not self._window:
+            return None
+        ordered = sorted(self._window)
+        # Nearest-rank percentile
+        index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+        return ordered[index]
+
+    def summary(self) -> dict:
+        """Count, mean and p50/p95/p99 in seconds."""
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+class LatencyTracker:
+    """Per-stage histograms fed by completed turns."""
+
+    def __init__(self, stages: Dict[str, Tuple[str, str]] = STAGES):
+        self.stages = stages
+        self.histograms: Dict[str, Histogram] = {name: Histogram(name) for name in stages}
+        # Per-turn values such as prompt_tokens, created on first use
+        self.values: Dict[str, Histogram] = {}
+
+    def record(self, turn: "TurnMetrics") -> dict:
+        """
+        Record a completed turn and emit it as a structured log record.
+        记录一轮完成的对话并输出结构化日志
+
+        Returns:
+            The structured record (stage durations in milliseconds)
+        """
+        stages = turn.stage_durations(self.stages)
+        for name, duration in stages.items():
+            self.histograms[name].observe(duration)
+        for name, value in turn.values.items():
+            if name not in self.values:
+                self.values[name] = Histogram(name, buckets=SIZE_BUCKETS)
+            self.values[name].observe(value)
+
+        record = {
+            "session_id": turn.session_id,
+            "turn_id": turn.turn_id,
+            "stages_ms": {name: round(duration * 1000, 1) for name, duration in stages.items()},
+        }
+        if turn.values:
+            record["values"] = dict(turn.values)
+        logger.bind(turn_latency=record).info(f"Turn latency: {json.dumps(record)}")
+        return record
+
+    def get_summary(self) -> Dict[str, dict]:
+        """
+        Get p50/p95/p99 per stage.
+        获取各阶段 p50/p95/p99
+        """
+        return {name: histogram.summary() for name, histogram in self.histograms.items()}
+
+    def get_value_summary(self) -> Dict[str, dict]:
+        """
+        Get count, mean and p50/p95/p99 of per-turn values (e.g. prompt_tokens).
+        获取每轮数值指标（如 prompt_tokens）的统计
+        """
+        return {name: histogram.summary() for name, histogram in self.values.items()}
+
+
+_turn_ids = itertools.count(1)
+
+
+@dataclass
+class TurnMetrics:
+    """Timestamps (time.monotonic) of the marks reached during one turn, plus per-turn values."""
+    session_id: str = ""
+    turn_id: int = field(default_factory=lambda: next(_turn_ids))
+    marks: Dict[str, float] = field(default_factory=dict)
+    values: Dict[str, float] = field(default_factory=dict)
+
+    def mark(self, name: str, at: Optional[float] = None) -> None:
+        """Record a mark; only the first occurrence counts unless the mark overwrites."""
+        if name in self.marks and name not in OVERWRITE_MARKS:
+            return
+        self.marks[name] = at if at is not None else time.monotonic()
+
+    def stage_durations(self, stages: Dict[str, Tuple[str, str]] = STAGES) -> Dict[str, float]:
+        """Durations in seconds of every stage whose start and end marks were both reached."""
+        durations = {}
+        for name, (start, end) in stages.items():
+            if start in self.marks and end in self.marks and self.marks[end] >= self.marks[start]:
+                durations[name] = self.marks[end] - self.marks[start]
+        return durations
+
+
+# Turn currently being served by this task; services mark it without being passed it
+current_turn: ContextVar[Optional[TurnMetrics]] = ContextVar("current_turn", default=None)
+
+
+def mark(name: str) -> None:
+    """
+    Mark the current turn, if any.
+    为当前轮次打点（若存在）
+    """
+    turn = current_turn.get()
+    if turn is not None:
+        turn.mark(name)
+
+
+def record_value(name: str, value: float) -> None:
+    """
+    Record a per-turn value (e.g. prompt size) on the current turn, if any.
+    为当前轮次记录数值指标（若存在）
+    """
+    turn = current_turn.get()
+    if turn is not None:
+        turn.values[name] = value
+
+
+class TurnTracker:
+    """Turn lifecycle for one session, driven by RTVI events and the turn runner."""
+
+    # RTVI event -> mark on the open turn
+    EVENT_MARKS = {
+        "llm_text": "llm_first_token",
+        "bot_started_speaking": "first_audio_out",
+    }
+
+    def __init__(self, session_id: str = "", tracker: Optional[LatencyTracker] = None):
+        self.session_id = session_id
+        self.tracker = tracker
+        self.current: Optional[TurnMetrics] = None
+        self.completed: deque = deque(maxlen=100)
+
+    def begin_turn(self) -> TurnMetrics:
+        """Start a new turn, recording any turn still open."""
+        if self.current is not None:
+            self.end_turn()
+        self.current = TurnMetrics(session_id=self.session_id)
+        return self.current
+
+    def end_turn(self) -> Optional[dict]:
+        """Close the open turn and record it."""
+        turn, self.current = self.current, None
+        if turn is None or not turn.marks:
+            return None
+        record = (self.tracker or get_tracker()).record(turn)
+        self.completed.append(record)
+        return record
+
+    def on_event(self, event_name: str, **kwargs) -> None:
+        """
+        Update the turn from an RTVI event.
+        根据 RTVI 事件更新轮次
+        """
+        if event_name == "user_stopped_speaking":
+            self.begin_turn().mark("vad_end")
+        elif event_name == "user_transcription":
+            if self.current is not None and kwargs.get("final", True):
+                self.current.mark("stt_final")
+        elif event_name == "bot_stopped_speaking":
+            self.end_turn()
+        elif event_name in self.EVENT_MARKS and self.current is not None:
+            self.current.mark(self.EVENT_MARKS[event_name])
+
+
+class UpstreamStats:
+    """Request, error and latency counters for one upstream service."""
+
+    def __init__(self, service: str):
+        self.service = service
+        self.latency = Histogram(f"{service}_request")
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+
+    @asynccontextmanager
+    async def track(self, ok_exceptions: Tuple[Type[BaseException], ...] = ()) -> AsyncIterator[None]:
+        """
+        Time one request; an exception counts as an error unless it is in ``ok_exceptions``.
+        统计一次上游请求的耗时与错误
+
+        Streamed responses are timed until the stream ends. Cancelled requests
+        (barge-in, hedging) are neither errors nor latency samples.
+        """
+        self.requests += 1
+        self.in_flight += 1
+        start = time.monotonic()
+        try:
+            yield
+        except asyncio.CancelledError:
+            raise
+        except ok_exceptions:
+            self.latency.observe(time.monotonic() - start)
+            raise
+        except Exception:
+            self.errors += 1
+            self.latency.observe(time.monotonic() - start)
+            raise
+        else:
+            self.latency.observe(time.monotonic() - start)
+        finally:
+            self.in_flight -= 1
+
+    def get_stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": self.errors / self.requests if self.requests else 0.0,
+            "in_flight": self.in_flight,
+            "latency": self.latency.summary(),
+        }
+
+
+# Upstream service name -> stats, created on first use
+_upstreams: Dict[str, UpstreamStats] = {}
+
+
+def get_upstream(service: str) -> UpstreamStats:
+    """Get or create the stats of an upstream service (doubao_stt, doubao_tts, zhipu_llm, ...)."""
+    stats = _upstreams.get(service)
+    if stats is None:
+        stats = _upstreams[service] = UpstreamStats(service)
+    return stats
+
+
+def track_upstream(service: str, ok_exceptions: Tuple[Type[BaseException], ...] = ()):
+    """
+    Async context manager timing one request to an upstream service.
+    统计一次上游请求（按服务）
+    """
+    return get_upstream(service).track(ok_exceptions)
+
+
+def get_upstream_stats() -> Dict[str, dict]:
+    """Stats of every upstream service seen so far."""
+    return {service: stats.get_stats() for service, stats in _upstreams.items()}
+
+
+# Singleton instance
+_instance = None
+
+
+def get_tracker() -> "LatencyTracker":
+    """Get or create the singleton instance of LatencyTracker."""
+    global _instance
+    if _instance is None:
+        _instance = LatencyTracker()
+    return _instance
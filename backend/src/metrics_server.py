@@ -0,0 +1,468 @@
+"""
+Metrics Endpoint and Health Probes
+指标端点与健康探针
+
+Embedded aiohttp server exposing Prometheus text-format metrics (sessions,
+per-service upstream latency and errors, turn latency, event-loop lag, queue
+depths, memory, LLM circuit state) on ``/metrics``, a liveness probe on
+``/healthz`` and a readiness probe on ``/readyz``. Readiness fails while the
+worker is saturated (session limit reached, event loop lagging, upstream
+queues backed up) or no LLM provider has a closed circuit, so the load
+balancer stops sending it new calls.
+
+With ADMIN_TOKEN set, /debug endpoints expose the profiler module at
+runtime: recent loop stalls with their stacks, per-coroutine timing, and a
+sampling profiler that returns collapsed stacks for a flame graph.
+内嵌 aiohttp 服务：/metrics 输出 Prometheus 文本格式指标，/healthz 存活探针，
+/readyz 就绪探针（会话满、事件循环延迟、上游排队或 LLM 熔断时返回 503）。
+设置 ADMIN_TOKEN 后提供 /debug 端点：卡顿调用栈、协程耗时、采样火焰图。
+"""
+
+import asyncio
+import hmac
+import os
+import resource
+import sys
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+from dotenv import load_dotenv
+from loguru import logger
+
+from http_client import get_pool
+from metrics import Histogram, get_tracker, get_upstream, get_upstream_stats
+from profiler import get_coroutine_profiler, get_sampler, get_watchdog
+from rate_limiter import get_stats as get_rate_limit_stats
+
+# Load environment variables
+load_dotenv()
+
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+# 0 = no metrics server; workers listen on METRICS_PORT + 1 + worker ID
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+LOOP_LAG_INTERVAL_MS = int(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+# Not ready while the worst lag over the last few seconds exceeds this
+READY_MAX_LOOP_LAG_MS = int(os.getenv("READY_MAX_LOOP_LAG_MS", "250"))
+# Not ready while this many requests wait at any upstream limiter
+READY_MAX_QUEUE_DEPTH = int(os.getenv("READY_MAX_QUEUE_DEPTH", "50"))
+# Bearer token for the /debug profiling endpoints (empty = endpoints off)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+# Seconds of lag samples readiness looks at
+LAG_WINDOW_SECONDS = 5.0
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag: how late a periodic sleep wakes up.
+    测量事件循环延迟（定时唤醒的滞后）
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.histogram = Histogram("event_loop_lag", buckets=LAG_BUCKETS)
+        self.last = 0.0
+        self._recent: deque = deque(maxlen=max(1, int(LAG_WINDOW_SECONDS / interval)))
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    @property
+    def recent_max(self) -> float:
+        """Worst lag over the last LAG_WINDOW_SECONDS."""
+        return max(self._recent, default=0.0)
+
+    def observe(self, lag: float) -> None:
+        self.last = lag
+        self._recent.append(lag)
+        self.histogram.observe(lag)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.observe(max(0.0, loop.time() - expected))
+
+
+class PrometheusWriter:
+    """
+    Builds a Prometheus text exposition (version 0.0.4).
+
+    Samples are grouped by metric family whatever order they are added in,
+    as the format requires.
+    """
+
+    def __init__(self, prefix: str = "voiceai_"):
+        self.prefix = prefix
+        # Family name -> header lines + samples, in first-seen order
+        self._families: Dict[str, List[str]] = {}
+
+    def sample(self, name: str, kind: str, help_text: str, value, labels: Optional[Dict[str, str]] = None) -> None:
+        """Add one counter or gauge sample; None values are skipped."""
+        if value is None:
+            return
+        name = self.prefix + name
+        self._family(name, kind, help_text).append(f"{name}{_labels(labels)} {_number(value)}")
+
+    def histogram(self, name: str, help_text: str, histogram: Histogram, labels: Optional[Dict[str, str]] = None) -> None:
+        """Add a metrics.Histogram (its bucket counts are already cumulative)."""
+        name = self.prefix + name
+        lines = self._family(name, "histogram", help_text)
+        labels = labels or {}
+        for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': _number(bound)})} {count}")
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {_number(histogram.sum)}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def render(self) -> str:
+        return "".join(line + "\n" for lines in self._families.values() for line in lines)
+
+    def _family(self, name: str, kind: str, help_text: str) -> List[str]:
+        lines = self._families.get(name)
+        if lines is None:
+            lines = self._families[name] = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        return lines
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def memory_usage() -> Dict[str, int]:
+    """Current and peak resident set size in bytes."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    current = peak
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    return {"rss_bytes": current, "max_rss_bytes": peak}
+
+
+class MetricsServer:
+    """
+    Serves /metrics, /healthz and /readyz for this process.
+    为本进程提供 /metrics、/healthz、/readyz
+    """
+
+    def __init__(
+        self,
+        host: str = METRICS_HOST,
+        port: int = METRICS_PORT,
+        router=None,
+        max_loop_lag: float = READY_MAX_LOOP_LAG_MS / 1000,
+        max_queue_depth: int = READY_MAX_QUEUE_DEPTH,
+        admin_token: str = ADMIN_TOKEN,
+    ):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on (0 = any free port)
+            router: LLMRouter whose circuit state gates readiness (optional)
+            max_loop_lag: Readiness fails above this recent event-loop lag (seconds)
+            max_queue_depth: Readiness fails with more requests than this queued at a limiter
+            admin_token: Bearer token required by the /debug endpoints (empty = not served)
+        """
+        self.host = host
+        self.port = port
+        self.router = router
+        self.max_loop_lag = max_loop_lag
+        self.max_queue_depth = max_queue_depth
+        self.admin_token = admin_token
+        self.lag = LoopLagMonitor()
+        self.watchdog = get_watchdog()
+        self.started_at = time.monotonic()
+        self.url: Optional[str] = None
+        # Session managers of the rooms this process hosts
+        self._session_managers: List = []
+        self._draining = False
+        self._runner: Optional[web.AppRunner] = None
+
+    def watch_sessions(self, manager) -> None:
+        """Include a room's SessionManager in session metrics and readiness."""
+        if manager not in self._session_managers:
+            self._session_managers.append(manager)
+
+    def unwatch_sessions(self, manager) -> None:
+        if manager in self._session_managers:
+            self._session_managers.remove(manager)
+
+    def drain(self) -> None:
+        """Report not ready from now on (e.g. before shutdown) so no new calls arrive."""
+        self._draining = True
+
+    async def start(self) -> str:
+        """
+        Start the HTTP server and lag monitor.
+        启动 HTTP 服务与事件循环延迟监控
+
+        Returns:
+            Base URL the server listens on
+        """
+        if self._runner is not None:
+            return self.url
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        app.router.add_get("/healthz", self._handle_healthz)
+        app.router.add_get("/readyz", self._handle_readyz)
+        if self.admin_token:
+            app.router.add_get("/debug/stalls", self._handle_stalls)
+            app.router.add_get("/debug/coroutines", self._handle_coroutines)
+            app.router.add_post("/debug/coroutines", self._handle_coroutines)
+            app.router.add_get("/debug/profile", self._handle_profile)
+            app.router.add_post("/debug/profile/start", self._handle_profile_start)
+            app.router.add_post("/debug/profile/stop", self._handle_profile_stop)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        bound_port = self._runner.addresses[0][1]
+        self.url = f"http://{self.host}:{bound_port}"
+        self.lag.start()
+        self.watchdog.start()
+        logger.info(f"Metrics server listening on {self.url}")
+        return self.url
+
+    async def stop(self) -> None:
+        """Stop the HTTP server, lag monitor, stall watchdog and any sampling run."""
+        await self.lag.stop()
+        self.watchdog.stop()
+        get_sampler().stop()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def session_stats(self) -> dict:
+        """Session counters summed over every watched room."""
+        totals = {"active": 0, "max_sessions": 0, "created": 0, "closed": 0, "rejected": 0}
+        for manager in self._session_managers:
+            for key, value in manager.get_stats().items():
+                if key in totals:
+                    totals[key] += value
+        return totals
+
+    def readiness(self) -> Tuple[bool, List[str]]:
+        """
+        Whether this process should get new calls, and why not.
+        判断本进程是否可接收新通话
+
+        Returns:
+            (ready, reasons it is not ready)
+        """
+        reasons = []
+        if self._draining:
+            reasons.append("draining")
+
+        sessions = self.session_stats()
+        if self._session_managers and sessions["active"] >= sessions["max_sessions"]:
+            reasons.append(f"session limit reached ({sessions['active']}/{sessions['max_sessions']})")
+
+        if self.lag.recent_max > self.max_loop_lag:
+            reasons.append(f"event loop lag {self.lag.recent_max * 1000:.0f}ms")
+
+        for resource_name, stats in get_rate_limit_stats().items():
+            depth = sum(stats["queue_depth"].values())
+            if depth > self.max_queue_depth:
+                reasons.append(f"{resource_name} queue depth {depth}")
+
+        if self.router is not None:
+            states = [provider["state"] for provider in self.router.get_stats()["providers"].values()]
+            if states and "closed" not in states:
+                reasons.append("no LLM provider with a closed circuit")
+
+        return not reasons, reasons
+
+    def render(self) -> str:
+        """
+        Current metrics in Prometheus text format.
+        以 Prometheus 文本格式输出当前指标
+        """
+        out = PrometheusWriter()
+        ready, _ = self.readiness()
+        out.sample("up_seconds", "gauge", "Seconds since the metrics server started", time.monotonic() - self.started_at)
+        out.sample("ready", "gauge", "1 if the process accepts new calls", ready)
+
+        sessions = self.session_stats()
+        out.sample("sessions_active", "gauge", "Active voice sessions", sessions["active"])
+        out.sample("sessions_max", "gauge", "Session admission limit", sessions["max_sessions"])
+        out.sample("sessions_created_total", "counter", "Sessions admitted", sessions["created"])
+        out.sample("sessions_rejected_total", "counter", "Sessions rejected at the limit", sessions["rejected"])
+
+        for service, stats in get_upstream_stats().items():
+            labels = {"service": service}
+            out.sample("upstream_requests_total", "counter", "Upstream requests", stats["requests"], labels)
+            out.sample("upstream_errors_total", "counter", "Failed upstream requests", stats["errors"], labels)
+            out.sample("upstream_in_flight", "gauge", "Upstream requests in progress", stats["in_flight"], labels)
+            out.histogram("upstream_request_seconds", "Upstream request latency", get_upstream(service).latency, labels)
+
+        tracker = get_tracker()
+        for stage, histogram in tracker.histograms.items():
+            out.histogram("turn_stage_seconds", "Turn latency by stage", histogram, {"stage": stage})
+
+        out.sample("event_loop_lag_last_seconds", "gauge", "Most recent event loop lag", self.lag.last)
+        out.histogram("event_loop_lag_seconds", "Event loop lag", self.lag.histogram)
+        if self.watchdog.running:
+            out.sample("event_loop_stalls_total", "counter", "Event loop stalls over the watchdog threshold", self.watchdog.total)
+            out.histogram("event_loop_stall_seconds", "Event loop stall duration", self.watchdog.durations)
+
+        for name, stats in get_coroutine_profiler().functions.items():
+            labels = {"function": name}
+            out.sample("coroutine_calls_total", "counter", "Profiled coroutine calls", stats.calls, labels)
+            out.sample("coroutine_errors_total", "counter", "Profiled coroutine calls that raised", stats.errors, labels)
+            out.sample("coroutine_busy_seconds_total", "counter", "Time profiled coroutines ran on the loop", stats.busy, labels)
+            out.histogram("coroutine_seconds", "Profiled coroutine wall time", stats.wall, labels)
+            out.histogram("coroutine_max_step_seconds", "Longest loop-blocking step per profiled call", stats.max_step, labels)
+
+        for resource_name, stats in get_rate_limit_stats().items():
+            labels = {"resource": resource_name}
+            out.sample("upstream_limiter_active", "gauge", "Requests holding a limiter slot", stats["active"], labels)
+            for priority, depth in stats["queue_depth"].items():
+                out.sample(
+                    "upstream_limiter_queue_depth", "gauge", "Requests waiting at a limiter",
+                    depth, {**labels, "priority": priority},
+                )
+
+        pool = get_pool().get_stats()
+        out.sample("http_pool_requests_total", "counter", "Requests through the shared HTTP pool", pool.get("requests", 0))
+        out.sample("http_pool_request_errors_total", "counter", "HTTP pool request errors", pool.get("request_errors", 0))
+        for state in ("active", "idle"):
+            out.sample(
+                "http_pool_connections", "gauge", "Pooled upstream connections",
+                pool[f"{state}_connections"], {"state": state},
+            )
+        out.sample("http_pool_connections_queued_total", "counter", "Requests that waited for a connection", pool.get("connections_queued", 0))
+
+        memory = memory_usage()
+        out.sample("memory_rss_bytes", "gauge", "Resident set size", memory["rss_bytes"])
+        out.sample("memory_max_rss_bytes", "gauge", "Peak resident set size", memory["max_rss_bytes"])
+
+        if self.router is not None:
+            router_stats = self.router.get_stats()
+            for provider, stats in router_stats["providers"].items():
+                labels = {"provider": provider}
+                out.sample(
+                    "llm_circuit_state", "gauge", "LLM circuit state (0 closed, 1 half open, 2 open)",
+                    CIRCUIT_STATES.get(stats["state"], 2), labels,
+                )
+                out.sample("llm_provider_requests_total", "counter", "Requests routed to an LLM provider", stats["requests"], labels)
+                out.sample("llm_provider_failures_total", "counter", "Failed LLM provider attempts", stats["failures"], labels)
+            for key in ("failovers", "hedged", "rejected"):
+                out.sample(f"llm_{key}_total", "counter", f"LLM router {key}", router_stats.get(key))
+
+        return out.render()
+
+    async def _handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def _handle_healthz(self, request: web.Request) -> web.Response:
+        # Answering at all means the event loop is alive; lag is reported, not judged
+        return web.json_response({
+            "status": "ok",
+            "uptime": round(time.monotonic() - self.started_at, 1),
+            "event_loop_lag_ms": round(self.lag.recent_max * 1000, 1),
+        })
+
+    async def _handle_readyz(self, request: web.Request) -> web.Response:
+        ready, reasons = self.readiness()
+        return web.json_response(
+            {"status": "ready" if ready else "not_ready", "reasons": reasons, "sessions": self.session_stats()},
+            status=200 if ready else 503,
+        )
+
+    def _authorize(self, request: web.Request) -> None:
+        expected = f"Bearer {self.admin_token}".encode()
+        # Bytes: compare_digest rejects non-ASCII str, which would surface as a 500
+        supplied = request.headers.get("Authorization", "").encode("utf-8", "surrogateescape")
+        if not hmac.compare_digest(supplied, expected):
+            raise web.HTTPUnauthorized()
+
+    async def _handle_stalls(self, request: web.Request) -> web.Response:
+        self._authorize(request)
+        return web.json_response({**self.watchdog.get_stats(), "recent": self.watchdog.get_stalls()})
+
+    async def _handle_coroutines(self, request: web.Request) -> web.Response:
+        """GET: per-coroutine timing. POST ?enabled=on|off[&reset=1]: switch timing on or off."""
+        self._authorize(request)
+        profiler = get_coroutine_profiler()
+        if request.method == "POST":
+            if request.query.get("reset"):
+                profiler.reset()
+            if "enabled" in request.query:
+                profiler.enabled = request.query["enabled"].lower() in ("on", "1", "true")
+                logger.info(f"Coroutine profiling {'enabled' if profiler.enabled else 'disabled'}")
+        return web.json_response(profiler.get_stats())
+
+    async def _handle_profile(self, request: web.Request) -> web.Response:
+        """Collapsed stacks of the current or last sampling run (flamegraph.pl / speedscope input)."""
+        self._authorize(request)
+        sampler = get_sampler()
+        return web.Response(text=sampler.collapsed(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Profile-Samples": str(sampler.samples)})
+
+    async def _handle_profile_start(self, request: web.Request) -> web.Response:
+        """Start sampling the event loop: ?hz=100&seconds=60&idle=1."""
+        self._authorize(request)
+        try:
+            hz = int(request.query.get("hz", 0)) or None
+            seconds = float(request.query.get("seconds", 0)) or None
+        except ValueError:
+            raise web.HTTPBadRequest(text="hz and seconds must be numbers")
+        sampler = get_sampler()
+        # Called on the loop, so the calling thread is the one to sample
+        sampler.start(hz=hz, max_seconds=seconds, include_idle=bool(request.query.get("idle")))
+        return web.json_response(sampler.get_stats())
+
+    async def _handle_profile_stop(self, request: web.Request) -> web.Response:
+        """Stop sampling and return the collapsed stacks."""
+        self._authorize(request)
+        sampler = get_sampler()
+        sampler.stop()
+        return web.Response(text=sampler.collapsed(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Profile-Samples": str(sampler.samples)})
+
+
+# Singleton instance
+_instance = None
+
+
+def get_metrics_server() -> "MetricsServer":
+    """Get or create the singleton instance of MetricsServer (gated on the shared LLM router)."""
+    global _instance
+    if _instance is None:
+        from llm_router import get_router
+        _instance = MetricsServer(router=get_router())
+    return _instance
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Mock Doubao / Zhipu Servers
+豆包 / 智谱模拟服务
+
+Local aiohttp stand-ins for the Doubao STT (submit/query), Doubao TTS and
+Zhipu chat completion endpoints, with configurable injected latency, token
+rate and error rate. Used by the benchmark harness and tests.
+本地模拟豆包 STT/TTS 与智谱对话接口，可配置延迟、token 速率和错误率，用于压测与测试。
+"""
+
+import asyncio
+import base64
+import itertools
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from aiohttp import web
+from loguru import logger
+
+
+@dataclass
+class MockConfig:
+    """Behaviour of the mock upstream servers."""
+    stt_latency: float = 0.3  # Seconds from submit until the result is ready
+    tts_latency: float = 0.1  # Seconds before the TTS response
+    tts_latency_per_char: float = 0.005
+    llm_first_token_latency: float = 0.3
+    llm_token_rate: float = 50.0  # Tokens per second after the first token
+    llm_reply: str = "好的，我明白了。今天天气晴朗，适合出门散步。还有什么可以帮您的吗？"
+    transcript: str = "今天天气怎么样？"
+    audio_bytes_per_char: int = 600
+    error_rate: float = 0.0
+    seed: Optional[int] = None
+
+
+class MockUpstream:
+    """Runs the mock endpoints on a local port."""
+
+    STT_PATH = "/api/v3/auc/bigmodel/submit"
+    TTS_PATH = "/api/v3/tts"
+    TTS_STREAM_PATH = "/api/v3/tts/unidirectional"
+    CHAT_PATH = "/api/paas/v4/chat/completions"
+
+    def __init__(self, config: Optional[MockConfig] = None):
+        self.config = config or MockConfig()
+        self.base_url = ""
+        self.stats = {"stt_submit": 0, "stt_query": 0, "tts": 0, "tts_stream": 0, "chat": 0, "errors": 0}
+
+        self._random = random.Random(self.config.seed)
+        self._task_ids = itertools.count(1)
+        self._tasks: Dict[str, float] = {}
+        self.last_stt_audio: Optional[dict] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def stt_url(self) -> str:
+        return self.base_url + self.STT_PATH
+
+    @property
+    def tts_url(self) -> str:
+        return self.base_url + self.TTS_PATH
+
+    @property
+    def tts_stream_url(self) -> str:
+        return self.base_url + self.TTS_STREAM_PATH
+
+    @property
+    def llm_base_url(self) -> str:
+        return self.base_url + self.CHAT_PATH[:-len("/chat/completions")]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Start serving and return the base URL.
+        启动服务并返回基础 URL
+        """
+        app = web.Application()
+        app.router.add_post(self.STT_PATH, self._handle_stt)
+        app.router.add_post(self.TTS_PATH, self._handle_tts)
+        app.router.add_post(self.TTS_STREAM_PATH, self._handle_tts_stream)
+        app.router.add_post(self.CHAT_PATH, self._handle_chat)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{bound_port}"
+        logger.info(f"Mock upstream listening on {self.base_url}")
+        return self.base_url
+
+    async def stop(self) -> None:
+        """Stop serving."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _should_fail(self) -> bool:
+        if self.config.error_rate and self._random.random() < self.config.error_rate:
+            self.stats["errors"] += 1
+            return True
+        return False
+
+    async def _handle_stt(self, request: web.Request) -> web.Response:
+        """Submit and query share one URL, as in DoubaoSTTService."""
+        body = await request.json()
+        app = body.get("app", {})
+
+        if "audio" in app:
+            self.stats["stt_submit"] += 1
+            if "data" in app["audio"]:
+                # Inline audio: remember what was sent so tests can check it
+                self.last_stt_audio = dict(app["audio"], data=base64.b64decode(app["audio"]["data"]))
+            if self._should_fail():
+                return web.json_response({"code": "45000001", "message": "mock submit error"})
+            task_id = f"task-{next(self._task_ids)}"
+            self._tasks[task_id] = time.monotonic() + self.config.stt_latency
+            return web.json_response({"code": "20000000", "task_id": task_id})
+
+        self.stats["stt_query"] += 1
+        task_id = app.get("task")
+        ready_at = self._tasks.get(task_id)
+        if ready_at is None:
+            return web.json_response({"code": "45000002", "message": "unknown task"})
+        if time.monotonic() < ready_at:
+            return web.json_response({"code": "20000001", "message": "processing"})
+
+        # Finished tasks stay queryable, as upstream (resumed batch runs query them again)
+        text = self.config.transcript
+        return web.json_response({
+            "code": "20000000",
+            "result": {
+                "text": text,
+                "utterances": [{"text": text, "utterance": 0, "start_time": 0, "end_time": 1500}],
+            },
+        })
+
+    async def _handle_tts(self, request: web.Request) -> web.Response:
+        self.stats["tts"] += 1
+        body = await request.json()
+        text = body["request"]["text"]
+
+        await asyncio.sleep(self.config.tts_latency + self.config.tts_latency_per_char * len(text))
+        if self._should_fail():
+            return web.json_response({"code": "50000000", "message": "mock tts error"})
+
+        audio = b"\x00" * (self.config.audio_bytes_per_char * len(text))
+        return web.json_response({"code": "20000000", "data": base64.b64encode(audio).decode()})
+
+    async def _handle_tts_stream(self, request: web.Request) -> web.StreamResponse:
+        """Chunked JSON messages, one per character's worth of audio, then an end message."""
+        self.stats["tts_stream"] += 1
+        body = await request.json()
+        text = body["req_params"]["text"]
+
+        await asyncio.sleep(self.config.tts_latency)
+        if self._should_fail():
+            return web.json_response({"code": 50000000, "message": "mock tts error"})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        await response.prepare(request)
+        chunk = base64.b64encode(b"\x00" * self.config.audio_bytes_per_char).decode()
+        for _ in text:
+            await response.write(json.dumps({"code": 0, "message": "", "data": chunk}).encode() + b"\n")
+            if self.config.tts_latency_per_char:
+                await asyncio.sleep(self.config.tts_latency_per_char)
+        await response.write(json.dumps({"code": 20000000, "message": "OK", "data": None}).encode() + b"\n")
+        return response
+
+    async def _handle_chat(self, request: web.Request) -> web.StreamResponse:
+        self.stats["chat"] += 1
+        await request.json()
+
+        await asyncio.sleep(self.config.llm_first_token_latency)
+        if self._should_fail():
+            return web.json_response({"error": "mock llm error"}, status=500)
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        reply = self.config.llm_reply
+        interval = 1.0 / self.config.llm_token_rate if self.config.llm_token_rate else 0.0
+        # Roughly two characters per token
+        for i in range(0, len(reply), 2):
+            chunk = {"choices": [{"index": 0, "delta": {"content": reply[i:i + 2]}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if interval:
+                await asyncio.sleep(interval)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+
+async def main():
+    """Run the mock upstream standalone."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mock Doubao/Zhipu upstream servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    upstream = MockUpstream(MockConfig(error_rate=args.error_rate))
+    await upstream.start(args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await upstream.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,534 @@
+"""
+Event-Loop Profiling
+事件循环性能分析
+
+Every session shares one event loop, so one blocking call (a large JSON
+decode, a slow log sink, synchronous file I/O) stalls everyone's audio. This
+module finds those calls at runtime:
+
+- ``StallWatchdog``: a thread that notices when the loop stops running
+  callbacks for longer than a threshold and records the loop thread's stack
+  while it is still blocked.
+- ``profiled``: per-coroutine timing for service calls. Besides wall time it
+  measures busy time, i.e. time spent running Python between awaits, whose
+  largest single step is how long that call blocked the loop.
+- ``SamplingProfiler``: samples the loop thread's stack at a fixed rate and
+  aggregates collapsed stacks (``a;b;c count``), the input format of
+  flamegraph.pl, speedscope and similar tools.
+
+All three are off by default and can be switched on at runtime (see the
+/debug endpoints of metrics_server.MetricsServer).
+所有会话共用一个事件循环，任何阻塞调用都会卡住全部会话的音频。本模块提供：
+卡顿看门狗（记录阻塞时的调用栈）、协程级耗时统计（含单步最长阻塞时间）、
+可运行时开关的采样分析器（输出火焰图可用的折叠栈）。默认全部关闭。
+"""
+
+import asyncio
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from metrics import Histogram
+
+# Load environment variables
+load_dotenv()
+
+# Record a stall when the loop runs no callbacks for this long (0 = watchdog off)
+LOOP_STALL_MS = int(os.getenv("LOOP_STALL_MS", "0"))
+# Stalls kept with their stacks
+LOOP_STALL_HISTORY = int(os.getenv("LOOP_STALL_HISTORY", "20"))
+# Time @profiled service calls from startup (can also be toggled at runtime)
+PROFILE_COROUTINES = os.getenv("PROFILE_COROUTINES", "off").lower() == "on"
+PROFILER_HZ = int(os.getenv("PROFILER_HZ", "100"))
+# A sampling run stops by itself after this long
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "300"))
+
+STALL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STEP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Stack frames kept per stall record
+STALL_STACK_DEPTH = 30
+
+
+def _thread_frame(thread_id: int):
+    """Current frame of another thread, or None if it has exited."""
+    return sys._current_frames().get(thread_id)
+
+
+@dataclass
+class LoopStall:
+    """One period in which the event loop ran no callbacks."""
+    started_at: float
+    duration: float
+    # Loop thread stack when the stall was detected, outermost call first
+    stack: List[str] = field(default_factory=list)
+    ongoing: bool = True
+
+    def to_dict(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 1),
+            "ongoing": self.ongoing,
+            "stack": self.stack,
+        }
+
+
+class StallWatchdog:
+    """
+    Detects event-loop stalls from a separate thread and captures their stacks.
+    在独立线程中检测事件循环卡顿并记录调用栈
+
+    The loop stamps a heartbeat from a recurring callback. When the watchdog
+    thread sees no heartbeat for longer than the threshold, the loop is stuck
+    inside some callback; the loop thread's stack at that moment shows which.
+    A lag monitor on the loop itself only learns about a stall after it ends,
+    when the culprit is gone.
+    """
+
+    def __init__(self, threshold: float = LOOP_STALL_MS / 1000, history: int = LOOP_STALL_HISTORY):
+        """
+        Args:
+            threshold: Seconds without a heartbeat that count as a stall (0 = disabled)
+            history: Most recent stalls kept with their stacks
+        """
+        self.threshold = threshold
+        # Beat often enough that a normal beat gap is well under the threshold
+        self.interval = min(threshold / 2, 0.05) if threshold > 0 else 0.05
+        self.durations = Histogram("event_loop_stall", buckets=STALL_BUCKETS)
+        self.stalls: deque = deque(maxlen=history)
+        self.total = 0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._last_beat = 0.0
+        self._beat_handle: Optional[asyncio.TimerHandle] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        """Start watching the running loop; a no-op when disabled or already running."""
+        if self.threshold <= 0 or self._thread is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-stall-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Event loop stall watchdog started ({self.threshold * 1000:.0f}ms threshold)")
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self._beat_handle is not None:
+            self._beat_handle.cancel()
+            self._beat_handle = None
+
+    def get_stalls(self) -> List[dict]:
+        """Recent stalls, newest last."""
+        with self._lock:
+            return [stall.to_dict() for stall in self.stalls]
+
+    def get_stats(self) -> dict:
+        return {
+            "running": self.running,
+            "threshold_ms": round(self.threshold * 1000),
+            "stalls": self.total,
+            "duration": self.durations.summary(),
+        }
+
+    def _beat(self) -> None:
+        self._last_beat = time.monotonic()
+        self._beat_handle = self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self) -> None:
+        stall: Optional[LoopStall] = None
+        stalled_beat = 0.0
+        logged_ongoing = False
+        while not self._stop.wait(self.interval):
+            beat = self._last_beat
+            # Time the loop has been unable to run the next heartbeat
+            blocked = time.monotonic() - beat - self.interval
+
+            if stall is not None and beat != stalled_beat:
+                # The loop caught up; the gap between beats is the stall
+                stall.duration = max(stall.duration, beat - stalled_beat - self.interval)
+                stall.ongoing = False
+                self.durations.observe(stall.duration)
+                logger.warning(
+                    f"Event loop stalled for {stall.duration * 1000:.0f}ms in: "
+                    f"{stall.stack[-1].strip() if stall.stack else 'unknown'}"
+                )
+                stall = None
+                continue
+
+            if stall is None and blocked > self.threshold:
+                frame = _thread_frame(self._loop_thread)
+                stack = traceback.format_list(traceback.extract_stack(frame, limit=STALL_STACK_DEPTH)) if frame else []
+                stall = LoopStall(
+                    started_at=time.time() - blocked,
+                    duration=blocked,
+                    stack=[line.rstrip() for line in stack],
+                )
+                stalled_beat = beat
+                logged_ongoing = False
+                with self._lock:
+                    self.stalls.append(stall)
+                    self.total += 1
+            elif stall is not None:
+                stall.duration = blocked
+                # Nothing on the loop can report a stall that never ends; say so from here
+                if not logged_ongoing and blocked > 1.0:
+                    logged_ongoing = True
+                    logger.error("Event loop blocked for over 1s:\n" + "\n".join(stall.stack[-5:]))
+
+
+class CoroutineStats:
+    """Timing of one profiled coroutine function."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.wall = Histogram(f"{name}_wall")
+        self.max_step = Histogram(f"{name}_max_step", buckets=STEP_BUCKETS)
+        self.calls = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.busy = 0.0
+        self.worst_step = 0.0
+
+    def get_stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+            "busy_seconds": round(self.busy, 6),
+            "worst_step_ms": round(self.worst_step * 1000, 3),
+            "wall": self.wall.summary(),
+            "max_step": self.max_step.summary(),
+        }
+
+
+class _Call:
+    """Busy time of one call, summed over every await resumption."""
+    __slots__ = ("busy", "max_step")
+
+    def __init__(self):
+        self.busy = 0.0
+        self.max_step = 0.0
+
+    def step(self, elapsed: float) -> None:
+        self.busy += elapsed
+        if elapsed > self.max_step:
+            self.max_step = elapsed
+
+
+def _drive(coro, call: _Call):
+    """
+    Run a coroutine to completion, timing each step between awaits.
+
+    Used as an ``__await__`` generator: whatever the coroutine yields (futures
+    for the task to wait on) is passed straight through to the task.
+    """
+    value, error = None, None
+    while True:
+        start = time.perf_counter()
+        try:
+            yielded = coro.send(value) if error is None else coro.throw(error)
+        except StopIteration as stop:
+            call.step(time.perf_counter() - start)
+            return stop.value
+        except BaseException:
+            call.step(time.perf_counter() - start)
+            raise
+        call.step(time.perf_counter() - start)
+        try:
+            value, error = (yield yielded), None
+        except BaseException as e:
+            value, error = None, e
+
+
+class _Timed:
+    __slots__ = ("coro", "call")
+
+    def __init__(self, coro, call: _Call):
+        self.coro = coro
+        self.call = call
+
+    def __await__(self):
+        return _drive(self.coro, self.call)
+
+
+class CoroutineProfiler:
+    """
+    Per-coroutine wall and busy time for functions decorated with ``profiled``.
+    被 profiled 装饰的协程的总耗时与占用事件循环的时间
+    """
+
+    def __init__(self, enabled: bool = PROFILE_COROUTINES):
+        self.enabled = enabled
+        self.functions: Dict[str, CoroutineStats] = {}
+
+    def get(self, name: str) -> CoroutineStats:
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = CoroutineStats(name)
+        return stats
+
+    async def run(self, name: str, coro):
+        """Await a coroutine, recording its timing under ``name``."""
+        stats = self.get(name)
+        call = _Call()
+        stats.calls += 1
+        start = time.perf_counter()
+        try:
+            return await _Timed(coro, call)
+        except asyncio.CancelledError:
+            stats.cancelled += 1
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            self._record(stats, call, time.perf_counter() - start)
+
+    async def run_generator(self, name: str, agen):
+        """Iterate an async generator, recording the whole iteration as one call."""
+        stats = self.get(name)
+        call = _Call()
+        stats.calls += 1
+        start = time.perf_counter()
+        try:
+            while True:
+                try:
+                    item = await _Timed(agen.__anext__(), call)
+                except StopAsyncIteration:
+                    break
+                yield item
+        except (asyncio.CancelledError, GeneratorExit):
+            stats.cancelled += 1
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            await agen.aclose()
+            self._record(stats, call, time.perf_counter() - start)
+
+    def reset(self) -> None:
+        self.functions.clear()
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "functions": {name: stats.get_stats() for name, stats in sorted(self.functions.items())},
+        }
+
+    @staticmethod
+    def _record(stats: CoroutineStats, call: _Call, wall: float) -> None:
+        stats.busy += call.busy
+        stats.worst_step = max(stats.worst_step, call.max_step)
+        stats.wall.observe(wall)
+        stats.max_step.observe(call.max_step)
+
+
+def profiled(name: str):
+    """
+    Time a coroutine or async generator function while coroutine profiling is on.
+    在开启协程分析时统计被装饰函数的耗时
+
+    When profiling is off a coroutine call costs one attribute check, and an
+    async generator function returns the original generator unwrapped, so
+    per-item hot paths (LLM token streams) pay nothing.
+
+    Example:
+        @profiled("doubao_tts.synthesize")
+        async def synthesize(self, text, ...): ...
+    """
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                # Checked once per call; only profiled streams get the timing wrapper
+                agen = func(*args, **kwargs)
+                profiler = get_coroutine_profiler()
+                if not profiler.enabled:
+                    return agen
+                return profiler.run_generator(name, agen)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            profiler = get_coroutine_profiler()
+            if not profiler.enabled:
+                return await func(*args, **kwargs)
+            return await profiler.run(name, func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+class SamplingProfiler:
+    """
+    Samples the event-loop thread's stack and aggregates collapsed stacks.
+    对事件循环线程做栈采样并聚合为折叠栈（火焰图格式）
+
+    Sampling runs in a separate thread, so it also sees code that blocks the
+    loop. Samples where the loop is idle in ``select()`` are counted but left
+    out of the stacks unless ``include_idle`` is set.
+    """
+
+    def __init__(self, hz: int = PROFILER_HZ, max_seconds: float = PROFILER_MAX_SECONDS):
+        self.hz = hz
+        self.max_seconds = max_seconds
+        self.include_idle = False
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+
+        self._loop_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # Code object -> frame label, so each sample only formats new functions
+        self._labels: Dict[object, str] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(
+        self,
+        hz: Optional[int] = None,
+        max_seconds: Optional[float] = None,
+        include_idle: bool = False,
+        thread_id: Optional[int] = None,
+    ) -> None:
+        """
+        Start a new sampling run, discarding the previous one.
+        开始新一轮采样（丢弃上一轮结果）
+
+        Args:
+            hz: Samples per second
+            max_seconds: Stop automatically after this long
+            include_idle: Keep samples where the loop is waiting in select()
+            thread_id: Thread to sample (default: the calling thread, i.e. the loop)
+        """
+        if self._thread is not None:
+            self.stop()
+        self.hz = hz or self.hz
+        self.max_seconds = max_seconds or self.max_seconds
+        self.include_idle = include_idle
+        with self._lock:
+            self.stacks.clear()
+            self.samples = self.idle_samples = 0
+        self._loop_thread = thread_id or threading.get_ident()
+        self.started_at, self.stopped_at = time.time(), None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name="loop-sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.info(f"Sampling profiler started at {self.hz}Hz for up to {self.max_seconds:.0f}s")
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+        logger.info(f"Sampling profiler stopped after {self.samples} samples")
+
+    def collapsed(self) -> str:
+        """Stacks so far in collapsed format: ``outer;inner count`` per line, hottest first."""
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def get_stats(self) -> dict:
+        end = self.stopped_at or time.time()
+        return {
+            "running": self.running,
+            "hz": self.hz,
+            "samples": self.samples,
+            "idle_samples": self.idle_samples,
+            "unique_stacks": len(self.stacks),
+            "seconds": round(end - self.started_at, 1) if self.started_at else 0.0,
+        }
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _sample(self) -> None:
+        interval = 1.0 / self.hz
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(interval):
+            frame = _thread_frame(self._loop_thread)
+            if frame is None:
+                break
+            idle = frame.f_code.co_filename.endswith("selectors.py")
+            labels = []
+            while frame is not None:
+                labels.append(self._label(frame.f_code))
+                frame = frame.f_back
+            with self._lock:
+                self.samples += 1
+                if idle:
+                    self.idle_samples += 1
+                if not idle or self.include_idle:
+                    self.stacks[";".join(reversed(labels))] += 1
+            if time.monotonic() > deadline:
+                logger.info("Sampling profiler reached its time limit")
+                break
+        self.stopped_at = time.time()
+        if not self._stop.is_set():
+            # Stopped on its own: let running report False
+            self._thread = None
+
+
+# Singleton instances
+_watchdog: Optional[StallWatchdog] = None
+_coroutines: Optional[CoroutineProfiler] = None
+_sampler: Optional[SamplingProfiler] = None
+
+
+def get_watchdog() -> StallWatchdog:
+    """Get or create the process-wide stall watchdog."""
+    global _watchdog
+    if _watchdog is None:
+        _watchdog = StallWatchdog()
+    return _watchdog
+
+
+def get_coroutine_profiler() -> CoroutineProfiler:
+    """Get or create the process-wide coroutine profiler."""
+    global _coroutines
+    if _coroutines is None:
+        _coroutines = CoroutineProfiler()
+    return _coroutines
+
+
+def get_sampler() -> SamplingProfiler:
+    """Get or create the process-wide sampling profiler."""
+    global _sampler
+    if _sampler is None:
+        _sampler = SamplingProfiler()
+    return _sampler
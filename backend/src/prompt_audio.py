@@ -0,0 +1,222 @@
+"""
+Prefetched Greeting and Filler Audio
+预取的问候语与填充语音
+
+Greetings and short "thinking" fillers are synthesized per voice when the
+server starts and kept in memory, so a greeting plays the moment a
+participant connects and a filler can cover a slow LLM first token without a
+TTS round trip. Clips are re-synthesized in the background at a fixed
+interval; until a refresh succeeds the previous audio stays in use.
+服务启动时按音色预合成问候语与“思考中”填充语并常驻内存：用户接入即播放问候，
+LLM 首字过慢时插入填充语，无需等待 TTS；后台定期刷新，失败时沿用旧音频。
+"""
+
+import asyncio
+import itertools
+import os
+import random
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from rate_limiter import PRIORITY_PREWARM, request_priority
+
+# Load environment variables
+load_dotenv()
+
+# Phrases are separated by "|"
+GREETING_PHRASES = os.getenv("GREETING_PHRASES", "你好，我是你的语音助手，有什么可以帮你的吗？")
+FILLER_PHRASES = os.getenv("FILLER_PHRASES", "嗯，|好的，|稍等，我想一想。")
+# Comma-separated voices prefetched at start; other voices are fetched on first use
+PROMPT_AUDIO_VOICES = os.getenv("PROMPT_AUDIO_VOICES", "zh_female_qingxin")
+# Seconds between background re-synthesis (0 = never refresh)
+PROMPT_AUDIO_REFRESH = float(os.getenv("PROMPT_AUDIO_REFRESH", "21600"))
+# LLM first-token wait after which a filler is played (0 = never)
+FILLER_AFTER_MS = int(os.getenv("FILLER_AFTER_MS", "1200"))
+
+KIND_GREETING = "greeting"
+KIND_FILLER = "filler"
+
+
+def split_phrases(value: str) -> List[str]:
+    """Split a "|"-separated phrase list, dropping blanks."""
+    return [phrase.strip() for phrase in value.split("|") if phrase.strip()]
+
+
+@dataclass
+class PromptClip:
+    """One prefetched phrase and its synthesized audio."""
+    kind: str
+    voice: str
+    text: str
+    audio: bytes
+
+
+class PromptAudioLibrary:
+    """
+    In-memory greeting and filler clips per voice, refreshed in the background.
+    按音色常驻内存的问候语与填充语音，后台定期刷新
+    """
+
+    def __init__(
+        self,
+        tts=None,
+        greetings: Optional[Iterable[str]] = None,
+        fillers: Optional[Iterable[str]] = None,
+        voices: Optional[Iterable[str]] = None,
+        refresh_interval: float = PROMPT_AUDIO_REFRESH,
+        max_concurrency: int = 4,
+    ):
+        """
+        Args:
+            tts: TTS service exposing ``async synthesize(text, voice, use_cache=...)``
+                (default: the shared DoubaoTTSService)
+            greetings: Greeting phrases (default: GREETING_PHRASES)
+            fillers: Filler phrases (default: FILLER_PHRASES)
+            voices: Voices to prefetch at start (default: PROMPT_AUDIO_VOICES)
+            refresh_interval: Seconds between background refreshes (0 = never)
+            max_concurrency: Max concurrent synthesis requests while fetching
+        """
+        if tts is None:
+            from doubao_tts import get_service as get_tts_service
+            tts = get_tts_service()
+        self.tts = tts
+        self.phrases = {
+            KIND_GREETING: list(greetings) if greetings is not None else split_phrases(GREETING_PHRASES),
+            KIND_FILLER: list(fillers) if fillers is not None else split_phrases(FILLER_PHRASES),
+        }
+        self.voices = list(voices) if voices is not None else split_phrases(PROMPT_AUDIO_VOICES.replace(",", "|"))
+        self.refresh_interval = refresh_interval
+        self.max_concurrency = max_concurrency
+
+        self._clips: Dict[Tuple[str, str], List[PromptClip]] = {}
+        # Round-robin per (kind, voice) so consecutive fillers differ
+        self._rotation: Dict[Tuple[str, str], itertools.cycle] = {}
+        self._fetching: Dict[str, asyncio.Task] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._starting: Optional[asyncio.Future] = None
+        self._stats = {"hits": 0, "misses": 0, "fetched": 0, "failed": 0, "refreshes": 0}
+
+    async def start(self) -> None:
+        """Prefetch every configured voice and start background refresh; every room may call it."""
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._start())
+        # Rooms starting together share one prefetch
+        await asyncio.shield(self._starting)
+
+    async def _start(self) -> None:
+        await asyncio.gather(*(self._fetch_in_background(voice) for voice in self.voices))
+        if self.refresh_interval > 0:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        """Stop background refresh and any voice still being fetched."""
+        tasks = [task for task in [self._starting, self._refresh_task, *self._fetching.values()] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._starting = self._refresh_task = None
+        self._fetching.clear()
+
+    def greeting(self, voice: str) -> Optional[PromptClip]:
+        """A greeting clip for the voice, or None if none is ready (it is then fetched)."""
+        return self._pick(KIND_GREETING, voice)
+
+    def filler(self, voice: str) -> Optional[PromptClip]:
+        """The next filler clip for the voice, or None if none is ready (it is then fetched)."""
+        return self._pick(KIND_FILLER, voice)
+
+    async def fetch_voice(self, voice: str, refresh: bool = False) -> int:
+        """
+        Synthesize every phrase for a voice and swap the new clips in.
+        为某个音色合成全部短语并替换旧音频
+
+        Args:
+            voice: Voice type
+            refresh: Bypass the TTS cache so updated voices are picked up
+
+        Returns:
+            Number of clips synthesized
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch(kind: str, text: str) -> Optional[PromptClip]:
+            # Queued behind live turns at the upstream limiter
+            with request_priority(PRIORITY_PREWARM):
+                async with semaphore:
+                    try:
+                        audio = await self.tts.synthesize(text, voice=voice, use_cache=not refresh)
+                    except Exception as e:
+                        self._stats["failed"] += 1
+                        logger.warning(f"Prompt audio fetch failed for '{text}' ({voice}): {e}")
+                        return None
+            return PromptClip(kind, voice, text, audio)
+
+        jobs = [(kind, text) for kind, phrases in self.phrases.items() for text in phrases]
+        clips = await asyncio.gather(*(fetch(kind, text) for kind, text in jobs))
+        fetched = 0
+        for kind in self.phrases:
+            ready = [clip for clip in clips if clip is not None and clip.kind == kind]
+            # A failed refresh keeps the previous clips
+            if ready:
+                self._clips[(kind, voice)] = ready
+                self._rotation[(kind, voice)] = itertools.cycle(random.sample(ready, len(ready)))
+                fetched += len(ready)
+        self._stats["fetched"] += fetched
+        logger.info(f"Prompt audio ready for voice {voice}: {fetched}/{len(jobs)} clips")
+        return fetched
+
+    def get_stats(self) -> dict:
+        return {
+            **self._stats,
+            "voices": sorted({voice for _, voice in self._clips}),
+            "clips": sum(len(clips) for clips in self._clips.values()),
+            "bytes": sum(len(clip.audio) for clips in self._clips.values() for clip in clips),
+        }
+
+    def _pick(self, kind: str, voice: str) -> Optional[PromptClip]:
+        rotation = self._rotation.get((kind, voice))
+        if rotation is not None:
+            self._stats["hits"] += 1
+            return next(rotation)
+        self._stats["misses"] += 1
+        # A voice nobody configured: fetch it for the next session
+        if self.phrases[kind]:
+            try:
+                self._fetch_in_background(voice)
+            except RuntimeError:
+                pass  # No running loop
+        return None
+
+    def _fetch_in_background(self, voice: str) -> asyncio.Future:
+        task = self._fetching.get(voice)
+        if task is None:
+            loop = asyncio.get_running_loop()
+            task = loop.create_task(self.fetch_voice(voice))
+            self._fetching[voice] = task
+            task.add_done_callback(lambda _: self._fetching.pop(voice, None))
+        return task
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            for voice in sorted({voice for _, voice in self._clips}):
+                try:
+                    await self.fetch_voice(voice, refresh=True)
+                except Exception as e:
+                    logger.warning(f"Prompt audio refresh failed for voice {voice}: {e}")
+            self._stats["refreshes"] += 1
+
+
+# Global library instance
+_instance: Optional[PromptAudioLibrary] = None
+
+
+def get_prompt_audio() -> PromptAudioLibrary:
+    """Get or create the process-wide prompt audio library."""
+    global _instance
+    if _instance is None:
+        _instance = PromptAudioLibrary()
+    return _instance
@@ -0,0 +1,273 @@
+"""
+Upstream Rate Limiter
+上游限流与请求调度
+
+One shared limiter per upstream resource (``volc.bigasr.auc``, ``volc.tts``,
+chat completions, ...) combining a token bucket (QPS) with a concurrency
+cap, so bursts queue locally instead of producing 429s. Waiters are served
+by priority class (live turns before pre-warming before batch jobs) and
+round-robin across sessions within a class, so one busy session cannot
+starve the others.
+每个上游资源一个共享限流器：令牌桶（QPS）+ 并发上限，突发请求在本地排队而非触发 429。
+按优先级（实时对话 > 预热 > 批处理）调度，同一优先级内按会话轮转，保证公平。
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from metrics import Histogram, current_turn
+
+# Load environment variables
+load_dotenv()
+
+# resource=qps:concurrency pairs; 0 means unlimited
+RATE_LIMITS = os.getenv(
+    "RATE_LIMITS",
+    "volc.bigasr.auc=20:50,volc.tts=20:10,volc.service_type.10029=20:10,chat=10:20",
+)
+
+RESOURCE_STT = "volc.bigasr.auc"
+RESOURCE_TTS = "volc.tts"
+RESOURCE_CHAT = "chat"
+
+PRIORITY_LIVE = 0
+PRIORITY_PREWARM = 1
+PRIORITY_BATCH = 2
+PRIORITY_NAMES = {PRIORITY_LIVE: "live", PRIORITY_PREWARM: "prewarm", PRIORITY_BATCH: "batch"}
+
+# Priority of upstream requests made by the current task
+current_priority: ContextVar[int] = ContextVar("current_priority", default=PRIORITY_LIVE)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """
+    Run the enclosed upstream calls at ``priority``.
+    以指定优先级执行其中的上游请求
+    """
+    token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, int]]:
+    """Parse ``resource=qps:concurrency,...`` into {resource: (qps, concurrency)}."""
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        resource, _, values = item.strip().partition("=")
+        qps, _, concurrency = values.partition(":")
+        limits[resource.strip()] = (float(qps or 0), int(concurrency or 0))
+    return limits
+
+
+class UpstreamLimiter:
+    """Token bucket + concurrency limit with priority classes and per-session fair queuing."""
+
+    def __init__(self, name: str, qps: float = 0, max_concurrency: int = 0, burst: Optional[float] = None):
+        """Initialize limiter.
+
+        Args:
+            name: Upstream resource name (for logs and metrics)
+            qps: Sustained requests per second (0 = unlimited)
+            max_concurrency: Max requests in flight (0 = unlimited)
+            burst: Bucket size (default: one second of ``qps``)
+        """
+        self.name = name
+        self.qps = qps
+        self.max_concurrency = max_concurrency
+        self.burst = burst if burst is not None else max(1.0, qps)
+
+        self.active = 0
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        # priority -> session -> waiters; OrderedDict order is the round-robin order
+        self._queues: Dict[int, "OrderedDict[str, Deque[asyncio.Future]]"] = {}
+        self._waiting = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wait = Histogram(f"{name}_queue_wait")
+        self._stats = {"granted": 0, "queued": 0, "cancelled": 0, "max_queue_depth": 0}
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[int] = None, session: Optional[str] = None):
+        """
+        Hold one request slot for the enclosed upstream call.
+        在上游请求期间占用一个名额
+        """
+        await self.acquire(priority, session)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: Optional[int] = None, session: Optional[str] = None) -> None:
+        """
+        Wait until a request may be sent.
+        等待直到允许发送请求
+
+        Args:
+            priority: Priority class (default: ``current_priority``)
+            session: Fair-queuing key (default: the session of the current turn)
+        """
+        if priority is None:
+            priority = current_priority.get()
+        if session is None:
+            turn = current_turn.get()
+            session = turn.session_id if turn is not None else ""
+
+        # Fast path only when nobody is queued, so waiters are never overtaken
+        if not self._waiting and self._has_capacity():
+            self._grant()
+            self.wait.observe(0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(priority, OrderedDict()).setdefault(session, deque()).append(future)
+        self._waiting += 1
+        self._stats["queued"] += 1
+        self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._waiting)
+        queued_at = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before the cancellation landed
+                self.release()
+            else:
+                self._stats["cancelled"] += 1
+                self._remove_waiter(priority, session, future)
+            raise
+        self.wait.observe(time.monotonic() - queued_at)
+
+    def release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def queue_depth(self) -> Dict[str, int]:
+        """Waiting requests per priority class."""
+        return {
+            PRIORITY_NAMES.get(priority, str(priority)): sum(len(waiters) for waiters in sessions.values())
+            for priority, sessions in sorted(self._queues.items())
+        }
+
+    def get_stats(self) -> dict:
+        """Get limits, in-flight count, queue depths and queue wait percentiles."""
+        stats = dict(self._stats)
+        stats.update({
+            "qps": self.qps,
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": self._waiting,
+            "queue_depth": self.queue_depth(),
+            "wait": self.wait.summary(),
+        })
+        return stats
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self.qps > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.qps)
+        self._refilled_at = now
+
+    def _has_capacity(self) -> bool:
+        if self.max_concurrency and self.active >= self.max_concurrency:
+            return False
+        if self.qps <= 0:
+            return True
+        self._refill()
+        return self._tokens >= 1.0
+
+    def _grant(self) -> None:
+        self.active += 1
+        if self.qps > 0:
+            self._tokens -= 1.0
+        self._stats["granted"] += 1
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            while sessions:
+                session, waiters = next(iter(sessions.items()))
+                future = waiters.popleft()
+                self._waiting -= 1
+                if waiters:
+                    # This session goes to the back of its class
+                    sessions.move_to_end(session)
+                else:
+                    del sessions[session]
+                if not future.done():
+                    return future
+            del self._queues[priority]
+        return None
+
+    def _remove_waiter(self, priority: int, session: str, future: asyncio.Future) -> None:
+        sessions = self._queues.get(priority, {})
+        waiters = sessions.get(session)
+        if waiters is None or future not in waiters:
+            return
+        waiters.remove(future)
+        self._waiting -= 1
+        if not waiters:
+            del sessions[session]
+
+    def _dispatch(self) -> None:
+        while self._waiting and self._has_capacity():
+            future = self._next_waiter()
+            if future is None:
+                break
+            self._grant()
+            future.set_result(None)
+
+        loop = asyncio.get_running_loop()
+        if self._timer is not None and self._timer_loop is not loop:
+            # Left over from a loop that has since stopped
+            self._timer = None
+        if self._waiting and self._timer is None and self.qps > 0 and (
+            not self.max_concurrency or self.active < self.max_concurrency
+        ):
+            # Out of tokens: wake up when the next one is available
+            delay = max(0.0, (1.0 - self._tokens) / self.qps)
+            self._timer = loop.call_later(delay, self._on_timer)
+            self._timer_loop = loop
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+
+_limiters: Dict[str, UpstreamLimiter] = {}
+
+
+def get_limiter(resource: str) -> UpstreamLimiter:
+    """
+    Get or create the shared limiter for an upstream resource.
+    获取（或创建）上游资源对应的共享限流器
+
+    Resources missing from RATE_LIMITS get an unlimited limiter, which still
+    reports traffic.
+    """
+    limiter = _limiters.get(resource)
+    if limiter is None:
+        qps, concurrency = parse_limits(RATE_LIMITS).get(resource, (0, 0))
+        limiter = UpstreamLimiter(resource, qps=qps, max_concurrency=concurrency)
+        _limiters[resource] = limiter
+        logger.info(f"Rate limiter for {resource}: qps={qps or 'unlimited'}, concurrency={concurrency or 'unlimited'}")
+    return limiter
+
+
+def get_stats() -> Dict[str, dict]:
+    """Stats of every limiter created so far."""
+    return {resource: limiter.get_stats() for resource, limiter in _limiters.items()}
@@ -0,0 +1,233 @@
+"""
+LLM Response Cache
+LLM 回复缓存
+
+Caches complete LLM replies keyed on the normalized user transcript (see
+text_normalization.py), scoped by the prompt sent ahead of it (system prompt,
+summary and conversation history), with TTL and LRU eviction. A follow-up
+such as "它多少钱？" therefore only hits for an identical conversation, never
+with a reply written for another caller's context.
+An optional local similarity lookup (hashed character n-gram vectors, cosine
+similarity in NumPy) also matches rephrasings of a cached question. A hit
+replays the reply through the normal TTS path, where its sentences are
+already in the TTS cache, so it costs no upstream time at all.
+以归一化后的用户文本为键缓存完整回复（按系统提示词与对话历史隔离），支持 TTL 与 LRU 淘汰；
+可选本地相似度匹配（字符 n-gram 哈希向量 + 余弦相似度）。命中后回复经 TTS 缓存播放，无上游开销。
+"""
+
+import hashlib
+import json
+import os
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from loguru import logger
+
+from text_normalization import normalize_text
+
+# Load environment variables
+load_dotenv()
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+# Shorter questions ("然后呢") depend on context and are never cached
+RESPONSE_CACHE_MIN_CHARS = int(os.getenv("RESPONSE_CACHE_MIN_CHARS", "4"))
+# Cosine similarity for the n-gram lookup; 0 disables it
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+
+EMBEDDING_DIM = 512
+
+
+def embed(normalized: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """
+    Hashed character unigram + bigram vector, L2-normalized.
+    字符一元/二元组哈希向量（L2 归一化）
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    grams = list(normalized) + [normalized[i:i + 2] for i in range(len(normalized) - 1)]
+    if not grams:
+        return vector
+    indices = np.fromiter((zlib.crc32(g.encode("utf-8")) % dim for g in grams), dtype=np.int64, count=len(grams))
+    np.add.at(vector, indices, 1.0)
+    return vector / np.linalg.norm(vector)
+
+
+@dataclass
+class CachedResponse:
+    """A cached reply."""
+    question: str
+    normalized: str
+    reply: str
+    scope: str
+    expires_at: float
+    slot: int = -1
+
+
+class ResponseCache:
+    """Normalized-text LLM reply cache with TTL, LRU bound and optional similarity lookup."""
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        ttl: float = RESPONSE_CACHE_TTL,
+        min_chars: int = RESPONSE_CACHE_MIN_CHARS,
+        similarity: float = RESPONSE_CACHE_SIMILARITY,
+        enabled: bool = RESPONSE_CACHE_ENABLED,
+    ):
+        """Initialize the cache.
+
+        Args:
+            max_entries: Entries kept before least-recently-used eviction
+            ttl: Seconds a reply stays valid
+            min_chars: Minimum normalized question length to cache
+            similarity: Cosine threshold for the n-gram lookup (0 disables it)
+            enabled: Master switch
+        """
+        if enabled and max_entries <= 0:
+            logger.warning(f"Response cache disabled: max_entries is {max_entries}")
+            enabled = False
+        max_entries = max(max_entries, 0)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_chars = min_chars
+        self.similarity = similarity
+        self.enabled = enabled
+
+        self._entries: "OrderedDict[tuple, CachedResponse]" = OrderedDict()
+        # Preallocated embedding matrix; one row per entry slot
+        self._vectors = np.zeros((max_entries, EMBEDDING_DIM), dtype=np.float32) if similarity else None
+        self._slot_keys: Dict[int, tuple] = {}
+        self._free_slots: List[int] = list(range(max_entries - 1, -1, -1)) if similarity else []
+        self._stats = {"hits": 0, "similar_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    @staticmethod
+    def scope_for(system_prompt: Optional[str], history: Optional[List[dict]] = None) -> str:
+        """
+        Replies are only shared between sessions with the same system prompt and
+        the same messages ahead of the question (in practice: first turns).
+
+        Args:
+            system_prompt: Session system prompt
+            history: Messages sent before the user question, e.g. ``context.build()``
+        """
+        digest = hashlib.sha256((system_prompt or "").encode("utf-8"))
+        if history:
+            digest.update(json.dumps(history, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()[:16]
+
+    def get(self, question: str, scope: str = "") -> Optional[str]:
+        """
+        Look up a reply for a user question.
+        查询用户问题的缓存回复
+
+        Returns:
+            The cached reply, or None
+        """
+        if not self.enabled:
+            return None
+        normalized = normalize_text(question)
+        if len(normalized) < self.min_chars:
+            return None
+
+        key = (scope, normalized)
+        entry = self._entries.get(key)
+        if entry is not None and self._expired(key, entry):
+            entry = None
+
+        if entry is None and self._vectors is not None:
+            entry = self._similar(normalized, scope)
+            if entry is not None:
+                self._stats["similar_hits"] += 1
+                logger.debug(f"Response cache similarity hit: '{question}' ~ '{entry.question}'")
+                self._entries.move_to_end((entry.scope, entry.normalized))
+                return entry.reply
+
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+
+        self._stats["hits"] += 1
+        self._entries.move_to_end(key)
+        return entry.reply
+
+    def put(self, question: str, reply: str, scope: str = "") -> None:
+        """Store a completed reply."""
+        if not self.enabled or not reply:
+            return
+        normalized = normalize_text(question)
+        if len(normalized) < self.min_chars:
+            return
+
+        key = (scope, normalized)
+        if key in self._entries:
+            self._remove(key)
+        while len(self._entries) >= self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+        entry = CachedResponse(
+            question=question, normalized=normalized, reply=reply, scope=scope,
+            expires_at=time.monotonic() + self.ttl,
+        )
+        if self._vectors is not None:
+            entry.slot = self._free_slots.pop()
+            self._vectors[entry.slot] = embed(normalized)
+            self._slot_keys[entry.slot] = key
+        self._entries[key] = entry
+
+    def clear(self) -> None:
+        for key in list(self._entries):
+            self._remove(key)
+
+    def get_stats(self) -> dict:
+        """Get hit/miss/eviction counters."""
+        stats = dict(self._stats)
+        lookups = stats["hits"] + stats["similar_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["similar_hits"]) / lookups if lookups else 0.0
+        stats["entries"] = len(self._entries)
+        return stats
+
+    def _similar(self, normalized: str, scope: str) -> Optional[CachedResponse]:
+        if not self._slot_keys:
+            return None
+        slots = np.fromiter(self._slot_keys, dtype=np.int64, count=len(self._slot_keys))
+        scores = self._vectors[slots] @ embed(normalized)
+        for index in np.argsort(scores)[::-1]:
+            if scores[index] < self.similarity:
+                return None
+            key = self._slot_keys[int(slots[index])]
+            entry = self._entries[key]
+            if entry.scope == scope and not self._expired(key, entry):
+                return entry
+        return None
+
+    def _expired(self, key: tuple, entry: CachedResponse) -> bool:
+        if entry.expires_at > time.monotonic():
+            return False
+        self._remove(key)
+        self._stats["expirations"] += 1
+        return True
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key)
+        if entry.slot >= 0:
+            del self._slot_keys[entry.slot]
+            self._free_slots.append(entry.slot)
+
+
+# Singleton instance
+_instance = None
+
+
+def get_response_cache() -> "ResponseCache":
+    """Get or create the singleton instance of ResponseCache."""
+    global _instance
+    if _instance is None:
+        _instance = ResponseCache()
+    return _instance
@@ -0,0 +1,270 @@
+"""
+Task Result Poller
+任务结果轮询器
+
+A single scheduler that waits on many asynchronous recognition tasks at once,
+polling each with an adaptive interval (fast at first, exponential backoff
+afterwards) until it completes, fails or passes its deadline.
+单个调度器同时等待多个异步任务：先快速轮询，之后指数退避，直到完成、失败或超时。
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from dotenv import load_dotenv
+from loguru import logger
+
+# Load environment variables
+load_dotenv()
+
+POLL_INITIAL_INTERVAL = float(os.getenv("POLL_INITIAL_INTERVAL", "0.2"))
+POLL_FAST_POLLS = int(os.getenv("POLL_FAST_POLLS", "3"))
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "2.0"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "5.0"))
+POLL_DEADLINE = float(os.getenv("POLL_DEADLINE", "60.0"))
+POLL_MAX_CONCURRENCY = int(os.getenv("POLL_MAX_CONCURRENCY", "16"))
+
+
+class TaskPendingError(Exception):
+    """Raised by a fetch function when the task has not finished yet."""
+
+
+@dataclass
+class _PollEntry:
+    """Scheduling state for one awaited task."""
+    task_id: str
+    future: asyncio.Future
+    deadline: float
+    due: float
+    polls: int = 0
+    queue_wait: float = 0.0
+
+
+@dataclass
+class PollerStats:
+    """Counters describing poller behaviour."""
+    completed: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    cancelled: int = 0
+    total_polls: int = 0
+    finished_polls: int = 0
+    max_polls: int = 0
+    total_queue_wait: float = 0.0
+    max_queue_wait: float = 0.0
+
+
+class ResultPoller:
+    """Adaptive, deadline-bounded poller shared by every waiting task."""
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Awaitable[Any]],
+        initial_interval: float = POLL_INITIAL_INTERVAL,
+        fast_polls: int = POLL_FAST_POLLS,
+        backoff: float = POLL_BACKOFF,
+        max_interval: float = POLL_MAX_INTERVAL,
+        deadline: float = POLL_DEADLINE,
+        max_concurrency: int = POLL_MAX_CONCURRENCY,
+    ):
+        """Initialize the poller.
+
+        Args:
+            fetch: Coroutine returning the task result or raising TaskPendingError
+            initial_interval: Seconds between the first ``fast_polls`` polls
+            fast_polls: Number of polls made at the initial interval
+            backoff: Interval multiplier applied after the fast polls
+            max_interval: Upper bound for the poll interval
+            deadline: Default seconds to wait for a task before giving up
+            max_concurrency: Max fetch calls in flight at the same time
+        """
+        self.fetch = fetch
+        self.initial_interval = initial_interval
+        self.fast_polls = fast_polls
+        self.backoff = backoff
+        self.max_interval = max_interval
+        self.deadline = deadline
+        self.max_concurrency = max_concurrency
+
+        self.stats = PollerStats()
+        self._heap: List[tuple] = []
+        self._counter = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._scheduler: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight = set()
+
+    def next_interval(self, polls: int) -> float:
+        """Interval to wait after ``polls`` unsuccessful polls."""
+        if polls < self.fast_polls:
+            return self.initial_interval
+        interval = self.initial_interval * self.backoff ** (polls - self.fast_polls + 1)
+        return min(interval, self.max_interval)
+
+    async def wait(self, task_id: str, deadline: Optional[float] = None) -> Any:
+        """
+        Wait for one task's result.
+        等待单个任务结果
+
+        Cancelling the caller removes the task from the schedule.
+
+        Args:
+            task_id: Task ID to poll
+            deadline: Seconds to wait before raising TimeoutError (default: poller deadline)
+
+        Returns:
+            Whatever ``fetch`` returns once the task is done
+        """
+        loop = asyncio.get_running_loop()
+        self._ensure_scheduler()
+
+        now = time.monotonic()
+        entry = _PollEntry(
+            task_id=task_id,
+            future=loop.create_future(),
+            deadline=now + (deadline if deadline is not None else self.deadline),
+            due=now,  # First poll is immediate
+        )
+        self._schedule(entry)
+
+        try:
+            return await entry.future
+        except asyncio.CancelledError:
+            if entry.future.cancelled():
+                self.stats.cancelled += 1
+            raise
+
+    async def wait_many(self, task_ids: Iterable[str], deadline: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Wait for many tasks on the shared scheduler.
+        在共享调度器上等待多个任务
+
+        Returns:
+            Mapping of task ID to result, or to the exception that ended it
+        """
+        task_ids = list(task_ids)
+        results = await asyncio.gather(
+            *(self.wait(task_id, deadline) for task_id in task_ids),
+            return_exceptions=True,
+        )
+        return dict(zip(task_ids, results))
+
+    def get_stats(self) -> dict:
+        """
+        Get poll metrics for monitoring.
+        获取轮询指标
+        """
+        finished = self.stats.completed + self.stats.failed + self.stats.timed_out
+        return {
+            "pending": len(self._heap) + len(self._in_flight),
+            "completed": self.stats.completed,
+            "failed": self.stats.failed,
+            "timed_out": self.stats.timed_out,
+            "cancelled": self.stats.cancelled,
+            "total_polls": self.stats.total_polls,
+            "avg_polls_per_task": (self.stats.finished_polls / finished) if finished else 0.0,
+            "max_polls_per_task": self.stats.max_polls,
+            "avg_queue_wait": (self.stats.total_queue_wait / self.stats.total_polls) if self.stats.total_polls else 0.0,
+            "max_queue_wait": self.stats.max_queue_wait,
+        }
+
+    def _ensure_scheduler(self) -> None:
+        """Start the scheduler on the running loop if it is not already running."""
+        loop = asyncio.get_running_loop()
+        if self._scheduler is None or self._scheduler.done() or self._loop is not loop:
+            self._loop = loop
+            self._heap.clear()
+            self._in_flight.clear()
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._scheduler = asyncio.create_task(self._run())
+
+    def _schedule(self, entry: _PollEntry) -> None:
+        heapq.heappush(self._heap, (entry.due, next(self._counter), entry))
+        self._wakeup.set()
+
+    async def _run(self) -> None:
+        """Scheduler loop: sleep until the earliest due poll, then dispatch every due entry."""
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=30.0)
+                except asyncio.TimeoutError:
+                    if not self._heap and not self._in_flight:
+                        return  # Idle; restarted by the next wait()
+                continue
+
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, entry = heapq.heappop(self._heap)
+            if entry.future.done():
+                continue  # Waiter was cancelled
+
+            await self._semaphore.acquire()
+            poll = asyncio.create_task(self._poll(entry))
+            self._in_flight.add(poll)
+            poll.add_done_callback(self._in_flight.discard)
+
+    async def _poll(self, entry: _PollEntry) -> None:
+        """Poll one task once and resolve or reschedule it."""
+        started = time.monotonic()
+        wait = max(0.0, started - entry.due)
+        entry.polls += 1
+        entry.queue_wait += wait
+        self.stats.total_polls += 1
+        self.stats.total_queue_wait += wait
+        self.stats.max_queue_wait = max(self.stats.max_queue_wait, wait)
+
+        try:
+            # A hung fetch must not outlive the task's deadline; the last poll, due at the
+            # deadline itself, still gets one initial interval to answer
+            budget = entry.deadline - started
+            if budget <= 0:
+                budget = self.initial_interval
+            result = await asyncio.wait_for(self.fetch(entry.task_id), budget)
+        except TaskPendingError:
+            now = time.monotonic()
+            if now >= entry.deadline:
+                self._time_out(entry)
+            elif not entry.future.done():
+                entry.due = min(now + self.next_interval(entry.polls), entry.deadline)
+                self._schedule(entry)
+        except asyncio.TimeoutError:
+            self._time_out(entry)
+        except Exception as e:
+            self.stats.failed += 1
+            self._finish(entry, error=e)
+        else:
+            self.stats.completed += 1
+            self._finish(entry, result=result)
+        finally:
+            self._semaphore.release()
+
+    def _time_out(self, entry: _PollEntry) -> None:
+        logger.warning(f"Task {entry.task_id} timed out after {entry.polls} polls")
+        self.stats.timed_out += 1
+        self._finish(entry, error=asyncio.TimeoutError(f"Task {entry.task_id} not finished before deadline"))
+
+    def _finish(self, entry: _PollEntry, result: Any = None, error: Optional[BaseException] = None) -> None:
+        self.stats.finished_polls += entry.polls
+        self.stats.max_polls = max(self.stats.max_polls, entry.polls)
+        if entry.future.done():
+            return
+        if error is not None:
+            entry.future.set_exception(error)
+        else:
+            entry.future.set_result(result)
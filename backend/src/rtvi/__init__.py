@@ -1,9 +1,20 @@
 """
-VoiceAI Backend Package
-VoiceAI 后端包
-"""
+RTVI Package
+RTVI 包
 
-from .rtvi.processor import RTVIProcessor, RTVIConfig
-from .rtvi.observer import RTVIObserver
+The processor and observer need pipecat; they are imported on first access
+so that ``rtvi.events`` can be used on its own.
+处理器与观察者依赖 pipecat，首次访问时才导入，rtvi.events 可单独使用。
+"""
 
 __all__ = ["RTVIProcessor", "RTVIConfig", "RTVIObserver"]
+
+
+def __getattr__(name):
+    if name in ("RTVIProcessor", "RTVIConfig"):
+        from rtvi import processor
+        return getattr(processor, name)
+    if name == "RTVIObserver":
+        from rtvi.observer import RTVIObserver
+        return RTVIObserver
+    raise AttributeError(f"module 'rtvi' has no attribute {name!r}")
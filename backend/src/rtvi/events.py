@@ -0,0 +1,139 @@
+"""
+RTVI Event Records and Dispatch Tables
+RTVI 事件记录与分发表
+
+Events are compact ``__slots__`` records instead of ``**kwargs`` dicts, and
+routing is a dictionary lookup keyed by event name or frame type instead of
+an ``if/elif isinstance`` chain, so per-frame overhead stays flat no matter
+how many handlers are registered. Handlers can be added at runtime.
+事件使用 __slots__ 记录而非 kwargs 字典；按事件名或帧类型查表分发（O(1)），
+替代 if/elif isinstance 链，支持运行时注册处理函数。
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+CLIENT_READY = "client_ready"
+BOT_READY = "bot_ready"
+BOT_DISCONNECTED = "bot_disconnected"
+USER_STARTED_SPEAKING = "user_started_speaking"
+USER_STOPPED_SPEAKING = "user_stopped_speaking"
+BOT_STARTED_SPEAKING = "bot_started_speaking"
+BOT_STOPPED_SPEAKING = "bot_stopped_speaking"
+USER_TRANSCRIPTION = "user_transcription"
+BOT_TRANSCRIPTION = "bot_transcription"
+LLM_TEXT = "llm_text"
+ERROR = "error"
+
+Handler = Callable[..., Any]
+
+
+class RTVIEvent:
+    """One RTVI event; only the fields an event uses are set."""
+
+    __slots__ = ("name", "text", "final", "user_id", "timestamp", "error")
+
+    def __init__(
+        self,
+        name: str,
+        text: Optional[str] = None,
+        final: bool = True,
+        user_id: str = "",
+        timestamp: str = "",
+        error: Optional[str] = None,
+    ):
+        self.name = name
+        self.text = text
+        self.final = final
+        self.user_id = user_id
+        self.timestamp = timestamp
+        self.error = error
+
+    @classmethod
+    def from_kwargs(cls, name: str, **kwargs) -> "RTVIEvent":
+        """Build an event from the legacy ``handle_event(name, **kwargs)`` form."""
+        return cls(name, **kwargs)
+
+    @classmethod
+    def from_frame(cls, name: str, frame) -> "RTVIEvent":
+        """Build a text event from a pipeline frame, keeping the ``final`` flag of interim transcripts."""
+        return cls(name, text=frame.text, final=getattr(frame, "final", True))
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{slot}={getattr(self, slot)!r}" for slot in self.__slots__[1:] if getattr(self, slot))
+        return f"RTVIEvent({self.name!r}{', ' + fields if fields else ''})"
+
+
+class EventDispatcher:
+    """Handlers keyed by event name, called in registration order."""
+
+    __slots__ = ("_handlers",)
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = {}
+
+    def register(self, name: str, handler: Handler) -> Handler:
+        """Add a handler for an event name; returns the handler."""
+        self._handlers.setdefault(name, []).append(handler)
+        return handler
+
+    def on(self, name: str) -> Callable[[Handler], Handler]:
+        """Decorator form of ``register``."""
+        return lambda handler: self.register(name, handler)
+
+    def unregister(self, name: str, handler: Handler) -> None:
+        handlers = self._handlers.get(name, [])
+        if handler in handlers:
+            handlers.remove(handler)
+
+    def handlers(self, name: str) -> Tuple[Handler, ...]:
+        """Handlers for an event name (empty if none are registered)."""
+        return tuple(self._handlers.get(name, ()))
+
+    def __contains__(self, name: str) -> bool:
+        return bool(self._handlers.get(name))
+
+
+class FrameDispatcher:
+    """
+    Handlers keyed by frame type.
+    按帧类型分发
+
+    Lookup is one dict access on ``type(frame)``; subclasses of a registered
+    type are resolved through the MRO once and cached, and so are types with
+    no handler (audio frames, which make up most of the traffic).
+
+    Only the nearest registered type in the MRO is used, like the first
+    matching branch of an ``isinstance`` chain: a type with handlers of its
+    own shadows the handlers of its base types.
+    只使用 MRO 中最近的已注册类型，子类的处理函数会覆盖基类的处理函数。
+    """
+
+    __slots__ = ("_handlers", "_cache")
+
+    def __init__(self):
+        self._handlers: Dict[type, List[Handler]] = {}
+        self._cache: Dict[type, Tuple[Handler, ...]] = {}
+
+    def register(self, frame_type: type, handler: Handler) -> Handler:
+        """Add a handler for a frame type and its subclasses that have none of their own; returns the handler."""
+        self._handlers.setdefault(frame_type, []).append(handler)
+        self._cache.clear()
+        return handler
+
+    def unregister(self, frame_type: type, handler: Handler) -> None:
+        handlers = self._handlers.get(frame_type, [])
+        if handler in handlers:
+            handlers.remove(handler)
+            self._cache.clear()
+
+    def handlers(self, frame_type: type) -> Tuple[Handler, ...]:
+        """Handlers of the nearest registered type in the frame type's MRO (empty if none)."""
+        handlers = self._cache.get(frame_type)
+        if handlers is None:
+            handlers = ()
+            for base in frame_type.__mro__:
+                if self._handlers.get(base):
+                    handlers = tuple(self._handlers[base])
+                    break
+            self._cache[frame_type] = handlers
+        return handlers
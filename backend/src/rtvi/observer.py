@@ -3,7 +3,6 @@ RTVI Observer for VoiceAI
 VoiceAI 的 RTVI 观察者
 """
 
-from pipecat.processors.frame_processor import FrameProcessor
 from pipecat.frames.frames import (
     UserStartedSpeakingFrame,
     UserStoppedSpeakingFrame,
@@ -13,36 +12,83 @@ from pipecat.frames.frames import (
     UserTranscriptionFrame,
     BotTranscriptionFrame,
 )
-from loguru import logger
+
+from rtvi import events
+from rtvi.events import FrameDispatcher, RTVIEvent
+
+# Frames forwarded to the RTVI processor as events without text
+SPEAKING_EVENTS = {
+    UserStartedSpeakingFrame: events.USER_STARTED_SPEAKING,
+    UserStoppedSpeakingFrame: events.USER_STOPPED_SPEAKING,
+    BotStartedSpeakingFrame: events.BOT_STARTED_SPEAKING,
+    BotStoppedSpeakingFrame: events.BOT_STOPPED_SPEAKING,
+}
+
+# Frames forwarded with their text
+TEXT_EVENTS = {
+    LLMTextFrame: events.LLM_TEXT,
+    UserTranscriptionFrame: events.USER_TRANSCRIPTION,
+    BotTranscriptionFrame: events.BOT_TRANSCRIPTION,
+}
+
+# Speaking events pre-built once; they carry no per-frame data
+_SPEAKING_RECORDS = {name: RTVIEvent(name) for name in SPEAKING_EVENTS.values()}
 
 
 class RTVIObserver:
     """RTVI Observer that monitors pipeline events and converts them to RTVI format."""
 
-    def __init__(self, rtvi_processor):
+    def __init__(self, rtvi_processor, interruptions=None):
         self.rtvi = rtvi_processor
+        # Optional InterruptionController; user speech over the bot cancels the reply
+        self.interruptions = interruptions
+        # Frame type -> handlers; plugins add their own with register()
+        self.dispatcher = FrameDispatcher()
+
+        if interruptions is not None:
+            # Ahead of the RTVI events, so a barge-in cancels the reply first
+            self.dispatcher.register(UserStartedSpeakingFrame, self._on_user_started_speaking)
+            self.dispatcher.register(BotStartedSpeakingFrame, self._on_bot_started_speaking)
+            self.dispatcher.register(BotStoppedSpeakingFrame, self._on_bot_stopped_speaking)
+        for frame_type, name in SPEAKING_EVENTS.items():
+            self.dispatcher.register(frame_type, self._forward_speaking(name))
+        for frame_type, name in TEXT_EVENTS.items():
+            self.dispatcher.register(frame_type, self._forward_text(name))
+
+    def register(self, frame_type: type, handler) -> None:
+        """
+        Add an async handler ``handler(frame, direction)`` for a frame type.
+        为某种帧类型注册异步处理函数
+
+        Frames of a subtype with handlers of its own (e.g. the built-in text
+        frames) do not reach handlers registered on a base type.
+        """
+        self.dispatcher.register(frame_type, handler)
 
     async def handle_frame(self, frame, direction):
         """Process incoming frames and send RTVI events."""
-        if isinstance(frame, UserStartedSpeakingFrame):
-            await self.rtvi.handle_event("user_started_speaking")
+        # Unhandled frames (audio, mostly) cost one cached dict lookup
+        for handler in self.dispatcher.handlers(type(frame)):
+            await handler(frame, direction)
 
-        elif isinstance(frame, UserStoppedSpeakingFrame):
-            await self.rtvi.handle_event("user_stopped_speaking")
+    def _forward_speaking(self, name: str):
+        event = _SPEAKING_RECORDS[name]
 
-        elif isinstance(frame, BotStartedSpeakingFrame):
-            await self.rtvi.handle_event("bot_started_speaking")
+        async def forward(frame, direction):
+            await self.rtvi.dispatch(event)
+        return forward
 
-        elif isinstance(frame, BotStoppedSpeakingFrame):
-            await self.rtvi.handle_event("bot_stopped_speaking")
+    def _forward_text(self, name: str):
+        async def forward(frame, direction):
+            # Interim transcripts must not close the turn's STT stage
+            await self.rtvi.dispatch(RTVIEvent.from_frame(name, frame))
+        return forward
 
-        elif isinstance(frame, LLMTextFrame):
-            await self.rtvi.handle_event("llm_text", text=frame.text)
+    async def _on_user_started_speaking(self, frame, direction):
+        await self.interruptions.user_started_speaking()
 
-        elif isinstance(frame, UserTranscriptionFrame):
-            await self.rtvi.handle_event("user_transcription", text=frame.text)
+    async def _on_bot_started_speaking(self, frame, direction):
+        self.interruptions.bot_started_speaking()
 
-        elif isinstance(frame, BotTranscriptionFrame):
-            await self.rtvi.handle_event("bot_transcription", text=frame.text)
-        else:
-            logger.debug(f"Unhandled frame type: {type(frame)}")
+    async def _on_bot_stopped_speaking(self, frame, direction):
+        self.interruptions.bot_stopped_speaking()
@@ -3,11 +3,11 @@ RTVI Processor for VoiceAI
 VoiceAI 的 RTVI 处理器
 """
 
-from dataclasses import dataclass, field
+import inspect
+from dataclasses import dataclass
 from typing import Optional, Any, Dict, List
 from pipecat.services.ai_services import TTSService, LLMService
 from pipecat.frames.frames import (
-    BotReadyFrame,
     ClientReadyFrame,
     ConfigFrame,
     ErrorFrame,
@@ -21,10 +21,10 @@ from pipecat.frames.frames import (
 )
 from loguru import logger
 
-# Import Doubao STT service
-from ..doubao_stt import DoubaoSTTService, get_service as get_doubao_stt_service
-# Import Zhipu GLM LLM service
-from ..zhipu_llm import get_service as get_glm_llm_service
+# Per-turn latency spans
+from metrics import TurnTracker
+from rtvi import events
+from rtvi.events import EventDispatcher, RTVIEvent
 
 
 @dataclass
@@ -43,50 +43,83 @@ class RTVIProcessor:
     _client_ready: bool = False
     _bot_ready: bool = False
 
-    def __init__(self, config: RTVIConfig):
+    def __init__(self, config: RTVIConfig, turns: Optional[TurnTracker] = None):
         """Initialize RTVI processor with configuration."""
         self.config = config
         self._client_ready = False
         self._bot_ready = False
+        self.turns = turns or TurnTracker()
+        # Event name -> handlers; plugins add their own with register()
+        self.dispatcher = EventDispatcher()
+        self._register_builtin_handlers()
 
-    async def handle_event(self, event_name: str, **kwargs) -> None:
-        """Handle RTVI events."""
-        if event_name == "client_ready":
-            self._client_ready = True
-            logger.info("Client ready, sending bot_ready...")
-            yield ClientReadyFrame()
-        elif event_name == "bot_ready":
-            self._bot_ready = True
-            logger.info("Bot ready, sending config...")
-            # Send configuration with LLM options and STT service
-            config_data = self._get_llm_config()
-            yield ConfigFrame(config=config_data)
-        elif event_name == "user_started_speaking":
-            logger.info("User started speaking")
-            yield UserStartedSpeakingFrame()
-        elif event_name == "user_stopped_speaking":
-            logger.info("User stopped speaking")
-            yield UserStoppedSpeakingFrame()
-        elif event_name == "bot_started_speaking":
-            logger.info("Bot started speaking")
-            yield BotStartedSpeakingFrame()
-        elif event_name == "bot_stopped_speaking":
-            logger.info("Bot stopped speaking")
-            yield BotStoppedSpeakingFrame()
-        elif event_name == "user_transcription":
-            logger.debug(f"User transcription: {kwargs}")
-            yield UserTranscriptionFrame(**kwargs)
-        elif event_name == "bot_transcription":
-            logger.debug(f"Bot transcription: {kwargs}")
-            yield BotTranscriptionFrame(**kwargs)
-        elif event_name == "llm_text":
-            logger.debug(f"LLM text: {kwargs}")
-            yield LLMTextFrame(**kwargs)
-        elif event_name == "error":
-            logger.error(f"Error: {kwargs}")
-            yield ErrorFrame(**kwargs)
-        else:
-            logger.warning(f"Unknown event: {event_name}")
+    def register(self, event_name: str, handler) -> None:
+        """
+        Add a handler for an RTVI event; it receives the RTVIEvent and may return a frame.
+        注册 RTVI 事件处理函数（接收 RTVIEvent，可返回帧）
+        """
+        self.dispatcher.register(event_name, handler)
+
+    async def handle_event(self, event_name: str, **kwargs):
+        """Handle an RTVI event given by name and fields; returns the resulting frame, if any."""
+        return await self.dispatch(RTVIEvent.from_kwargs(event_name, **kwargs))
+
+    async def dispatch(self, event: RTVIEvent):
+        """
+        Route an event to its handlers.
+        将事件分发给已注册的处理函数
+
+        Returns:
+            The first frame a handler produced, or None
+        """
+        self.turns.on_event(event.name, final=event.final)
+
+        handlers = self.dispatcher.handlers(event.name)
+        if not handlers:
+            logger.warning(f"Unknown event: {event.name}")
+            return None
+
+        frame = None
+        for handler in handlers:
+            result = handler(event)
+            if inspect.isawaitable(result):
+                result = await result
+            if frame is None:
+                frame = result
+        return frame
+
+    def _register_builtin_handlers(self) -> None:
+        register = self.dispatcher.register
+        register(events.CLIENT_READY, self._on_client_ready)
+        register(events.BOT_READY, self._on_bot_ready)
+        register(events.BOT_DISCONNECTED, lambda event: None)
+        # Speaking transitions happen every turn; keep them out of info logs
+        register(events.USER_STARTED_SPEAKING, lambda event: UserStartedSpeakingFrame())
+        register(events.USER_STOPPED_SPEAKING, lambda event: UserStoppedSpeakingFrame())
+        register(events.BOT_STARTED_SPEAKING, lambda event: BotStartedSpeakingFrame())
+        register(events.BOT_STOPPED_SPEAKING, lambda event: BotStoppedSpeakingFrame())
+        register(events.USER_TRANSCRIPTION, lambda event: UserTranscriptionFrame(
+            text=event.text, user_id=event.user_id, timestamp=event.timestamp, final=event.final,
+        ))
+        register(events.BOT_TRANSCRIPTION, lambda event: BotTranscriptionFrame(text=event.text))
+        register(events.LLM_TEXT, lambda event: LLMTextFrame(text=event.text))
+        register(events.ERROR, self._on_error)
+
+    def _on_client_ready(self, event: RTVIEvent):
+        self._client_ready = True
+        logger.info("Client ready, sending bot_ready...")
+        return ClientReadyFrame()
+
+    def _on_bot_ready(self, event: RTVIEvent):
+        self._bot_ready = True
+        logger.info("Bot ready, sending config...")
+        # Send configuration with LLM options and STT service
+        config_data = self._get_llm_config()
+        return ConfigFrame(config=config_data)
+
+    def _on_error(self, event: RTVIEvent):
+        logger.error(f"Error: {event.error}")
+        return ErrorFrame(error=event.error)
 
     def _get_llm_config(self) -> List[Dict[str, Any]]:
         """Get LLM service configuration for RTVI."""
@@ -4,94 +4,168 @@ VoiceAI Server - Real-time voice AI assistant using Pipecat
 VoiceAI 服务器 - 使用 Pipecat 的实时语音 AI 助手
 """
 
+import asyncio
 import os
 from dotenv import load_dotenv
 from loguru import logger
-from pipecat.services.openai.llm import OpenAILLMService
-from pipecat.services.ai_services import TTSService, LLMService
 
 from rtvi.processor import RTVIProcessor, RTVIConfig
 from rtvi.observer import RTVIObserver
-from doubao_stt import DoubaoSTTService, get_service as get_stt_service
+from doubao_stt import DoubaoSTTService
 from doubao_tts import DoubaoTTSService, get_service as get_tts_service
+from llm_router import LLM_PROVIDERS, get_router
+from http_client import close_pool, get_pool
+from interruption import InterruptionController
+from session_manager import SessionLimitError, SessionManager, VoiceSession
+from supervisor import Supervisor
+from metrics import TurnTracker, get_tracker
+from metrics_server import METRICS_PORT, get_metrics_server
+from prompt_audio import get_prompt_audio
+from rate_limiter import get_stats as get_rate_limit_stats
+from tts_cache import TTS_PREWARM_PHRASES, load_phrases
 
 # Load environment variables
 load_dotenv()
 
-# Determine which LLM provider to use
-LLM_PROVIDER = os.getenv("LLM_PROVIDER", "doubao").lower()
-
-logger.info(f"Starting VoiceAI server with LLM provider: {LLM_PROVIDER}")
-
-
-def get_llm_service() -> LLMService:
-    """Get the configured LLM service based on environment variable."""
-    if LLM_PROVIDER == "doubao":
-        # Use Doubao LLM service
-        # TODO: Implement Doubao LLM service
-        raise NotImplementedError("Doubao LLM service not yet implemented")
-    elif LLM_PROVIDER == "glm":
-        # Use Zhipu GLM service (OpenAI Compatible)
-        api_key = os.getenv("ZHIPU_API_KEY")
-        base_url = os.getenv("ZHIPU_BASE_URL", "https://open.bigmodel.cn/api/paas/v4/")
-        model = os.getenv("GLM_MODEL", "glm-4")
-
-        logger.info(f"Initializing Zhipu GLM service with model: {model}")
-        return OpenAILLMService(
-            api_key=api_key,
-            base_url=base_url,
-            model=model,
-        )
-    else:
-        raise ValueError(f"Unknown LLM provider: {LLM_PROVIDER}")
+logger.info(f"Starting VoiceAI server with LLM providers: {LLM_PROVIDERS}")
+
+
+def create_session(session_id: str) -> VoiceSession:
+    """Build an isolated pipeline for one participant. Network pools and caches stay shared."""
+    stt = DoubaoSTTService()
+    tts = DoubaoTTSService()
+    # The router answers the turns, so it also describes the LLM to the client
+    llm = get_router()
+    rtvi = RTVIProcessor(config=RTVIConfig(
+        stt=stt,
+        llm=llm,
+        tts=tts,
+    ), turns=TurnTracker(session_id))
+    interruptions = InterruptionController(session_id)
+    observer = RTVIObserver(rtvi, interruptions=interruptions)
+
+    return VoiceSession(
+        session_id=session_id,
+        stt=stt,
+        llm=llm,
+        tts=tts,
+        rtvi=rtvi,
+        observer=observer,
+        interruptions=interruptions,
+        prompt_audio=get_prompt_audio(),
+    )
 
 
-async def main():
-    """Main entry point for VoiceAI server."""
-    from pipecat.flows import Flow
-    from pipecat.transports.daily import DailyTransport
-    from pipecat.transports.services.transport import TransportSessionArgs
-    from pipecat.services.openai import openai_realtime
+async def run_room(room_name: str, transport=None) -> None:
+    """
+    Host one room: a session per participant over the room's transport.
+    承载一个房间：每个参与者一个会话
 
-    # Configure RTVI services
-    rtvi_config = RTVIConfig(
-        stt=get_stt_service(),
-        llm=get_llm_service(),
-        tts=get_tts_service(),
-    )
+    Args:
+        room_name: Room to join
+        transport: Transport to use (default: DailyTransport for the room)
+    """
+    from pipecat.transports.services.transport import TransportSessionArgs
 
-    # Create RTVI processor and observer
-    rtvi = RTVIProcessor(config=rtvi_config)
-    observer = RTVIObserver(rtvi)
-
-    # Setup transport (using Daily for WebRTC)
-    transport = DailyTransport(
-        room_name=os.getenv("DAILY_ROOM", "voice-ai-room"),
-        token=os.getenv("DAILY_API_KEY", ""),
-        url=os.getenv("DAILY_URL", "wss://api.daily.co/v1/"),
-        audio_enabled=True,
-        video_enabled=False,
-    )
+    # Pre-warm the TTS cache with common phrases
+    if TTS_PREWARM_PHRASES:
+        await get_tts_service().prewarm(load_phrases(TTS_PREWARM_PHRASES))
+    # Greetings and fillers in memory before anyone connects
+    await get_prompt_audio().start()
+
+    # One isolated pipeline + RTVI state per participant
+    sessions = SessionManager(create_session)
+    # Session counts and the session limit feed /metrics and /readyz
+    get_metrics_server().watch_sessions(sessions)
+
+    if transport is None:
+        from pipecat.transports.daily import DailyTransport
+
+        # Setup transport (using Daily for WebRTC)
+        transport = DailyTransport(
+            room_name=room_name,
+            token=os.getenv("DAILY_API_KEY", ""),
+            url=os.getenv("DAILY_URL", "wss://api.daily.co/v1/"),
+            audio_enabled=True,
+            video_enabled=False,
+        )
 
-    # Build the pipeline
-    # transport.input() → rtvi → doubao_stt → llm → doubao_tts → transport.output()
+    # Build the pipeline (per session)
+    # transport.input() → rtvi → doubao_stt → llm → sentence_tts (doubao_tts) → transport.output()
     # rtvi_observer → client events
 
     @transport.event_handler("on_participant_connected")
     async def on_participant_connected(transport, participant):
         logger.info(f"Client connected: {participant.identity}")
-        await rtvi.handle_event("client_ready")
-        await rtvi.set_bot_ready()
+        try:
+            session = await sessions.create(participant.identity)
+        except SessionLimitError as e:
+            logger.warning(f"Client {participant.identity} not admitted: {e}")
+            return
+
+        await session.rtvi.handle_event("client_ready")
+        await session.rtvi.set_bot_ready()
+        # Prefetched: no LLM or TTS round trip before the bot says hello
+        await session.greet()
 
     @transport.event_handler("on_participant_disconnected")
     async def on_participant_disconnected(transport, participant, reason):
         logger.info(f"Client disconnected: {participant.identity}, reason: {reason}")
-        await rtvi.handle_event("bot_disconnected")
+        session = sessions.get(participant.identity)
+        if session is not None:
+            await session.rtvi.handle_event("bot_disconnected")
+            await sessions.close(participant.identity)
+
+    try:
+        await transport.start(TransportSessionArgs(room_name=room_name))
+    finally:
+        get_metrics_server().unwatch_sessions(sessions)
+        await sessions.close_all()
+        logger.info(f"Room {room_name} session stats at shutdown: {sessions.get_stats()}")
+
 
-    await transport.start(TransportSessionArgs(room_name=os.getenv("DAILY_ROOM")))
-    await rtvi.start()
+async def main():
+    """Main entry point for VoiceAI server."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="VoiceAI server")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WORKERS", "1")),
+        help="Number of worker processes (1 = run in this process)",
+    )
+    args = parser.parse_args()
+
+    rooms = [room.strip() for room in os.getenv("DAILY_ROOMS", os.getenv("DAILY_ROOM", "voice-ai-room")).split(",")]
+    rooms = [room for room in rooms if room]
+
+    if args.workers <= 1:
+        metrics_server = get_metrics_server()
+        if METRICS_PORT > 0:
+            await metrics_server.start()
+        try:
+            await asyncio.gather(*(run_room(room) for room in rooms))
+        finally:
+            metrics_server.drain()
+            await metrics_server.stop()
+            logger.info(f"Turn latency summary: {get_tracker().get_summary()}")
+            logger.info(f"HTTP pool stats at shutdown: {get_pool().get_stats()}")
+            logger.info(f"Rate limiter stats at shutdown: {get_rate_limit_stats()}")
+            await close_pool()
+        return
+
+    supervisor = Supervisor(args.workers, room_runner="server:run_room")
+    await supervisor.start()
+    try:
+        for room in rooms:
+            await supervisor.assign(room)
+        while True:
+            await asyncio.sleep(30)
+            logger.info(f"Supervisor health: {supervisor.get_health()}")
+    finally:
+        await supervisor.stop()
 
 
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
@@ -0,0 +1,356 @@
+"""
+Session Manager
+会话管理器
+
+Creates an isolated pipeline (services, RTVI state, conversation history)
+for every connected participant so one server process can host many calls.
+Only pooled network clients and caches are shared between sessions.
+为每个参与者创建独立的管道（服务、RTVI 状态、对话历史），仅共享连接池和缓存。
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from conversation_context import ConversationContext, count_message_tokens, llm_summarizer
+from interruption import InterruptionController
+from metrics import TurnTracker, current_turn, record_value
+from prompt_audio import FILLER_AFTER_MS, PromptAudioLibrary
+from response_cache import ResponseCache, get_response_cache
+from speculative import SpeculativeLLM
+from tts_pipeline import SentenceTTSPipeline, SpeechSegment
+
+# Load environment variables
+load_dotenv()
+
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "50"))
+
+
+class SessionLimitError(Exception):
+    """Raised when a new session would exceed the configured maximum."""
+
+
+@dataclass
+class VoiceSession:
+    """Per-participant pipeline state."""
+    session_id: str
+    stt: Any
+    llm: Any
+    tts: Any
+    rtvi: Any = None
+    observer: Any = None
+    system_prompt: Optional[str] = None
+    voice: str = "zh_female_qingxin"
+    messages: List[dict] = field(default_factory=list)
+    created_at: float = field(default_factory=time.monotonic)
+    tts_pipeline: Optional[SentenceTTSPipeline] = None
+    turns: Optional[TurnTracker] = None
+    interruptions: Optional[InterruptionController] = None
+    context: Optional[ConversationContext] = None
+    speculator: Optional[SpeculativeLLM] = None
+    response_cache: Optional[ResponseCache] = None
+    # Opt out for prompts whose replies are personal or time-sensitive
+    cache_responses: bool = True
+    # Prefetched greeting/filler clips; a filler plays once the first token is this late
+    prompt_audio: Optional[PromptAudioLibrary] = None
+    filler_after: float = FILLER_AFTER_MS / 1000
+    _tasks: Set[asyncio.Task] = field(default_factory=set, init=False, repr=False)
+
+    def __post_init__(self):
+        if self.tts_pipeline is None:
+            self.tts_pipeline = SentenceTTSPipeline(self.tts, voice=self.voice)
+        if self.turns is None:
+            # Shared with the RTVI processor so its events land on the same turn
+            self.turns = getattr(self.rtvi, "turns", None) or TurnTracker(self.session_id)
+        if self.interruptions is None:
+            self.interruptions = InterruptionController(self.session_id)
+        self.interruptions.add_flush_handler(self.tts_pipeline.interrupt)
+        if self.context is None:
+            # Manages ``messages`` in place; summarizes with the session's LLM when it can
+            summarizer = llm_summarizer(self.llm) if hasattr(self.llm, "chat") else None
+            self.context = ConversationContext(self.system_prompt, messages=self.messages, summarizer=summarizer)
+        if self.speculator is None:
+            self.speculator = SpeculativeLLM(self._speculative_stream)
+        if self.response_cache is None:
+            self.response_cache = get_response_cache()
+
+    async def greet(self) -> Optional[SpeechSegment]:
+        """
+        Play the prefetched greeting through the pipeline's audio callback.
+        播放预取的问候语
+
+        Returns:
+            The greeting segment, or None if no clip is ready for this voice
+        """
+        clip = self.prompt_audio.greeting(self.voice) if self.prompt_audio is not None else None
+        if clip is None:
+            return None
+        segment = SpeechSegment(index=-1, text=clip.text, audio=clip.audio)
+        if self.tts_pipeline.on_audio is not None:
+            await self.tts_pipeline.on_audio(segment)
+        # The model should know it already said hello
+        self.context.add_assistant(clip.text)
+        return segment
+
+    def on_interim_transcript(self, text: str) -> None:
+        """
+        Feed an interim STT transcript; may start the LLM early (see speculative.py).
+        输入 STT 中间结果；可能提前发起 LLM 请求
+        """
+        self.speculator.on_interim(text)
+
+    def _speculative_stream(self, text: str) -> AsyncIterator[str]:
+        # Same prompt the turn would send, with the interim text as the user message
+        return self.llm.chat_stream(self.context.build() + [{"role": "user", "content": text}])
+
+    async def run_turn(self, user_text: str, use_response_cache: bool = True) -> AsyncIterator[SpeechSegment]:
+        """
+        Run one conversational turn: stream the LLM reply into sentence-level TTS.
+        执行一轮对话：LLM 流式回复按句送入 TTS
+
+        The reply runs in its own task registered with ``interruptions``; a
+        barge-in cancels it, ends this iterator early and only the text that
+        was already handed to playback is kept in the conversation.
+
+        Args:
+            user_text: Final user transcript
+            use_response_cache: Set False to always ask the LLM for this turn
+
+        If the LLM has not produced a first token ``filler_after`` seconds in,
+        one prefetched filler segment (index -1) is yielded ahead of the reply;
+        it is not part of the conversation history.
+
+        Yields:
+            Synthesized reply segments in playback order
+        """
+        use_cache = use_response_cache and self.cache_responses
+        # Keyed on the whole prompt ahead of the question: follow-ups depend on the conversation
+        cache_scope = ResponseCache.scope_for(self.system_prompt, self.context.build()) if use_cache else ""
+        cached = self.response_cache.get(user_text, cache_scope) if use_cache else None
+        if cached is not None:
+            self.speculator.cancel()
+            speculation = None
+        else:
+            speculation = self.speculator.take(user_text)
+        if speculation is not None:
+            # Adopted: its upstream stream is now this turn's reply, cancelled on barge-in or close
+            self.interruptions.register(speculation.task)
+            self.spawn(speculation.task)
+        self.context.add_user(user_text)
+        prompt = self.context.build()
+        reply = []
+        spoken = []
+        completed = False
+
+        # Continue the turn opened by VAD end if there is one; services mark it via the context
+        turn = self.turns.current or self.turns.begin_turn()
+        turn.mark("stt_final")
+        token = current_turn.set(turn)
+        record_value("prompt_tokens", count_message_tokens(prompt))
+
+        # One slot so the reply is still paced by the consumer
+        segments: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+        async def deltas():
+            if cached is not None:
+                # Replayed through the normal TTS path, whose cache already holds these sentences
+                turn.mark("llm_request")
+                turn.mark("llm_first_token")
+                record_value("response_cache_hit", 1)
+                reply.append(cached)
+                yield cached
+                turn.mark("llm_last_token")
+                return
+            if speculation is not None:
+                # Adopt the request started on the interim transcript
+                turn.mark("llm_request", at=speculation.started_at)
+                record_value("speculation_saved_ms", round((time.monotonic() - speculation.started_at) * 1000, 1))
+                stream = speculation.replay()
+            else:
+                # The prompt already starts with the pinned system prompt and summary
+                stream = self.llm.chat_stream(prompt)
+            async for delta in stream:
+                if speculation is not None:
+                    turn.mark("llm_first_token", at=speculation.first_token_at)
+                reply.append(delta)
+                yield delta
+            if speculation is not None:
+                turn.mark("llm_last_token")
+
+        async def produce():
+            try:
+                async for segment in self.tts_pipeline.synthesize_stream(deltas()):
+                    await segments.put(segment)
+            except Exception as e:
+                await segments.put(e)
+                return
+            await segments.put(None)
+
+        def on_done(task: asyncio.Task):
+            if task.cancelled():
+                # Interrupted: drop any queued segment and wake the consumer
+                while not segments.empty():
+                    segments.get_nowait()
+                segments.put_nowait(None)
+
+        # Created after current_turn is set so the reply task inherits it
+        reply_task = self.interruptions.register(asyncio.create_task(produce()))
+        reply_task.add_done_callback(on_done)
+
+        filler_at = None
+        if self.prompt_audio is not None and cached is None and self.filler_after > 0:
+            filler_at = asyncio.get_running_loop().time() + self.filler_after
+
+        try:
+            while True:
+                if filler_at is not None:
+                    item = await self._next_or_filler(segments, filler_at, turn)
+                    filler_at = None
+                else:
+                    item = await segments.get()
+                if item is None:
+                    completed = not reply_task.cancelled()
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if item.index < 0:
+                    # Filler: played, but neither the reply nor its latency
+                    yield item
+                    continue
+                turn.mark("first_audio_out")
+                spoken.append(item.text)
+                yield item
+        finally:
+            reply_task.cancel()
+            tasks = [reply_task]
+            if speculation is not None:
+                # replay() only reads the buffer; the adopted stream keeps draining until cancelled
+                speculation.cancel()
+                tasks.append(speculation.task)
+            await asyncio.gather(*tasks, return_exceptions=True)
+            current_turn.reset(token)
+            if self.turns.current is turn:
+                self.turns.end_turn()
+
+            text = "".join(reply) if completed else "".join(spoken)
+            if completed and use_cache and cached is None:
+                self.response_cache.put(user_text, text, cache_scope)
+            if not completed:
+                logger.info(f"Session {self.session_id} reply truncated after {len(spoken)} segment(s)")
+            if text:
+                self.context.add_assistant(text)
+            if self.context.needs_compaction():
+                # Off the turn path; the next prompt is budgeted by build() meanwhile
+                self.spawn(self.context.compact())
+
+    async def _next_or_filler(self, segments: asyncio.Queue, filler_at: float, turn) -> Any:
+        """Wait for the first reply item; past ``filler_at`` with no token yet, return a filler."""
+        timeout = max(0.0, filler_at - asyncio.get_running_loop().time())
+        try:
+            return await asyncio.wait_for(segments.get(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        if "llm_first_token" in turn.marks:
+            # The reply is only waiting on TTS now
+            return await segments.get()
+        clip = self.prompt_audio.filler(self.voice)
+        if clip is None:
+            return await segments.get()
+        turn.mark("filler_out")
+        record_value("filler_played", 1)
+        logger.debug(f"Session {self.session_id} playing filler after {self.filler_after:.1f}s without a token")
+        return SpeechSegment(index=-1, text=clip.text, audio=clip.audio)
+
+    def spawn(self, coro: Awaitable) -> asyncio.Task:
+        """Run a background task owned by this session; it is cancelled on close."""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def close(self) -> None:
+        """Cancel all work owned by this session."""
+        self.speculator.cancel()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class SessionManager:
+    """Creates, tracks and tears down per-participant sessions with admission control."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[str], VoiceSession],
+        max_sessions: int = MAX_SESSIONS,
+    ):
+        """Initialize session manager.
+
+        Args:
+            session_factory: Builds a fresh VoiceSession for a session ID
+            max_sessions: Max concurrent sessions admitted by this process
+        """
+        self.session_factory = session_factory
+        self.max_sessions = max_sessions
+        self._sessions: Dict[str, VoiceSession] = {}
+        self._stats = {"created": 0, "closed": 0, "rejected": 0}
+
+    async def create(self, session_id: str) -> VoiceSession:
+        """
+        Admit and create a session.
+        准入并创建会话
+
+        Raises:
+            SessionLimitError: The process is already at max_sessions
+        """
+        if session_id in self._sessions:
+            logger.warning(f"Session {session_id} already exists, replacing it")
+            await self.close(session_id)
+
+        if len(self._sessions) >= self.max_sessions:
+            self._stats["rejected"] += 1
+            logger.warning(f"Rejecting session {session_id}: {len(self._sessions)}/{self.max_sessions} active")
+            raise SessionLimitError(f"Max concurrent sessions reached ({self.max_sessions})")
+
+        session = self.session_factory(session_id)
+        self._sessions[session_id] = session
+        self._stats["created"] += 1
+        logger.info(f"Session {session_id} created ({len(self._sessions)}/{self.max_sessions} active)")
+        return session
+
+    def get(self, session_id: str) -> Optional[VoiceSession]:
+        """Get an active session by ID."""
+        return self._sessions.get(session_id)
+
+    async def close(self, session_id: str) -> None:
+        """
+        Tear down a session and release its slot.
+        关闭会话并释放名额
+        """
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return
+        await session.close()
+        self._stats["closed"] += 1
+        logger.info(f"Session {session_id} closed ({len(self._sessions)}/{self.max_sessions} active)")
+
+    async def close_all(self) -> None:
+        """Tear down every session, e.g. on server shutdown."""
+        for session_id in list(self._sessions):
+            await self.close(session_id)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get_stats(self) -> dict:
+        """Get session counters for monitoring."""
+        stats = dict(self._stats)
+        stats["active"] = len(self._sessions)
+        stats["max_sessions"] = self.max_sessions
+        return stats
@@ -0,0 +1,205 @@
+"""
+Speculative LLM Start
+LLM 预测性提前请求
+
+Starts the LLM request on an interim transcript once it has been stable for
+a short window. When the final transcript arrives the speculative stream is
+adopted if the text matches (up to trivial differences), otherwise it is
+cancelled and the turn runs normally. Trades extra upstream calls for
+lower latency, so the policy is configured per deployment.
+中间识别结果稳定一段时间后提前发起 LLM 请求；终稿一致则直接采用，否则取消重来。
+以额外的上游调用换取更低延迟，策略按部署配置。
+"""
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, List, Optional
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from metrics import Histogram, current_turn
+from text_normalization import normalize_text, text_similarity
+
+# Load environment variables
+load_dotenv()
+
+# off: never speculate; on: speculate on stable interim transcripts
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "off").lower()
+SPECULATIVE_STABLE_MS = int(os.getenv("SPECULATIVE_STABLE_MS", "300"))
+SPECULATIVE_MIN_CHARS = int(os.getenv("SPECULATIVE_MIN_CHARS", "4"))
+# Normalized similarity at which the final transcript still adopts the speculation
+SPECULATIVE_MIN_SIMILARITY = float(os.getenv("SPECULATIVE_MIN_SIMILARITY", "1.0"))
+# Upper bound on speculative requests per user turn (upstream cost)
+SPECULATIVE_MAX_PER_TURN = int(os.getenv("SPECULATIVE_MAX_PER_TURN", "2"))
+
+
+@dataclass
+class SpeculationPolicy:
+    """When to speculate and what counts as a match."""
+    enabled: bool = SPECULATIVE_MODE == "on"
+    stable_ms: int = SPECULATIVE_STABLE_MS
+    min_chars: int = SPECULATIVE_MIN_CHARS
+    min_similarity: float = SPECULATIVE_MIN_SIMILARITY
+    max_per_turn: int = SPECULATIVE_MAX_PER_TURN
+
+
+class Speculation:
+    """One speculative LLM stream, buffered until it is adopted or discarded."""
+
+    def __init__(self, text: str, stream: AsyncIterator[str]):
+        self.text = text
+        self.normalized = normalize_text(text)
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        self.deltas: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._updated = asyncio.Event()
+        self.task = asyncio.create_task(self._consume(stream))
+
+    async def _consume(self, stream: AsyncIterator[str]) -> None:
+        # Not part of any turn until adopted; marks are copied over then
+        current_turn.set(None)
+        try:
+            async for delta in stream:
+                if self.first_token_at is None:
+                    self.first_token_at = time.monotonic()
+                self.deltas.append(delta)
+                self._updated.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._updated.set()
+
+    async def replay(self) -> AsyncIterator[str]:
+        """Yield the buffered deltas, then follow the live stream to its end."""
+        index = 0
+        while True:
+            while index < len(self.deltas):
+                yield self.deltas[index]
+                index += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            self._updated.clear()
+            await self._updated.wait()
+
+    def cancel(self) -> None:
+        self.task.cancel()
+
+
+class SpeculativeLLM:
+    """Per-session speculation driven by interim transcripts."""
+
+    def __init__(
+        self,
+        start_stream: Callable[[str], AsyncIterator[str]],
+        policy: Optional[SpeculationPolicy] = None,
+    ):
+        """Initialize speculator.
+
+        Args:
+            start_stream: Starts the LLM stream for a candidate user text
+            policy: Speculation policy (default: from environment)
+        """
+        self.start_stream = start_stream
+        self.policy = policy or SpeculationPolicy()
+        self.current: Optional[Speculation] = None
+
+        self._candidate = ""
+        self._timer: Optional[asyncio.Task] = None
+        self._started_this_turn = 0
+        self.saved = Histogram("speculation_saved")
+        self._stats = {"started": 0, "adopted": 0, "discarded": 0, "invalidated": 0, "skipped": 0}
+
+    def on_interim(self, text: str) -> None:
+        """
+        Feed an interim transcript; speculation starts once it stays unchanged for ``stable_ms``.
+        输入中间识别结果；文本稳定 stable_ms 后发起预测请求
+        """
+        if not self.policy.enabled:
+            return
+        normalized = normalize_text(text)
+        if normalized == normalize_text(self._candidate):
+            return
+
+        self._candidate = text
+        self._cancel_timer()
+        if self.current is not None and not self._matches(self.current, normalized):
+            # The user kept talking; the running speculation answers the wrong question
+            self._discard("invalidated")
+
+        if len(normalized) >= self.policy.min_chars:
+            self._timer = asyncio.create_task(self._start_when_stable(text))
+
+    def take(self, final_text: str) -> Optional[Speculation]:
+        """
+        Resolve speculation against the final transcript.
+        用终稿判定预测请求是否可用
+
+        Returns:
+            The speculation to adopt, or None (any mismatching one is cancelled)
+        """
+        self._cancel_timer()
+        self._candidate = ""
+        self._started_this_turn = 0
+        speculation, self.current = self.current, None
+        if speculation is None:
+            return None
+
+        if self._matches(speculation, normalize_text(final_text)) and speculation.error is None:
+            saved = time.monotonic() - speculation.started_at
+            self.saved.observe(saved)
+            self._stats["adopted"] += 1
+            logger.info(f"Speculative LLM adopted, {saved * 1000:.0f} ms head start")
+            return speculation
+
+        speculation.cancel()
+        self._stats["discarded"] += 1
+        logger.debug(f"Speculative LLM discarded: '{speculation.text}' vs final '{final_text}'")
+        return None
+
+    def cancel(self) -> None:
+        """Drop any pending or running speculation."""
+        self._cancel_timer()
+        self._candidate = ""
+        if self.current is not None:
+            self._discard("discarded")
+
+    def get_stats(self) -> dict:
+        """Get hit rate and latency saved (head start of adopted speculations)."""
+        stats = dict(self._stats)
+        resolved = stats["adopted"] + stats["discarded"] + stats["invalidated"]
+        stats["hit_rate"] = stats["adopted"] / resolved if resolved else None
+        stats["saved"] = self.saved.summary()
+        return stats
+
+    async def _start_when_stable(self, text: str) -> None:
+        await asyncio.sleep(self.policy.stable_ms / 1000)
+        if self.current is not None:
+            return
+        if self._started_this_turn >= self.policy.max_per_turn:
+            self._stats["skipped"] += 1
+            return
+        self._started_this_turn += 1
+        self._stats["started"] += 1
+        self.current = Speculation(text, self.start_stream(text))
+        logger.debug(f"Speculative LLM started on interim: {text}")
+
+    def _matches(self, speculation: Speculation, normalized: str) -> bool:
+        return text_similarity(speculation.normalized, normalized) >= self.policy.min_similarity
+
+    def _discard(self, reason: str) -> None:
+        self.current.cancel()
+        self.current = None
+        self._stats[reason] += 1
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+        self._timer = None
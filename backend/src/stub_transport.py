@@ -0,0 +1,76 @@
+"""
+Stub Transport
+模拟传输层
+
+In-process stand-in for the Daily transport used by local tests, the
+multi-process supervisor and benchmarks. It exposes the same
+``event_handler`` / ``start`` surface that server.py relies on and lets
+callers simulate participants joining and leaving.
+本地测试、多进程调度和压测用的模拟传输层，与 server.py 使用的接口一致。
+"""
+
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, List
+
+from loguru import logger
+
+
+@dataclass
+class StubParticipant:
+    """Participant handle passed to transport event handlers."""
+    identity: str
+
+
+class StubTransport:
+    """Transport stand-in that dispatches participant events to registered handlers."""
+
+    def __init__(self, room_name: str = "stub-room"):
+        self.room_name = room_name
+        self.participants: Dict[str, StubParticipant] = {}
+        self._handlers: Dict[str, List[Callable]] = defaultdict(list)
+        self._stopped = asyncio.Event()
+
+    def event_handler(self, event_name: str):
+        """Register a coroutine handler for a transport event (decorator)."""
+        def decorator(handler):
+            self._handlers[event_name].append(handler)
+            return handler
+        return decorator
+
+    async def start(self, args=None) -> None:
+        """Run until stop() is called."""
+        logger.info(f"Stub transport started for room {self.room_name}")
+        await self._stopped.wait()
+
+    def stop(self) -> None:
+        """Make start() return."""
+        self._stopped.set()
+
+    async def connect_participant(self, identity: str) -> StubParticipant:
+        """Simulate a participant joining the room."""
+        participant = StubParticipant(identity=identity)
+        self.participants[identity] = participant
+        await self._emit("on_participant_connected", participant)
+        return participant
+
+    async def disconnect_participant(self, identity: str, reason: str = "left") -> None:
+        """Simulate a participant leaving the room."""
+        participant = self.participants.pop(identity, None)
+        if participant is not None:
+            await self._emit("on_participant_disconnected", participant, reason)
+
+    async def _emit(self, event_name: str, *args) -> None:
+        for handler in self._handlers[event_name]:
+            await handler(self, *args)
+
+
+async def run_stub_room(room_name: str) -> None:
+    """Room runner that hosts one simulated participant until cancelled (for supervisor tests)."""
+    transport = StubTransport(room_name)
+    await transport.connect_participant(f"{room_name}-user")
+    try:
+        await transport.start()
+    finally:
+        await transport.disconnect_participant(f"{room_name}-user")
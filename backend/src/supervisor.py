@@ -0,0 +1,338 @@
+"""
+Multi-process Supervisor
+多进程调度器
+
+Runs N worker processes, each with its own event loop, assigns rooms to the
+least-loaded worker, restarts workers that crash or stop sending heartbeats,
+and aggregates their health and metrics.
+启动 N 个工作进程（各自一个事件循环），按最小负载分配房间，
+自动重启崩溃或失联的进程，并汇总健康状态与指标。
+"""
+
+import asyncio
+import importlib
+import multiprocessing
+import os
+import resource
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Set
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from http_client import close_pool, get_pool
+from metrics_server import METRICS_PORT, get_metrics_server
+from rate_limiter import get_stats as get_rate_limit_stats
+
+# Load environment variables
+load_dotenv()
+
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "2.0"))
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", "10.0"))
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", "1.0"))
+
+
+def _resolve(target: str):
+    """Import a ``module:function`` reference."""
+    module_name, _, attr = target.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def run_worker(conn, worker_id: int, room_runner: str, heartbeat_interval: float) -> None:
+    """
+    Worker process entry point: one event loop hosting the rooms it is assigned.
+    工作进程入口：一个事件循环承载分配到的房间
+    """
+    asyncio.run(_worker_loop(conn, worker_id, _resolve(room_runner), heartbeat_interval))
+
+
+async def _worker_loop(conn, worker_id: int, run_room, heartbeat_interval: float) -> None:
+    loop = asyncio.get_running_loop()
+    rooms: Dict[str, asyncio.Task] = {}
+    commands: asyncio.Queue = asyncio.Queue()
+    stats = {"rooms_started": 0, "rooms_finished": 0, "rooms_failed": 0}
+
+    def on_readable():
+        try:
+            commands.put_nowait(conn.recv())
+        except (EOFError, OSError):
+            # Supervisor went away
+            loop.remove_reader(conn.fileno())
+            commands.put_nowait({"cmd": "stop"})
+
+    def on_room_done(room: str, task: asyncio.Task):
+        if rooms.get(room) is task:
+            del rooms[room]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            stats["rooms_failed"] += 1
+            logger.error(f"Worker {worker_id} room {room} failed: {task.exception()}")
+        else:
+            stats["rooms_finished"] += 1
+        _send(conn, {"type": "room_closed", "room": room})
+
+    async def heartbeat():
+        while True:
+            _send(conn, {"type": "health", "metrics": _worker_metrics(rooms, stats)})
+            await asyncio.sleep(heartbeat_interval)
+
+    loop.add_reader(conn.fileno(), on_readable)
+    heartbeat_task = asyncio.create_task(heartbeat())
+    # Each worker is scraped and probed on its own port
+    metrics_server = get_metrics_server()
+    if METRICS_PORT > 0:
+        metrics_server.port = METRICS_PORT + 1 + worker_id
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            # Calls still run; the probe is just unreachable
+            logger.error(f"Worker {worker_id} metrics server failed to start: {e}")
+    logger.info(f"Worker {worker_id} started (pid {os.getpid()})")
+
+    try:
+        while True:
+            command = await commands.get()
+            if command["cmd"] == "assign":
+                room = command["room"]
+                if room not in rooms:
+                    task = asyncio.create_task(run_room(room))
+                    task.add_done_callback(lambda t, room=room: on_room_done(room, t))
+                    rooms[room] = task
+                    stats["rooms_started"] += 1
+            elif command["cmd"] == "release":
+                task = rooms.pop(command["room"], None)
+                if task is not None:
+                    task.cancel()
+            elif command["cmd"] == "stop":
+                break
+    finally:
+        metrics_server.drain()
+        heartbeat_task.cancel()
+        for task in rooms.values():
+            task.cancel()
+        await asyncio.gather(heartbeat_task, *rooms.values(), return_exceptions=True)
+        await metrics_server.stop()
+        await close_pool()
+        logger.info(f"Worker {worker_id} stopped")
+
+
+def _worker_metrics(rooms: Dict[str, asyncio.Task], stats: dict) -> dict:
+    """Collect the metrics a worker reports with each heartbeat."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "pid": os.getpid(),
+        "load": len(rooms),
+        "rooms": sorted(rooms),
+        "max_rss_kb": usage.ru_maxrss,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "http_pool": get_pool().get_stats(),
+        "rate_limits": get_rate_limit_stats(),
+        **stats,
+    }
+
+
+def _send(conn, message: dict) -> None:
+    try:
+        conn.send(message)
+    except (BrokenPipeError, OSError):
+        pass
+
+
+@dataclass
+class WorkerHandle:
+    """Supervisor-side state for one worker process."""
+    worker_id: int
+    process: multiprocessing.Process
+    conn: object
+    rooms: Set[str] = field(default_factory=set)
+    restarts: int = 0
+    last_heartbeat: float = field(default_factory=time.monotonic)
+    metrics: dict = field(default_factory=dict)
+
+
+class Supervisor:
+    """Starts, load-balances, monitors and restarts worker processes."""
+
+    def __init__(
+        self,
+        num_workers: int,
+        room_runner: str,
+        heartbeat_interval: float = WORKER_HEARTBEAT_INTERVAL,
+        heartbeat_timeout: float = WORKER_HEARTBEAT_TIMEOUT,
+        restart_delay: float = WORKER_RESTART_DELAY,
+    ):
+        """Initialize supervisor.
+
+        Args:
+            num_workers: Number of worker processes
+            room_runner: ``module:function`` coroutine function hosting one room in a worker
+            heartbeat_interval: Seconds between worker health reports
+            heartbeat_timeout: Seconds without a report before a worker is restarted
+            restart_delay: Seconds to wait before restarting a dead worker
+        """
+        self.num_workers = num_workers
+        self.room_runner = room_runner
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.restart_delay = restart_delay
+
+        # Spawned (not forked) so workers never inherit the supervisor's event loop state
+        self._context = multiprocessing.get_context("spawn")
+        self.workers: Dict[int, WorkerHandle] = {}
+        self._monitor: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self) -> None:
+        """
+        Start all workers and the health monitor.
+        启动所有工作进程和健康监控
+        """
+        for worker_id in range(self.num_workers):
+            self.workers[worker_id] = self._spawn(worker_id)
+        self._monitor = asyncio.create_task(self._monitor_loop())
+        logger.info(f"Supervisor started {self.num_workers} workers")
+
+    async def assign(self, room: str) -> int:
+        """
+        Assign a room to the least-loaded live worker.
+        将房间分配给负载最小的工作进程
+
+        Returns:
+            Worker ID hosting the room
+        """
+        for handle in self.workers.values():
+            if room in handle.rooms:
+                return handle.worker_id
+
+        live = [h for h in self.workers.values() if h.process.is_alive()]
+        if not live:
+            raise Exception("No live workers available")
+
+        handle = min(live, key=lambda h: (len(h.rooms), h.metrics.get("load", 0), h.worker_id))
+        handle.rooms.add(room)
+        _send(handle.conn, {"cmd": "assign", "room": room})
+        logger.info(f"Room {room} assigned to worker {handle.worker_id}")
+        return handle.worker_id
+
+    async def release(self, room: str) -> None:
+        """Stop hosting a room."""
+        for handle in self.workers.values():
+            if room in handle.rooms:
+                handle.rooms.discard(room)
+                _send(handle.conn, {"cmd": "release", "room": room})
+
+    def get_health(self) -> dict:
+        """
+        Aggregate health and metrics across workers.
+        汇总所有工作进程的健康状态与指标
+        """
+        now = time.monotonic()
+        workers = {}
+        for worker_id, handle in self.workers.items():
+            workers[worker_id] = {
+                "pid": handle.process.pid,
+                "alive": handle.process.is_alive(),
+                "restarts": handle.restarts,
+                "rooms": sorted(handle.rooms),
+                "heartbeat_age": now - handle.last_heartbeat,
+                "metrics": handle.metrics,
+            }
+
+        return {
+            "workers": workers,
+            "live_workers": sum(1 for w in workers.values() if w["alive"]),
+            "total_rooms": sum(len(h.rooms) for h in self.workers.values()),
+            "total_restarts": sum(h.restarts for h in self.workers.values()),
+            "max_rss_kb": sum(h.metrics.get("max_rss_kb", 0) for h in self.workers.values()),
+        }
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stop all workers gracefully, terminating any that do not exit in time.
+        优雅停止所有工作进程
+        """
+        self._stopping = True
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+
+        loop = asyncio.get_running_loop()
+        for handle in self.workers.values():
+            self._unwatch(handle)
+            _send(handle.conn, {"cmd": "stop"})
+        for handle in self.workers.values():
+            await loop.run_in_executor(None, handle.process.join, timeout)
+            if handle.process.is_alive():
+                logger.warning(f"Worker {handle.worker_id} did not stop, terminating")
+                handle.process.terminate()
+                await loop.run_in_executor(None, handle.process.join, timeout)
+            handle.conn.close()
+        logger.info("Supervisor stopped")
+
+    def _spawn(self, worker_id: int) -> WorkerHandle:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=run_worker,
+            args=(child_conn, worker_id, self.room_runner, self.heartbeat_interval),
+            name=f"voiceai-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+
+        handle = WorkerHandle(worker_id=worker_id, process=process, conn=parent_conn)
+        asyncio.get_running_loop().add_reader(parent_conn.fileno(), self._on_message, handle)
+        logger.info(f"Worker {worker_id} spawned (pid {process.pid})")
+        return handle
+
+    def _unwatch(self, handle: WorkerHandle) -> None:
+        try:
+            asyncio.get_running_loop().remove_reader(handle.conn.fileno())
+        except (OSError, ValueError):
+            pass
+
+    def _on_message(self, handle: WorkerHandle) -> None:
+        try:
+            message = handle.conn.recv()
+        except (EOFError, OSError):
+            # Worker exited; the monitor restarts it
+            self._unwatch(handle)
+            return
+
+        if message["type"] == "health":
+            handle.last_heartbeat = time.monotonic()
+            handle.metrics = message["metrics"]
+        elif message["type"] == "room_closed":
+            handle.rooms.discard(message["room"])
+
+    async def _monitor_loop(self) -> None:
+        """Restart workers that died or stopped reporting."""
+        while not self._stopping:
+            await asyncio.sleep(min(self.heartbeat_interval, 1.0))
+            now = time.monotonic()
+            for worker_id, handle in list(self.workers.items()):
+                if not handle.process.is_alive():
+                    logger.error(f"Worker {worker_id} exited with code {handle.process.exitcode}")
+                elif now - handle.last_heartbeat > self.heartbeat_timeout:
+                    logger.error(f"Worker {worker_id} missed heartbeats, killing it")
+                    handle.process.kill()
+                    # Off the loop: heartbeats and pipe reads of the other workers keep flowing
+                    await asyncio.get_running_loop().run_in_executor(None, handle.process.join, 1.0)
+                else:
+                    continue
+                await self._restart(handle)
+
+    async def _restart(self, handle: WorkerHandle) -> None:
+        """Replace a dead worker and re-home its rooms."""
+        self._unwatch(handle)
+        handle.conn.close()
+        await asyncio.sleep(self.restart_delay)
+
+        replacement = self._spawn(handle.worker_id)
+        replacement.restarts = handle.restarts + 1
+        self.workers[handle.worker_id] = replacement
+
+        for room in sorted(handle.rooms):
+            await self.assign(room)
@@ -10,6 +10,18 @@ from doubao_stt import DoubaoSTTService, get_service as get_stt_service
 from doubao_tts import DoubaoTTSService, get_service as get_tts_service
 
 
+async def start_local_server(app):
+    """Start an aiohttp app on a free local port and return (runner, base_url)."""
+    from aiohttp import web
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
 async def test_doubao_stt():
     """Test Doubao STT service."""
     logger.info("Testing Doubao STT service...")
@@ -100,6 +112,1746 @@ async def test_zhipu_glm():
         return False
 
 
+async def test_http_pool():
+    """Test shared HTTP connection pool reuses connections."""
+    logger.info("Testing shared HTTP connection pool...")
+
+    try:
+        from aiohttp import web
+        from http_client import HTTPClientPool
+
+        async def handle(request):
+            return web.json_response({"code": "20000000"})
+
+        app = web.Application()
+        app.router.add_post("/ping", handle)
+        runner, base_url = await start_local_server(app)
+
+        pool = HTTPClientPool()
+        try:
+            session = await pool.get_session()
+            assert session is await pool.get_session(), "Session should be shared"
+
+            for _ in range(3):
+                async with session.post(f"{base_url}/ping", json={}) as response:
+                    await response.json()
+
+            stats = pool.get_stats()
+            logger.info(f"Pool stats: {stats}")
+            assert stats["requests"] == 3
+            assert stats["connections_created"] == 1, "Keep-alive connection should be reused"
+            assert stats["connections_reused"] == 2
+        finally:
+            await pool.close()
+            await runner.cleanup()
+
+        assert not pool.get_stats()["open"]
+
+        logger.success("Shared HTTP connection pool test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Shared HTTP connection pool test failed: {e}")
+        return False
+
+
+async def test_zhipu_glm_stream():
+    """Test Zhipu GLM streaming chat against a local SSE server."""
+    logger.info("Testing Zhipu GLM streaming chat...")
+
+    try:
+        import json
+        from aiohttp import web
+        from http_client import close_pool
+        from zhipu_llm import ZhipuGLMService
+
+        received = {}
+
+        async def handle(request):
+            received["body"] = await request.json()
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for delta in ["你好", "，我是", "语音助手。"]:
+                chunk = {"choices": [{"index": 0, "delta": {"content": delta}}]}
+                await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            return response
+
+        app = web.Application()
+        app.router.add_post("/chat/completions", handle)
+        runner, base_url = await start_local_server(app)
+
+        try:
+            glm_service = ZhipuGLMService(api_key="test-key")
+            glm_service.base_url = base_url + "/"
+            messages = [{"role": "user", "content": "你好"}]
+
+            deltas = [d async for d in glm_service.chat_stream(messages, system_prompt="You are helpful.")]
+            assert deltas == ["你好", "，我是", "语音助手。"], deltas
+            assert received["body"]["messages"][0] == {"role": "system", "content": "You are helpful."}
+
+            reply = await glm_service.chat(messages)
+            assert reply == "你好，我是语音助手。", reply
+        finally:
+            await close_pool()
+            await runner.cleanup()
+
+        logger.success("Zhipu GLM streaming chat test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Zhipu GLM streaming chat test failed: {e}")
+        return False
+
+
+async def test_sentence_tts_pipeline():
+    """Test sentence-level LLM-to-TTS pipelining preserves order."""
+    logger.info("Testing sentence TTS pipeline...")
+
+    try:
+        from tts_pipeline import SentenceSegmenter, SentenceTTSPipeline
+
+        segmenter = SentenceSegmenter(max_chars=20)
+        segments = []
+        for delta in ["你好，我是", "助手。Pi is 3", ".14 today. OK", "!剩下的"]:
+            segments += segmenter.push(delta)
+        assert segments == ["你好，我是助手。", "Pi is 3.14 today.", "OK!"], segments
+        assert segmenter.flush() == "剩下的"
+
+        class FakeTTS:
+            def __init__(self):
+                self.active = 0
+                self.max_active = 0
+
+            async def synthesize(self, text, voice=None):
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                # Earlier sentences take longer, so completion order differs from playback order
+                await asyncio.sleep(0.05 if text.startswith("第一") else 0.01)
+                self.active -= 1
+                return text.encode()
+
+        async def llm_stream():
+            for delta in ["第一句话。", "第二句", "话。第三句话！", "结尾"]:
+                await asyncio.sleep(0.005)
+                yield delta
+
+        tts = FakeTTS()
+        pipeline = SentenceTTSPipeline(tts, max_concurrency=2)
+        played = [segment.text async for segment in pipeline.synthesize_stream(llm_stream())]
+
+        assert played == ["第一句话。", "第二句话。", "第三句话！", "结尾"], played
+        assert tts.max_active == 2, f"Expected overlapping synthesis, got {tts.max_active}"
+
+        logger.success("Sentence TTS pipeline test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Sentence TTS pipeline test failed: {e}")
+        return False
+
+
+async def test_doubao_stt_stream():
+    """Test streaming recognition against a local stand-in websocket server."""
+    logger.info("Testing Doubao streaming STT...")
+
+    try:
+        import json
+        import websockets
+        from doubao_stt import (
+            DoubaoSTTService, build_packet, parse_packet,
+            MSG_FULL_CLIENT_REQUEST, MSG_AUDIO_ONLY_REQUEST, MSG_FULL_SERVER_RESPONSE,
+            FLAG_LAST_PACKET, FLAG_POSITIVE_SEQUENCE, FLAG_NEGATIVE_SEQUENCE,
+        )
+
+        received = {"audio_bytes": 0, "packets": 0}
+
+        async def handler(websocket):
+            request = parse_packet(await websocket.recv())
+            assert request["message_type"] == MSG_FULL_CLIENT_REQUEST
+            received["request"] = request["payload"]
+
+            async for message in websocket:
+                packet = parse_packet(message)
+                assert packet["message_type"] == MSG_AUDIO_ONLY_REQUEST
+                received["packets"] += 1
+                received["audio_bytes"] += len(packet["payload"])
+
+                is_last = packet["flags"] == FLAG_LAST_PACKET
+                if received["packets"] == 1:
+                    utterances = [{"text": "你好", "definite": False}]
+                else:
+                    utterances = [
+                        {"text": "你好。", "definite": True, "start_time": 0, "end_time": 800},
+                        {"text": "今天天气" if not is_last else "今天天气不错。", "definite": False},
+                    ]
+                payload = json.dumps({"result": {"utterances": utterances}}).encode()
+                flags = FLAG_NEGATIVE_SEQUENCE if is_last else FLAG_POSITIVE_SEQUENCE
+                sequence = -received["packets"] if is_last else received["packets"]
+                await websocket.send(build_packet(MSG_FULL_SERVER_RESPONSE, flags, payload, sequence=sequence))
+                if is_last:
+                    break
+
+        async with websockets.serve(handler, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            stt_service = DoubaoSTTService()
+            stt_service.stream_url = f"ws://127.0.0.1:{port}"
+
+            stream = await stt_service.open_stream(sample_rate=16000, chunk_ms=100)
+            # 250 ms of silence in 20 ms transport frames -> two full 100 ms packets + remainder
+            for _ in range(12):
+                await stream.send_audio(b"\x00\x00" * 320)
+            await stream.finish()
+
+            transcripts = [(t.text, t.is_final) async for t in stream.results()]
+            await stream.close()
+
+        assert received["request"]["audio"]["rate"] == 16000
+        assert received["packets"] == 3 and received["audio_bytes"] == 12 * 640, received
+        assert transcripts == [
+            ("你好", False),
+            ("你好。", True),
+            ("今天天气", False),
+            ("今天天气不错。", True),
+        ], transcripts
+
+        logger.success("Doubao streaming STT test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Doubao streaming STT test failed: {e}")
+        return False
+
+
+async def test_result_poller():
+    """Test adaptive polling, deadlines and cancellation on one scheduler."""
+    logger.info("Testing STT result poller...")
+
+    try:
+        import time
+        from result_poller import ResultPoller, TaskPendingError
+
+        # Task "a" finishes on the 2nd poll, "b" on the 5th, "c" never, "d" fails
+        ready_after = {"a": 2, "b": 5, "c": 10 ** 6, "d": 1, "e": 10 ** 6}
+        polls = {task_id: 0 for task_id in ready_after}
+
+        async def fetch(task_id):
+            polls[task_id] += 1
+            if task_id == "d":
+                raise Exception("Task failed upstream")
+            if polls[task_id] < ready_after[task_id]:
+                raise TaskPendingError(task_id)
+            return {"text": f"result-{task_id}"}
+
+        poller = ResultPoller(fetch, initial_interval=0.01, fast_polls=2, backoff=2.0, max_interval=0.04, deadline=0.3)
+        assert [poller.next_interval(n) for n in range(5)] == [0.01, 0.01, 0.02, 0.04, 0.04]
+
+        waiter = asyncio.create_task(poller.wait("e", deadline=10.0))
+        results = await poller.wait_many(["a", "b", "c", "d"])
+        assert results["a"] == {"text": "result-a"}
+        assert results["b"] == {"text": "result-b"}
+        assert isinstance(results["c"], asyncio.TimeoutError)
+        assert str(results["d"]) == "Task failed upstream"
+
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        polls_after_cancel = polls["e"]
+        await asyncio.sleep(0.1)
+        assert polls["e"] == polls_after_cancel, "Cancelled task must not be polled again"
+
+        stats = poller.get_stats()
+        logger.info(f"Poller stats: {stats}")
+        assert stats["completed"] == 2 and stats["failed"] == 1 and stats["timed_out"] == 1
+        assert stats["cancelled"] == 1 and stats["pending"] == 0
+        assert stats["max_polls_per_task"] == polls["c"]
+
+        # A fetch that hangs is cut off at the task's deadline, not the HTTP timeout
+        async def hang(task_id):
+            await asyncio.sleep(10)
+
+        hung = ResultPoller(hang, deadline=0.1)
+        started = time.monotonic()
+        try:
+            await hung.wait("h")
+            assert False, "Hung fetch must time out"
+        except asyncio.TimeoutError:
+            pass
+        assert time.monotonic() - started < 0.5
+        await asyncio.sleep(0)  # Let the finished poll leave the in-flight set
+        assert hung.get_stats()["timed_out"] == 1 and hung.get_stats()["pending"] == 0
+
+        logger.success("STT result poller test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"STT result poller test failed: {e}")
+        return False
+
+
+async def test_tts_cache():
+    """Test TTS audio cache tiers and cached synthesis."""
+    logger.info("Testing TTS audio cache...")
+
+    try:
+        import base64
+        import tempfile
+        from aiohttp import web
+        from doubao_tts import DoubaoTTSService
+        from http_client import close_pool
+        from tts_cache import TTSAudioCache, cache_key
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = TTSAudioCache(max_memory_bytes=10, disk_dir=cache_dir, max_disk_bytes=12)
+            key_a, key_b = cache_key("请稍等", "v1"), cache_key("请稍等", "v1", speed_ratio=1.2)
+            assert key_a != key_b
+
+            cache.put(key_a, b"aaaaaa")
+            cache.put(key_b, b"bbbbbb")  # Evicts key_a from memory (10-byte budget)
+            assert cache.get(key_b) == b"bbbbbb"
+            from_disk = cache.get(key_a)
+            assert isinstance(from_disk, memoryview) and from_disk == b"aaaaaa"
+
+            # key_a was just used, so key_b is the least recently used entry in both tiers
+            cache.put(cache_key("好的", "v1"), b"cccccc")
+            assert cache.get(key_b) is None
+
+            stats = cache.get_stats()
+            assert stats["memory_hits"] == 1 and stats["disk_hits"] == 1 and stats["misses"] == 1
+            assert stats["memory_evictions"] == 2 and stats["disk_evictions"] == 1
+
+            reloaded = TTSAudioCache(max_memory_bytes=10, disk_dir=cache_dir, max_disk_bytes=12)
+            assert reloaded.get(key_a) == b"aaaaaa"
+
+        calls = []
+
+        async def handle(request):
+            body = await request.json()
+            calls.append(body["request"]["text"])
+            await asyncio.sleep(0.02)
+            audio = f"audio:{body['request']['text']}".encode()
+            return web.json_response({"code": "20000000", "data": base64.b64encode(audio).decode()})
+
+        app = web.Application()
+        app.router.add_post("/tts", handle)
+        runner, base_url = await start_local_server(app)
+
+        try:
+            tts_service = DoubaoTTSService()
+            tts_service.api_url = f"{base_url}/tts"
+            tts_service.cache = TTSAudioCache(max_memory_bytes=1024)
+
+            assert await tts_service.prewarm(["你好", "请稍等"]) == 2
+            first, second = await asyncio.gather(
+                tts_service.synthesize("再见"), tts_service.synthesize("再见")
+            )
+            assert first == second == "audio:再见".encode()
+            assert await tts_service.synthesize("请稍等") == "audio:请稍等".encode()
+            assert sorted(calls) == sorted(["你好", "请稍等", "再见"]), calls
+
+            # The first caller barging in does not take the shared request from the others
+            owner = asyncio.create_task(tts_service.synthesize("谢谢"))
+            await asyncio.sleep(0.005)
+            joiner = asyncio.create_task(tts_service.synthesize("谢谢"))
+            await asyncio.sleep(0.005)
+            owner.cancel()
+            assert await joiner == "audio:谢谢".encode() and owner.cancelled()
+            assert calls.count("谢谢") == 1, calls
+
+            # Once every caller has left the upstream request is cancelled
+            alone = asyncio.create_task(tts_service.synthesize("不用了"))
+            await asyncio.sleep(0.005)
+            alone.cancel()
+            await asyncio.gather(alone, return_exceptions=True)
+            await asyncio.sleep(0)
+            assert not tts_service._in_flight
+        finally:
+            await close_pool()
+            await runner.cleanup()
+
+        logger.info(f"TTS cache stats: {tts_service.cache.get_stats()}")
+        logger.success("TTS audio cache test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"TTS audio cache test failed: {e}")
+        return False
+
+
+async def test_session_manager():
+    """Test per-session isolation and admission control."""
+    logger.info("Testing session manager...")
+
+    try:
+        from session_manager import SessionLimitError, SessionManager, VoiceSession
+
+        class FakeLLM:
+            async def chat_stream(self, messages, system_prompt=None):
+                for delta in [f"第{len(messages)}条", "回复。"]:
+                    yield delta
+
+        class FakeTTS:
+            async def synthesize(self, text, voice=None):
+                return text.encode()
+
+        def factory(session_id):
+            return VoiceSession(session_id=session_id, stt=None, llm=FakeLLM(), tts=FakeTTS())
+
+        manager = SessionManager(factory, max_sessions=2)
+        alice = await manager.create("alice")
+        bob = await manager.create("bob")
+        assert alice.tts_pipeline is not bob.tts_pipeline
+
+        try:
+            await manager.create("carol")
+            raise AssertionError("Third session should have been rejected")
+        except SessionLimitError:
+            pass
+
+        segments = [segment.text async for segment in alice.run_turn("你好")]
+        assert segments == ["第1条回复。"], segments
+        assert len(alice.messages) == 2 and bob.messages == []
+
+        background = alice.spawn(asyncio.sleep(10))
+        await manager.close("alice")
+        assert background.cancelled()
+        assert manager.get("alice") is None
+
+        await manager.create("carol")
+        stats = manager.get_stats()
+        assert stats == {"created": 3, "closed": 1, "rejected": 1, "active": 2, "max_sessions": 2}, stats
+        await manager.close_all()
+        assert len(manager) == 0
+
+        logger.success("Session manager test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Session manager test failed: {e}")
+        return False
+
+
+async def test_supervisor():
+    """Test multi-process worker assignment, health and restart with the stub transport."""
+    logger.info("Testing multi-process supervisor...")
+
+    try:
+        from supervisor import Supervisor
+
+        supervisor = Supervisor(
+            num_workers=2,
+            room_runner="stub_transport:run_stub_room",
+            heartbeat_interval=0.2,
+            heartbeat_timeout=5.0,
+            restart_delay=0.1,
+        )
+        await supervisor.start()
+        try:
+            assigned = [await supervisor.assign(room) for room in ["room-a", "room-b", "room-c"]]
+            assert sorted(assigned) == [0, 0, 1], assigned
+
+            async def wait_for(condition, timeout=15.0):
+                deadline = asyncio.get_running_loop().time() + timeout
+                while not condition():
+                    if asyncio.get_running_loop().time() > deadline:
+                        raise AssertionError(f"Timed out: {supervisor.get_health()}")
+                    await asyncio.sleep(0.1)
+
+            def worker_loads():
+                return {w: s["metrics"].get("load") for w, s in supervisor.get_health()["workers"].items()}
+
+            await wait_for(lambda: worker_loads() == {0: 2, 1: 1})
+
+            # Crash worker 0; its rooms must come back on a restarted worker
+            supervisor.workers[0].process.kill()
+            await wait_for(lambda: supervisor.get_health()["total_restarts"] == 1)
+            await wait_for(lambda: sum(load or 0 for load in worker_loads().values()) == 3)
+
+            health = supervisor.get_health()
+            assert health["live_workers"] == 2 and health["total_rooms"] == 3, health
+            hosted = sorted(room for w in health["workers"].values() for room in w["metrics"]["rooms"])
+            assert hosted == ["room-a", "room-b", "room-c"], hosted
+        finally:
+            await supervisor.stop()
+
+        assert not any(h.process.is_alive() for h in supervisor.workers.values())
+
+        logger.success("Multi-process supervisor test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Multi-process supervisor test failed: {e}")
+        return False
+
+
+async def test_turn_latency():
+    """Test per-turn stage spans and percentile histograms."""
+    logger.info("Testing turn latency instrumentation...")
+
+    try:
+        from metrics import Histogram, LatencyTracker, TurnTracker, mark
+        from rtvi.events import RTVIEvent
+        from session_manager import VoiceSession
+
+        histogram = Histogram("test")
+        for value in range(1, 101):
+            histogram.observe(value / 100)
+        assert histogram.percentile(50) == 0.5 and histogram.percentile(99) == 0.99
+        assert histogram.bucket_counts[histogram.buckets.index(0.5)] == 50
+
+        class FakeLLM:
+            async def chat_stream(self, messages, system_prompt=None):
+                mark("llm_request")
+                await asyncio.sleep(0.02)
+                for delta in ["你好。", "再见。"]:
+                    mark("llm_first_token")
+                    yield delta
+                mark("llm_last_token")
+
+        class FakeTTS:
+            async def synthesize(self, text, voice=None):
+                mark("tts_request")
+                await asyncio.sleep(0.01)
+                mark("tts_first_audio")
+                return text.encode()
+
+        tracker = LatencyTracker()
+        session = VoiceSession(
+            session_id="s1", stt=None, llm=FakeLLM(), tts=FakeTTS(),
+            turns=TurnTracker("s1", tracker=tracker),
+        )
+
+        # RTVI events open the turn at VAD end; the turn runner completes it
+        session.turns.on_event("user_stopped_speaking")
+        await asyncio.sleep(0.01)
+        session.turns.on_event("user_transcription", text="你好", final=True)
+        _ = [segment async for segment in session.run_turn("你好")]
+
+        record = session.turns.completed[-1]
+        stages = record["stages_ms"]
+        assert set(stages) == {"stt", "llm_first_token", "llm_total", "tts_first_audio", "mouth_to_ear"}, stages
+        assert stages["llm_first_token"] >= 20 and stages["mouth_to_ear"] >= stages["llm_first_token"]
+        assert session.turns.current is None
+
+        summary = tracker.get_summary()
+        assert summary["mouth_to_ear"]["count"] == 1 and summary["mouth_to_ear"]["p95"] is not None
+
+        # Interim transcripts forwarded from frames keep final=False and leave the STT stage open
+        class TranscriptionFrame:
+            def __init__(self, text, final=True):
+                self.text = text
+                self.final = final
+
+        turns = TurnTracker("r1", tracker=LatencyTracker())
+        turns.on_event("user_stopped_speaking")
+        interim = RTVIEvent.from_frame("user_transcription", TranscriptionFrame("今天", final=False))
+        turns.on_event(interim.name, final=interim.final)
+        assert interim.final is False and "stt_final" not in turns.current.marks
+        final = RTVIEvent.from_frame("user_transcription", TranscriptionFrame("今天天气"))
+        turns.on_event(final.name, final=final.final)
+        assert "stt_final" in turns.current.marks
+
+        logger.success("Turn latency instrumentation test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Turn latency instrumentation test failed: {e}")
+        return False
+
+
+async def test_benchmark():
+    """Test the offline load-test harness against the mock upstream."""
+    logger.info("Testing benchmark harness...")
+
+    try:
+        from benchmark import format_report, run_benchmark
+        from mock_servers import MockConfig
+
+        config = MockConfig(
+            stt_latency=0.05, tts_latency=0.01, tts_latency_per_char=0.0,
+            llm_first_token_latency=0.02, llm_token_rate=0,
+        )
+        report = await run_benchmark(sessions=3, turns=2, config=config)
+
+        assert report["turns"] == 6 and report["failed_turns"] == 0, report
+        assert report["upstream"]["stt_submit"] == 6 and report["upstream"]["chat"] == 6
+        assert report["stages_ms"]["mouth_to_ear"]["count"] == 6
+        assert report["stages_ms"]["stt"]["p50"] >= 50
+        assert report["memory_per_session_kb"] > 0
+        assert "mouth_to_ear" in format_report(report)
+
+        # Injected upstream errors surface as failed turns, not crashed sessions
+        report = await run_benchmark(sessions=2, turns=2, config=MockConfig(
+            stt_latency=0.0, llm_first_token_latency=0.0, llm_token_rate=0, error_rate=1.0,
+        ))
+        assert report["failed_turns"] == 4 and report["failed_sessions"] == 0, report
+
+        logger.success("Benchmark harness test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Benchmark harness test failed: {e}")
+        return False
+
+
+async def test_tts_stream():
+    """Test streamed TTS audio framing, caching and sentence pipelining."""
+    logger.info("Testing streaming TTS...")
+
+    try:
+        from mock_servers import MockConfig, MockUpstream
+        from tts_cache import TTSAudioCache
+        from tts_pipeline import SentenceTTSPipeline
+
+        upstream = MockUpstream(MockConfig(tts_latency=0.01, tts_latency_per_char=0.0, audio_bytes_per_char=700))
+        await upstream.start()
+        try:
+            tts = DoubaoTTSService()
+            tts.stream_url = upstream.tts_stream_url
+            tts.cache = TTSAudioCache(max_memory_bytes=1 << 20, disk_dir=None)
+
+            # 16 kHz, 20 ms frames = 640 bytes; 4 chars x 700 bytes = 2800 bytes
+            frames = [f async for f in tts.synthesize_stream("你好世界", sample_rate=16000, max_buffered_frames=2)]
+            assert [len(f) for f in frames] == [640] * 4 + [240], [len(f) for f in frames]
+            assert upstream.stats["tts_stream"] == 1
+
+            # Short replies are cached and replayed in the same framing
+            again = [f async for f in tts.synthesize_stream("你好世界", sample_rate=16000)]
+            assert again == frames and upstream.stats["tts_stream"] == 1
+
+            # Stopping early cancels the upstream read
+            stream = tts.synthesize_stream("很长的一段回复" * 20, sample_rate=16000, use_cache=False)
+            await stream.__anext__()
+            await stream.aclose()
+
+            pipeline = SentenceTTSPipeline(tts, max_concurrency=2)
+
+            async def deltas():
+                for delta in ["第一句。", "第二句话。", "三"]:
+                    yield delta
+
+            chunks = [c async for c in pipeline.stream_audio(deltas())]
+            assert sum(len(c) for c in chunks) == 700 * (4 + 5 + 1), sum(len(c) for c in chunks)
+        finally:
+            await upstream.stop()
+
+        logger.success("Streaming TTS test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Streaming TTS test failed: {e}")
+        return False
+
+
+async def test_interruption():
+    """Test barge-in cancelling the in-flight reply and truncating context."""
+    logger.info("Testing interruption handling...")
+
+    try:
+        from session_manager import VoiceSession
+
+        state = {"llm_cancelled": False, "tts_calls": 0}
+
+        class SlowLLM:
+            async def chat_stream(self, messages, system_prompt=None):
+                try:
+                    for delta in ["第一句。", "第二句。", "第三句。", "第四句。"]:
+                        yield delta
+                        await asyncio.sleep(0.05)
+                except asyncio.CancelledError:
+                    state["llm_cancelled"] = True
+                    raise
+
+        class FakeTTS:
+            async def synthesize(self, text, voice=None):
+                state["tts_calls"] += 1
+                await asyncio.sleep(0.01)
+                return text.encode()
+
+        session = VoiceSession(session_id="s1", stt=None, llm=SlowLLM(), tts=FakeTTS())
+        played = []
+        async for segment in session.run_turn("讲个故事"):
+            played.append(segment.text)
+            session.interruptions.bot_started_speaking()
+            # User talks over the first sentence
+            assert await session.interruptions.user_started_speaking()
+
+        assert played == ["第一句。"], played
+        assert state["llm_cancelled"] and state["tts_calls"] < 4, state
+        assert session.messages[-1] == {"role": "assistant", "content": "第一句。"}, session.messages
+        assert session.interruptions.get_stats()["interruptions"] == 1
+        assert not session.interruptions.bot_speaking
+
+        # User speech while the bot is silent does not interrupt; the next turn runs in full
+        assert not await session.interruptions.user_started_speaking()
+        state["llm_cancelled"] = False
+        played = [segment.text async for segment in session.run_turn("继续")]
+        assert len(played) == 4 and not state["llm_cancelled"]
+        assert session.messages[-1]["content"] == "第一句。第二句。第三句。第四句。"
+
+        logger.success("Interruption handling test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Interruption handling test failed: {e}")
+        return False
+
+
+async def test_vad():
+    """Test VAD onset/endpoint detection and silence trimming."""
+    logger.info("Testing VAD...")
+
+    try:
+        import numpy as np
+        from vad import EVENT_AUDIO, EVENT_STARTED, EVENT_STOPPED, VADProcessor
+
+        rate = 16000
+        rng = np.random.default_rng(0)
+
+        def silence(ms):
+            return (rng.normal(0, 30, rate * ms // 1000)).astype("<i2").tobytes()
+
+        def tone(ms):
+            t = np.arange(rate * ms // 1000) / rate
+            return (np.sin(2 * np.pi * 220 * t) * 8000).astype("<i2").tobytes()
+
+        vad = VADProcessor(sample_rate=rate, start_ms=60, stop_ms=300, pre_roll_ms=100, hangover_ms=40)
+        audio = silence(1000) + tone(500) + silence(100) + tone(300) + silence(1000)
+
+        events = []
+        # Odd chunk size exercises the partial-frame remainder
+        for offset in range(0, len(audio), 1234):
+            events.extend(vad.process(audio[offset:offset + 1234]))
+        events.extend(vad.flush())
+
+        kinds = [e.kind for e in events if e.kind != EVENT_AUDIO]
+        assert kinds == [EVENT_STARTED, EVENT_STOPPED], kinds
+        speech = sum(len(e.audio) for e in events if e.kind == EVENT_AUDIO)
+        # 900 ms of speech and pause plus 100 ms pre-roll and 40 ms hangover (+/- onset rounding)
+        assert abs(speech / 32 - 1040) <= 60, speech / 32
+        stats = vad.get_stats()
+        assert stats["utterances"] == 1 and stats["trimmed_ratio"] > 0.5, stats
+
+        # Short blips below start_ms never open a turn
+        vad = VADProcessor(sample_rate=rate, start_ms=100)
+        events = vad.process(silence(200) + tone(40) + silence(200))
+        assert not [e for e in events if e.kind == EVENT_STARTED]
+
+        logger.success("VAD test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"VAD test failed: {e}")
+        return False
+
+
+async def test_conversation_context():
+    """Test token budgeting, pinned system prompt and rolling summarization."""
+    logger.info("Testing conversation context...")
+
+    try:
+        from conversation_context import ConversationContext, count_message_tokens, estimate_tokens
+        from metrics import LatencyTracker, TurnTracker
+        from session_manager import VoiceSession
+
+        assert estimate_tokens("你好") == 2 and estimate_tokens("hello world!") == 3
+
+        calls = []
+
+        async def summarizer(previous, messages):
+            calls.append((previous, len(messages)))
+            return f"摘要{len(calls)}"
+
+        context = ConversationContext("你是语音助手。", max_tokens=200, keep_messages=2, summarizer=summarizer)
+        for i in range(12):
+            context.add_user(f"第{i}个问题" + "内容" * 5)
+            context.add_assistant(f"第{i}个回答" + "内容" * 5)
+
+        # Over budget before compaction: build() trims the view, never the system prompt
+        prompt = context.build()
+        assert prompt[0] == {"role": "system", "content": "你是语音助手。"}
+        assert prompt[1]["role"] == "user" and count_message_tokens(prompt) <= 200
+
+        assert await context.compact()
+        assert calls == [(None, calls[0][1])] and context.summary == "摘要1"
+        assert count_message_tokens(context.build()) <= 120, context.get_stats()
+        assert context.messages[0]["role"] == "user"
+
+        # Between compactions the prefix is identical, so upstream prompt caching applies
+        before = context.build()
+        context.add_user("新问题")
+        after = context.build()
+        assert after[:len(before)] == before
+        assert "摘要1" in after[0]["content"] and after[0]["content"].startswith("你是语音助手。")
+        assert not await context.compact()
+
+        # Prompt size is reported per turn
+        class EchoLLM:
+            async def chat_stream(self, messages, system_prompt=None):
+                yield "好的。"
+
+        class FakeTTS:
+            async def synthesize(self, text, voice=None):
+                return text.encode()
+
+        tracker = LatencyTracker()
+        session = VoiceSession(
+            session_id="s1", stt=None, llm=EchoLLM(), tts=FakeTTS(),
+            system_prompt="你是语音助手。", turns=TurnTracker("s1", tracker=tracker),
+        )
+        _ = [segment async for segment in session.run_turn("你好")]
+        assert session.turns.completed[-1]["values"]["prompt_tokens"] == count_message_tokens(
+            [{"role": "system", "content": "你是语音助手。"}, {"role": "user", "content": "你好"}]
+        )
+        assert tracker.get_value_summary()["prompt_tokens"]["count"] == 1
+
+        logger.success("Conversation context test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Conversation context test failed: {e}")
+        return False
+
+
+async def test_speculative_llm():
+    """Test speculative LLM start on stable interim transcripts."""
+    logger.info("Testing speculative LLM...")
+
+    try:
+        from metrics import LatencyTracker, TurnTracker
+        from session_manager import VoiceSession
+        from speculative import SpeculationPolicy, SpeculativeLLM
+        from text_normalization import normalize_text
+
+        assert normalize_text("今天天气怎么样？ ") == normalize_text("今天天气怎么样") == "今天天气怎么样"
+        assert normalize_text("ＨＥＬＬＯ，World!") == "helloworld"
+
+        calls = []
+        cancelled = []
+
+        class SlowLLM:
+            async def chat_stream(self, messages, system_prompt=None):
+                question = messages[-1]["content"]
+                calls.append(question)
+                try:
+                    await asyncio.sleep(0.1)
+                    yield f"关于{question}。"
+                except asyncio.CancelledError:
+                    cancelled.append(question)
+                    raise
+
+        class FakeTTS:
+            async def synthesize(self, text, voice=None):
+                return text.encode()
+
+        tracker = LatencyTracker()
+        session = VoiceSession(
+            session_id="s1", stt=None, llm=SlowLLM(), tts=FakeTTS(),
+            turns=TurnTracker("s1", tracker=tracker), cache_responses=False,
+        )
+        session.speculator = SpeculativeLLM(
+            session._speculative_stream, SpeculationPolicy(enabled=True, stable_ms=30, min_chars=2)
+        )
+
+        # Interim settles; the final differs only in punctuation, so the early stream is adopted
+        session.on_interim_transcript("今天")
+        session.on_interim_transcript("今天天气怎么样")
+        await asyncio.sleep(0.15)
+        session.turns.on_event("user_stopped_speaking")
+        replies = [segment.text async for segment in session.run_turn("今天天气怎么样？")]
+        assert replies == ["关于今天天气怎么样。"] and calls == ["今天天气怎么样"], (replies, calls)
+        assert session.messages[-2]["content"] == "今天天气怎么样？"
+        assert session.turns.completed[-1]["values"]["speculation_saved_ms"] >= 100
+
+        # Final transcript differs: speculation is cancelled and the turn restarts
+        session.on_interim_transcript("明天会下雨吗")
+        await asyncio.sleep(0.05)
+        replies = [segment.text async for segment in session.run_turn("明天会下雪吗")]
+        assert replies == ["关于明天会下雪吗。"] and cancelled == ["明天会下雨吗"], (replies, cancelled)
+
+        stats = session.speculator.get_stats()
+        assert stats["adopted"] == 1 and stats["discarded"] == 1 and stats["hit_rate"] == 0.5, stats
+
+        # Barge-in during an adopted speculation closes its upstream stream
+        closed = []
+
+        class LongLLM:
+            async def chat_stream(self, messages, system_prompt=None):
+                try:
+                    for i in range(20):
+                        yield f"第{i}句。"
+                        await asyncio.sleep(0.05)
+                finally:
+                    closed.append(messages[-1]["content"])
+
+        session.llm = LongLLM()
+        session.on_interim_transcript("讲个长故事")
+        await asyncio.sleep(0.1)
+        played = []
+        async for segment in session.run_turn("讲个长故事"):
+            played.append(segment.text)
+            session.interruptions.bot_started_speaking()
+            assert await session.interruptions.user_started_speaking()
+        assert played == ["第0句。"] and closed == ["讲个长故事"], (played, closed)
+        assert session.speculator.get_stats()["adopted"] == 2
+
+        # Disabled policy never calls the LLM early
+        quiet = SpeculativeLLM(session._speculative_stream, SpeculationPolicy(enabled=False))
+        quiet.on_interim("今天天气怎么样")
+        await asyncio.sleep(0.05)
+        assert quiet.take("今天天气怎么样") is None and quiet.get_stats()["started"] == 0
+
+        logger.success("Speculative LLM test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Speculative LLM test failed: {e}")
+        return False
+
+
+async def test_response_cache():
+    """Test the normalized LLM reply cache and its TTS-cache replay."""
+    logger.info("Testing response cache...")
+
+    try:
+        from response_cache import ResponseCache
+        from session_manager import VoiceSession
+        from tts_cache import TTSAudioCache
+
+        assert not ResponseCache(max_entries=0, enabled=True).enabled
+        cache = ResponseCache(max_entries=2, ttl=0.2, enabled=True)
+        cache.put("營業時間是幾點？", "早上九点到晚上六点。", scope="a")
+        # Full-width, punctuation and traditional/simplified differences fold away
+        assert cache.get("营业时间是几点", scope="a") == "早上九点到晚上六点。"
+        assert cache.get("营业时间是几点", scope="b") is None
+        assert cache.get("好的") is None  # Too short to cache
+
+        cache.put("退货流程是什么", "请在订单页申请退货。", scope="a")
+        cache.put("怎么联系客服", "拨打400电话。", scope="a")
+        assert cache.get("营业时间是几点？", scope="a") is None  # LRU evicted
+        await asyncio.sleep(0.25)
+        assert cache.get("怎么联系客服", scope="a") is None  # Expired
+        stats = cache.get_stats()
+        assert stats["evictions"] == 1 and stats["expirations"] == 1, stats
+
+        similar = ResponseCache(similarity=0.6, enabled=True)
+        similar.put("你们的营业时间是几点", "早上九点到晚上六点。")
+        assert similar.get("营业时间是几点呀") == "早上九点到晚上六点。"
+        assert similar.get("退货流程是什么") is None
+        assert similar.get_stats()["similar_hits"] == 1
+
+        calls = {"llm": 0, "tts": 0}
+
+        class FakeLLM:
+            async def chat_stream(self, messages, system_prompt=None):
+                calls["llm"] += 1
+                for delta in ["早上九点", "到晚上六点。", "周末休息。"]:
+                    yield delta
+
+        class CountingTTS:
+            def __init__(self):
+                self.cache = TTSAudioCache(max_memory_bytes=1 << 20, disk_dir=None)
+
+            async def synthesize(self, text, voice=None):
+                audio = self.cache.get(text)
+                if audio is None:
+                    calls["tts"] += 1
+                    audio = text.encode()
+                    self.cache.put(text, audio)
+                return audio
+
+        shared = ResponseCache(enabled=True)
+        tts = CountingTTS()
+
+        def new_session(session_id, **kwargs):
+            return VoiceSession(
+                session_id=session_id, stt=None, llm=FakeLLM(), tts=tts,
+                system_prompt="客服", response_cache=shared, **kwargs,
+            )
+
+        first = [s.text async for s in new_session("s1").run_turn("营业时间是几点？")]
+        second = [s.text async for s in new_session("s2").run_turn("營業時間是幾點")]
+        # Hit: no LLM call and every sentence is served by the TTS cache
+        assert first == second and calls == {"llm": 1, "tts": 2}, (first, second, calls)
+
+        # Per-prompt and per-turn opt-out
+        _ = [s async for s in new_session("s3", cache_responses=False).run_turn("营业时间是几点")]
+        _ = [s async for s in new_session("s4").run_turn("营业时间是几点", use_response_cache=False)]
+        assert calls["llm"] == 3
+
+        # A context-dependent follow-up never gets a reply from another conversation
+        follow_up = new_session("s5")
+        _ = [s async for s in follow_up.run_turn("营业时间是几点")]
+        _ = [s async for s in follow_up.run_turn("那周末开门吗")]
+        assert calls["llm"] == 4
+        _ = [s async for s in new_session("s6").run_turn("那周末开门吗")]
+        assert calls["llm"] == 5, calls
+
+        logger.success("Response cache test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Response cache test failed: {e}")
+        return False
+
+
+async def test_llm_router():
+    """Test LLM routing: hedging, circuit breaking, failover and failback."""
+    logger.info("Testing LLM router...")
+
+    try:
+        import json
+        import time
+        from aiohttp import web
+        from openai import AsyncOpenAI
+        from http_client import close_pool
+        from llm_router import CircuitBreaker, LLMProvider, LLMRouter, OpenAIClientLLM
+        from zhipu_llm import ZhipuGLMService
+
+        class FakeLLM:
+            def __init__(self, reply, delay=0.0, fail=False):
+                self.reply = reply
+                self.delay = delay
+                self.fail = fail
+                self.calls = 0
+                self.cancelled = 0
+
+            async def chat_stream(self, messages, system_prompt=None):
+                self.calls += 1
+                try:
+                    await asyncio.sleep(self.delay)
+                    if self.fail:
+                        raise Exception("upstream 503")
+                    for delta in self.reply:
+                        yield delta
+                except asyncio.CancelledError:
+                    self.cancelled += 1
+                    raise
+
+        messages = [{"role": "user", "content": "你好"}]
+
+        # Hedging: the slow primary loses to the backup and is cancelled
+        slow, fast = FakeLLM(["慢"], delay=0.3), FakeLLM(["快", "。"])
+        router = LLMRouter(
+            [LLMProvider("slow", slow, priority=0), LLMProvider("fast", fast, priority=1)],
+            hedge=True, hedge_after=0.05,
+        )
+        assert await router.chat(messages) == "快。"
+        stats = router.get_stats()
+        assert stats["hedged"] == 1 and stats["hedge_wins"] == 1, stats
+        assert slow.cancelled == 1
+        # The measured faster provider is now preferred, no hedge needed
+        assert await router.chat(messages) == "快。" and slow.calls == 1
+
+        # Failover before the first token opens the breaker; failback through the half-open probe
+        primary, backup = FakeLLM(["主"], fail=True), FakeLLM(["备"])
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+        router = LLMRouter([LLMProvider("primary", primary, breaker=breaker), LLMProvider("backup", backup, priority=1)])
+        for _ in range(3):
+            assert await router.chat(messages) == "备"
+        assert breaker.state == CircuitBreaker.OPEN and primary.calls == 1, (breaker.state, primary.calls)
+        assert router.get_stats()["failovers"] == 1
+
+        primary.fail = False
+        await asyncio.sleep(0.12)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert await router.chat(messages) == "主"
+        assert breaker.state == CircuitBreaker.CLOSED
+
+        # A cold backup with no measurements does not jump ahead of a measured primary
+        router = LLMRouter([LLMProvider("primary", FakeLLM(["主"])), LLMProvider("backup", FakeLLM(["备"]), priority=1)])
+        router.providers[0].observe(0.5)
+        assert [p.name for p in router.select()] == ["primary", "backup"]
+        assert await router.chat(messages) == "主"
+
+        # First-token timeout counts as a failure; all providers down raises
+        stuck = LLMRouter([LLMProvider("stuck", FakeLLM(["x"], delay=1.0))], first_token_timeout=0.05)
+        try:
+            await stuck.chat(messages)
+            raise AssertionError("expected failure")
+        except AssertionError:
+            raise
+        except Exception as e:
+            assert "no first token" in str(e), e
+
+        # Real services behind the router: GLM over aiohttp, an OpenAI client over the same stub
+        async def handle(request):
+            body = await request.json()
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for delta in ["你好", "。"]:
+                chunk = {
+                    "id": "1", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+                }
+                await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            return response
+
+        app = web.Application()
+        app.router.add_post("/chat/completions", handle)
+        runner, base_url = await start_local_server(app)
+        client = AsyncOpenAI(api_key="test-key", base_url=base_url)
+        try:
+            router = LLMRouter([
+                LLMProvider("glm", ZhipuGLMService(api_key="test-key", base_url=base_url)),
+                LLMProvider("openai", OpenAIClientLLM(client, "glm-4"), priority=1),
+            ])
+            assert await router.chat(messages) == "你好。"
+            router.providers[0].breaker.opened_at = time.monotonic() + 1e9
+            assert router.providers[0].breaker.state == CircuitBreaker.OPEN
+            assert await router.chat(messages, system_prompt="You are helpful.") == "你好。"
+            assert router.get_stats()["providers"]["openai"]["requests"] == 1
+        finally:
+            await client.close()
+            await close_pool()
+            await runner.cleanup()
+
+        logger.success("LLM router test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"LLM router test failed: {e}")
+        return False
+
+
+async def test_rate_limiter():
+    """Test the upstream limiter: priority classes, fair queuing, token bucket and cancellation."""
+    logger.info("Testing rate limiter...")
+
+    try:
+        import time
+        from rate_limiter import (
+            PRIORITY_BATCH, PRIORITY_PREWARM, UpstreamLimiter, parse_limits, request_priority,
+        )
+
+        assert parse_limits("volc.tts=20:10, chat=5") == {"volc.tts": (20.0, 10), "chat": (5.0, 0)}
+
+        limiter = UpstreamLimiter("test", max_concurrency=1)
+        order = []
+
+        async def request(name, session, priority=None):
+            async with limiter.slot(priority=priority, session=session):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async def prewarm(name):
+            with request_priority(PRIORITY_PREWARM):
+                await request(name, "warm")
+
+        await limiter.acquire()  # Hold the only slot while the queue builds up
+        tasks = [asyncio.create_task(coro) for coro in [
+            request("batch", "job", PRIORITY_BATCH),
+            prewarm("warm"),
+            request("a1", "a"), request("a2", "a"), request("a3", "a"),
+            request("b1", "b"),
+        ]]
+        await asyncio.sleep(0.01)
+        assert limiter.queue_depth() == {"live": 4, "prewarm": 1, "batch": 1}, limiter.queue_depth()
+        limiter.release()
+        await asyncio.gather(*tasks)
+        # Live turns first, round-robin across sessions, then pre-warm, then batch
+        assert order == ["a1", "b1", "a2", "a3", "warm", "batch"], order
+        stats = limiter.get_stats()
+        assert stats["max_queue_depth"] == 6 and stats["active"] == 0 and stats["waiting"] == 0, stats
+
+        # Cancelled waiters leave the queue without taking a slot
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert limiter.get_stats()["waiting"] == 0 and limiter.get_stats()["cancelled"] == 1
+        limiter.release()
+        assert limiter.active == 0
+
+        # Token bucket: a burst of one, then 20 requests per second
+        bucket = UpstreamLimiter("bucket", qps=20, burst=1)
+        start = time.monotonic()
+        await asyncio.gather(*(bucket.slot().__aenter__() for _ in range(5)))
+        elapsed = time.monotonic() - start
+        assert 0.18 <= elapsed < 0.5, elapsed
+        assert bucket.get_stats()["wait"]["count"] == 5
+
+        logger.success("Rate limiter test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Rate limiter test failed: {e}")
+        return False
+
+
+async def test_batch_transcribe():
+    """Test batch transcription with bounded concurrency, checkpointing and resume."""
+    logger.info("Testing batch transcription...")
+
+    try:
+        import json
+        import os
+        import tempfile
+        from batch_transcribe import BatchTranscriber, read_manifest
+        from http_client import close_pool
+        from mock_servers import MockConfig, MockUpstream
+
+        upstream = MockUpstream(MockConfig(stt_latency=0.1, transcript="测试录音"))
+        await upstream.start()
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                manifest = os.path.join(tmp, "manifest.txt")
+                output = os.path.join(tmp, "results.jsonl")
+                with open(manifest, "w", encoding="utf-8") as f:
+                    for i in range(10):
+                        f.write(f"http://archive.local/call-{i}.mp3\n")
+                    f.write(json.dumps({"id": "vip", "url": "http://archive.local/vip.mp3", "agent": "A7"}) + "\n")
+                    f.write("http://archive.local/call-0.mp3\n")  # Duplicate
+
+                def new_transcriber():
+                    stt = DoubaoSTTService()
+                    stt.api_url = upstream.stt_url
+                    stt.poller.initial_interval = 0.02
+                    return BatchTranscriber(output, stt=stt, concurrency=4)
+
+                # Interrupt the first run while tasks are in flight
+                first = new_transcriber()
+                run = asyncio.create_task(first.run(read_manifest(manifest)))
+                while first.get_stats()["succeeded"] < 4 or upstream.stats["stt_submit"] < 6:
+                    await asyncio.sleep(0.01)
+                run.cancel()
+                await asyncio.gather(run, return_exceptions=True)
+                submitted = upstream.stats["stt_submit"]
+                with open(output, encoding="utf-8") as f:
+                    finished = sum(1 for _ in f)
+
+                stats = await new_transcriber().run(read_manifest(manifest))
+                assert stats["total"] == 12 and stats["resumed"] >= 1, stats
+                with open(output, encoding="utf-8") as f:
+                    records = [json.loads(line) for line in f]
+                ids = [record["id"] for record in records]
+                # Every file exactly once; checkpointed tasks are polled instead of resubmitted
+                assert sorted(ids) == sorted(set(ids)) and len(ids) == 11, ids
+                assert upstream.stats["stt_submit"] - submitted < 11 - finished, (submitted, finished, upstream.stats)
+                assert all(record["text"] == "测试录音" for record in records)
+                vip = next(record for record in records if record["id"] == "vip")
+                assert vip["agent"] == "A7" and vip["task_id"]
+
+                # A finished run has nothing left to do
+                total_submits = upstream.stats["stt_submit"]
+                stats = await new_transcriber().run(read_manifest(manifest))
+                assert stats["skipped"] == 12 and upstream.stats["stt_submit"] == total_submits, stats
+        finally:
+            await close_pool()
+            await upstream.stop()
+
+        logger.success("Batch transcription test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Batch transcription test failed: {e}")
+        return False
+
+
+async def test_rtvi_dispatch():
+    """Test RTVI event records and the name/frame-type dispatch tables."""
+    logger.info("Testing RTVI dispatch...")
+
+    try:
+        from dispatch_benchmark import run_dispatch_benchmark
+        from rtvi.events import EventDispatcher, FrameDispatcher, RTVIEvent
+
+        event = RTVIEvent.from_kwargs("user_transcription", text="你好", final=False)
+        assert not hasattr(event, "__dict__") and event.text == "你好" and event.final is False
+        assert repr(event) == "RTVIEvent('user_transcription', text='你好')", repr(event)
+
+        calls = []
+        dispatcher = EventDispatcher()
+        dispatcher.register("llm_text", lambda e: calls.append(("builtin", e.text)))
+
+        @dispatcher.on("llm_text")
+        def plugin(e):
+            calls.append(("plugin", e.text))
+
+        for handler in dispatcher.handlers("llm_text"):
+            handler(RTVIEvent("llm_text", text="好"))
+        assert calls == [("builtin", "好"), ("plugin", "好")], calls
+        assert "llm_text" in dispatcher and "error" not in dispatcher
+        dispatcher.unregister("llm_text", plugin)
+        assert len(dispatcher.handlers("llm_text")) == 1
+
+        class Frame:
+            pass
+
+        class TextFrame(Frame):
+            pass
+
+        class LLMTextFrame(TextFrame):
+            pass
+
+        frames = FrameDispatcher()
+        on_text, on_llm = object(), object()
+        frames.register(TextFrame, on_text)
+        # Subclasses resolve to the nearest registered type; unknown types map to nothing
+        assert frames.handlers(LLMTextFrame) == (on_text,)
+        assert frames.handlers(Frame) == ()
+        # A subclass with its own handlers shadows its base type's handlers
+        frames.register(LLMTextFrame, on_llm)
+        assert frames.handlers(LLMTextFrame) == (on_llm,)
+
+        report = await run_dispatch_benchmark(frames=5000)
+        assert report["table_ns_per_frame"] > 0 and report["legacy_ns_per_frame"] > 0, report
+        logger.info(f"RTVI dispatch: {report}")
+
+        logger.success("RTVI dispatch test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"RTVI dispatch test failed: {e}")
+        return False
+
+
+async def test_audio_upload():
+    """Test header sniffing and inline audio submission without a hosted URL."""
+    logger.info("Testing inline audio upload...")
+
+    try:
+        import io
+        import struct
+        import wave
+        from audio_format import AudioFormat, format_from_url, sniff_audio
+        from http_client import close_pool
+        from mock_servers import MockConfig, MockUpstream
+
+        pcm = b"\x01\x00" * 8000
+        wav = io.BytesIO()
+        with wave.open(wav, "wb") as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(24000)
+            w.writeframes(pcm)
+        wav = wav.getvalue()
+        assert sniff_audio(wav) == AudioFormat(format="wav", codec="raw", rate=24000, bits=16, channels=2)
+
+        opus_head = b"OpusHead" + bytes([1, 1]) + struct.pack("<HIhB", 312, 16000, 0, 0)
+        ogg = b"OggS" + b"\x00" * 24 + opus_head
+        assert sniff_audio(ogg) == AudioFormat(format="ogg", codec="opus", rate=16000, channels=1)
+
+        # ID3 tag, then an MPEG-1 Layer III frame header at 44.1 kHz, joint stereo
+        mp3 = b"ID3\x04\x00\x00\x00\x00\x00\x04" + b"\x00" * 4 + b"\xff\xfb\x90\x44"
+        assert sniff_audio(mp3) == AudioFormat(format="mp3", codec="mp3", rate=44100, channels=2)
+        assert sniff_audio(pcm, default_rate=8000) == AudioFormat(rate=8000)
+        assert format_from_url("http://archive.local/a.wav?sig=1").format == "wav"
+
+        upstream = MockUpstream(MockConfig(stt_latency=0.05, transcript="内联音频"))
+        await upstream.start()
+        try:
+            stt = DoubaoSTTService()
+            stt.api_url = upstream.stt_url
+            stt.poller.initial_interval = 0.02
+
+            # A view into a larger transport buffer goes out as-is
+            packet = bytearray(b"HDR!") + bytearray(wav)
+            text = await stt.transcribe(memoryview(packet)[4:])
+            assert text == "内联音频", text
+            sent = upstream.last_stt_audio
+            assert sent["data"] == wav and sent["format"] == "wav" and sent["rate"] == 24000, sent
+            assert sent["channel"] == 2 and "url" not in sent
+
+            await stt.submit_audio(pcm, sample_rate=8000)
+            sent = upstream.last_stt_audio
+            assert sent["data"] == pcm and sent["format"] == "pcm" and sent["rate"] == 8000, sent
+        finally:
+            await close_pool()
+            await upstream.stop()
+
+        logger.success("Inline audio upload test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Inline audio upload test failed: {e}")
+        return False
+
+
+async def test_audio_convert():
+    """Test downmix, resampling, sample format conversion and re-chunking."""
+    logger.info("Testing audio conversion...")
+
+    try:
+        import gzip
+        import numpy as np
+        from audio_benchmark import run_audio_benchmark
+        from audio_convert import AudioConverter
+        from doubao_stt import DoubaoStreamingSession
+
+        def tone(frequency, rate, seconds, channels=1):
+            t = np.arange(int(rate * seconds)) / rate
+            samples = (0.5 * np.sin(2 * np.pi * frequency * t) * 32767).astype("<i2")
+            return np.repeat(samples, channels).tobytes()
+
+        def peak_hz(pcm, rate):
+            samples = np.frombuffer(pcm, dtype="<i2")[rate // 10:].astype(np.float32)
+            spectrum = np.abs(np.fft.rfft(samples * np.hanning(len(samples))))
+            return np.argmax(spectrum) * rate / len(samples)
+
+        for in_rate, out_rate, channels in [(48000, 16000, 2), (48000, 24000, 1), (24000, 48000, 1), (16000, 48000, 1)]:
+            audio = tone(1000, in_rate, 0.5, channels)
+            converter = AudioConverter(in_rate, out_rate, in_channels=channels, frame_ms=10)
+            buffers = (converter._out, converter._mono)
+            step = in_rate * channels * 2 // 50
+            frames = [bytes(f) for i in range(0, len(audio), step) for f in converter.process(audio[i:i + step])]
+            # Fixed 10 ms frames, the tone kept, no buffer reallocated along the way
+            assert all(len(f) == out_rate // 100 * 2 for f in frames)
+            assert len(frames) >= 49, (in_rate, out_rate, len(frames))
+            assert abs(peak_hz(b"".join(frames), out_rate) - 1000) < 5
+            assert (converter._out, converter._mono) == buffers
+
+        # 10 kHz cannot exist at 16 kHz; it must be filtered, not aliased to 6 kHz
+        alias = np.frombuffer(bytes(AudioConverter(48000, 16000).convert(tone(10000, 48000, 0.2))), dtype="<i2")
+        assert np.abs(alias[100:]).max() < 100, np.abs(alias[100:]).max()
+
+        # Chunk boundaries do not change the output
+        audio = tone(440, 48000, 0.2, 2)
+        whole = bytes(AudioConverter(48000, 16000, in_channels=2).convert(audio))
+        pieces = AudioConverter(48000, 16000, in_channels=2)
+        assert whole == b"".join(bytes(pieces.convert(audio[i:i + 1004])) for i in range(0, len(audio), 1004))
+
+        # Near-full-scale stereo must not wrap around while downmixing
+        loud = np.full(320, 30000, dtype="<i2").tobytes()
+        assert set(np.frombuffer(bytes(AudioConverter(16000, 16000, in_channels=2).convert(loud)), dtype="<i2")) == {30000}
+        t = np.arange(48000 // 2) / 48000
+        loud = np.repeat((0.9 * np.sin(2 * np.pi * 1000 * t) * 32767).astype("<i2"), 2).tobytes()
+        peak = np.abs(np.frombuffer(bytes(AudioConverter(48000, 16000, in_channels=2).convert(loud)), dtype="<i2")).max()
+        assert abs(int(peak) - 29490) < 600, peak
+
+        floats = AudioConverter(16000, 16000, out_format="f32").convert(np.array([16384, -32768], dtype="<i2").tobytes())
+        assert np.frombuffer(floats, dtype="<f4").tolist() == [0.5, -1.0]
+
+        # A streaming session accepts 48 kHz stereo transport audio and sends 16 kHz mono
+        class FakeSocket:
+            sent = []
+
+            async def send(self, packet):
+                self.sent.append(packet)
+
+        session = DoubaoStreamingSession(DoubaoSTTService(), chunk_ms=100, input_rate=48000, input_channels=2)
+        session._ws = FakeSocket()
+        audio = tone(1000, 48000, 0.5, 2)
+        for i in range(0, len(audio), 3840):
+            await session.send_audio(audio[i:i + 3840])
+        assert len(FakeSocket.sent) == 5 and all(len(gzip.decompress(p[8:])) == 3200 for p in FakeSocket.sent)
+
+        report = run_audio_benchmark(seconds=1.0)
+        assert all(result["frames_per_second"] > 50 for result in report), report
+        logger.info(f"Audio conversion: {[(r['scenario'], r['frames_per_second']) for r in report]}")
+
+        logger.success("Audio conversion test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Audio conversion test failed: {e}")
+        return False
+
+
+async def test_prompt_audio():
+    """Test prefetched greetings on connect and fillers on a slow first token."""
+    logger.info("Testing prompt audio...")
+
+    try:
+        from metrics import LatencyTracker, TurnTracker
+        from prompt_audio import PromptAudioLibrary
+        from session_manager import VoiceSession
+
+        synthesized = []
+
+        class FakeTTS:
+            async def synthesize(self, text, voice=None, use_cache=True):
+                synthesized.append((text, voice, use_cache))
+                if text == "坏":
+                    raise Exception("upstream 500")
+                return f"{voice}:{text}".encode()
+
+        class LLM:
+            def __init__(self, delay):
+                self.delay = delay
+
+            async def chat_stream(self, messages, system_prompt=None):
+                await asyncio.sleep(self.delay)
+                yield "好的。"
+
+        tts = FakeTTS()
+        library = PromptAudioLibrary(
+            tts, greetings=["你好！"], fillers=["嗯，", "稍等。", "坏"], voices=["v1"], refresh_interval=0.05,
+        )
+        await asyncio.gather(library.start(), library.start())
+        assert library.get_stats()["clips"] == 3 and len(synthesized) == 4, library.get_stats()
+        assert library.greeting("v1").audio == "v1:你好！".encode()
+        fillers = {library.filler("v1").text for _ in range(4)}
+        assert fillers == {"嗯，", "稍等。"}, fillers
+
+        # Failed phrases are left out; refreshes bypass the TTS cache
+        await asyncio.sleep(0.12)
+        assert library.get_stats()["refreshes"] >= 1
+        assert any(use_cache is False for _, _, use_cache in synthesized)
+
+        # An unknown voice misses once, then is fetched in the background
+        assert library.greeting("v2") is None
+        await asyncio.sleep(0.02)
+        assert library.greeting("v2").audio == "v2:你好！".encode()
+
+        played = []
+        session = VoiceSession(
+            session_id="p1", stt=None, llm=LLM(0.2), tts=tts, voice="v1",
+            turns=TurnTracker("p1", tracker=LatencyTracker()), cache_responses=False,
+            prompt_audio=library, filler_after=0.05,
+        )
+
+        async def on_audio(segment):
+            played.append(segment.text)
+        session.tts_pipeline.on_audio = on_audio
+        greeting = await session.greet()
+        assert greeting.text == "你好！" and played == ["你好！"]
+        assert session.messages[-1] == {"role": "assistant", "content": "你好！"}
+
+        # Slow first token: one filler ahead of the reply, kept out of history and latency
+        segments = [segment async for segment in session.run_turn("帮我查一下")]
+        assert [s.index for s in segments] == [-1, 0] and segments[0].text in ("嗯，", "稍等。"), segments
+        assert session.messages[-1]["content"] == "好的。"
+        turn = session.turns.completed[-1]
+        assert turn["values"]["filler_played"] == 1
+
+        # Fast first token: no filler
+        session.llm = LLM(0.0)
+        segments = [segment async for segment in session.run_turn("谢谢")]
+        assert [s.index for s in segments] == [0], segments
+
+        await library.stop()
+        logger.success("Prompt audio test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Prompt audio test failed: {e}")
+        return False
+
+
+async def test_metrics_server():
+    """Test the Prometheus endpoint, per-service upstream stats and readiness probe."""
+    logger.info("Testing metrics server...")
+
+    try:
+        import aiohttp
+        from llm_router import LLMProvider, LLMRouter
+        from metrics import get_upstream, track_upstream
+        from metrics_server import MetricsServer
+        from session_manager import SessionManager, VoiceSession
+
+        class Pending(Exception):
+            pass
+
+        async with track_upstream("test_upstream"):
+            await asyncio.sleep(0.01)
+        for exc in (Exception("upstream 500"), Pending("still running")):
+            try:
+                async with track_upstream("test_upstream", (Pending,)):
+                    raise exc
+            except Exception:
+                pass
+
+        async def cancelled():
+            async with track_upstream("test_upstream"):
+                await asyncio.sleep(10)
+        task = asyncio.create_task(cancelled())
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        upstream = get_upstream("test_upstream").get_stats()
+        # Expected "pending" results and cancellations are not errors
+        assert upstream["requests"] == 4 and upstream["errors"] == 1 and upstream["in_flight"] == 0, upstream
+        assert upstream["latency"]["count"] == 3, upstream
+
+        router = LLMRouter([LLMProvider("primary", object())])
+        server = MetricsServer(host="127.0.0.1", port=0, router=router, max_loop_lag=10.0)
+        url = await server.start()
+        sessions = SessionManager(
+            lambda session_id: VoiceSession(session_id=session_id, stt=None, llm=None, tts=None),
+            max_sessions=1,
+        )
+        server.watch_sessions(sessions)
+        try:
+            async with aiohttp.ClientSession() as http:
+                async with http.get(f"{url}/healthz") as response:
+                    assert response.status == 200 and (await response.json())["status"] == "ok"
+                async with http.get(f"{url}/readyz") as response:
+                    assert response.status == 200, await response.text()
+
+                async with http.get(f"{url}/metrics") as response:
+                    assert response.status == 200 and response.content_type == "text/plain"
+                    text = await response.text()
+                assert 'voiceai_upstream_requests_total{service="test_upstream"} 4' in text
+                assert 'voiceai_upstream_errors_total{service="test_upstream"} 1' in text
+                assert 'voiceai_upstream_request_seconds_bucket{service="test_upstream",le="+Inf"} 3' in text
+                assert 'voiceai_llm_circuit_state{provider="primary"} 0' in text
+                assert "voiceai_sessions_max 1" in text and "voiceai_memory_rss_bytes" in text
+                # Every family's samples are contiguous under one TYPE line
+                families = [line.split()[2] for line in text.splitlines() if line.startswith("# TYPE")]
+                assert len(families) == len(set(families)), families
+
+                # A full session manager and an open circuit take the process out of rotation
+                await sessions.create("caller")
+                for _ in range(router.providers[0].breaker.failure_threshold):
+                    router.providers[0].breaker.record_failure()
+                async with http.get(f"{url}/readyz") as response:
+                    body = await response.json()
+                    assert response.status == 503, body
+                assert any("session limit" in reason for reason in body["reasons"]), body
+                assert any("circuit" in reason for reason in body["reasons"]), body
+                async with http.get(f"{url}/metrics") as response:
+                    text = await response.text()
+                assert 'voiceai_llm_circuit_state{provider="primary"} 2' in text and "voiceai_ready 0" in text
+
+                await sessions.close_all()
+                router.providers[0].breaker.record_success()
+                server.drain()
+                async with http.get(f"{url}/readyz") as response:
+                    assert response.status == 503 and (await response.json())["reasons"] == ["draining"]
+        finally:
+            server.unwatch_sessions(sessions)
+            await server.stop()
+
+        logger.success("Metrics server test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Metrics server test failed: {e}")
+        return False
+
+
+async def test_profiler():
+    """Test loop stall capture, per-coroutine timing and the sampling profiler endpoints."""
+    logger.info("Testing event-loop profiler...")
+
+    try:
+        import time
+        import aiohttp
+        from metrics_server import MetricsServer
+        from profiler import StallWatchdog, get_coroutine_profiler, profiled
+
+        def blocking_call(seconds):
+            time.sleep(seconds)
+
+        # A stall is caught with the stack of the call that blocked the loop
+        watchdog = StallWatchdog(threshold=0.05)
+        watchdog.start()
+        await asyncio.sleep(0.1)
+        blocking_call(0.25)
+        await asyncio.sleep(0.15)
+        watchdog.stop()
+        stalls = watchdog.get_stalls()
+        assert watchdog.total == 1 and not stalls[0]["ongoing"], stalls
+        assert stalls[0]["duration_ms"] >= 150, stalls
+        assert any("blocking_call" in frame for frame in stalls[0]["stack"]), stalls[0]["stack"]
+
+        # Busy time counts only the steps between awaits; the longest step is the blocking one
+        closed = []
+
+        @profiled("test.work")
+        async def work(fail=False):
+            blocking_call(0.03)
+            await asyncio.sleep(0.05)
+            blocking_call(0.01)
+            if fail:
+                raise Exception("upstream 500")
+            return "done"
+
+        @profiled("test.stream")
+        async def stream():
+            try:
+                for i in range(3):
+                    await asyncio.sleep(0)
+                    yield i
+            finally:
+                closed.append(True)
+
+        coroutines = get_coroutine_profiler()
+        assert await work() == "done" and "test.work" not in coroutines.functions
+        # Profiling off: the stream is the original generator, no per-item wrapper
+        assert stream().ag_code.co_name == "stream"
+        coroutines.enabled = True
+        try:
+            assert await work() == "done"
+            try:
+                await work(fail=True)
+            except Exception:
+                pass
+            assert [i async for i in stream()] == [0, 1, 2]
+            # Closing the wrapper closes the underlying stream right away
+            partial = stream()
+            assert await partial.__anext__() == 0
+            await partial.aclose()
+            assert closed == [True, True], closed
+
+            stats = coroutines.get_stats()["functions"]
+            work_stats = stats["test.work"]
+            assert work_stats["calls"] == 2 and work_stats["errors"] == 1, work_stats
+            assert 0.07 <= work_stats["busy_seconds"] < 0.15, work_stats
+            assert 30 <= work_stats["worst_step_ms"] < 50, work_stats
+            assert work_stats["wall"]["p50"] >= 0.09, work_stats
+            assert stats["test.stream"]["calls"] == 2 and stats["test.stream"]["cancelled"] == 1, stats["test.stream"]
+        finally:
+            coroutines.enabled = False
+
+        # Endpoints are only served with an admin token, and require it
+        server = MetricsServer(host="127.0.0.1", port=0, admin_token="secret")
+        url = await server.start()
+        headers = {"Authorization": "Bearer secret"}
+        try:
+            async with aiohttp.ClientSession() as http:
+                async with http.get(f"{url}/debug/stalls") as response:
+                    assert response.status == 401
+                async with http.get(f"{url}/debug/stalls", headers={"Authorization": "Bearer 密钥"}) as response:
+                    assert response.status == 401
+                async with http.post(f"{url}/debug/profile/start?hz=500", headers=headers) as response:
+                    assert response.status == 200 and (await response.json())["running"]
+
+                blocking_call(0.2)
+                await asyncio.sleep(0.05)
+
+                async with http.post(f"{url}/debug/profile/stop", headers=headers) as response:
+                    assert response.status == 200
+                    collapsed = await response.text()
+                lines = collapsed.splitlines()
+                assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines), collapsed[:200]
+                hot = [line for line in lines if "blocking_call (test_services.py:" in line]
+                assert hot and sum(int(line.rsplit(" ", 1)[1]) for line in hot) >= 50, collapsed[:500]
+                assert "test_profiler (test_services.py:" in hot[0].split(";blocking_call")[0]
+
+                async with http.post(f"{url}/debug/coroutines?enabled=on&reset=1", headers=headers) as response:
+                    body = await response.json()
+                    assert body == {"enabled": True, "functions": {}}, body
+                assert get_coroutine_profiler().enabled
+                await work()
+                async with http.get(f"{url}/metrics") as response:
+                    text = await response.text()
+                assert 'voiceai_coroutine_calls_total{function="test.work"} 1' in text
+                async with http.post(f"{url}/debug/coroutines?enabled=off&reset=1", headers=headers) as response:
+                    assert (await response.json())["enabled"] is False
+        finally:
+            await server.stop()
+
+        server = MetricsServer(host="127.0.0.1", port=0)
+        url = await server.start()
+        try:
+            async with aiohttp.ClientSession() as http:
+                async with http.get(f"{url}/debug/stalls", headers=headers) as response:
+                    assert response.status == 404
+        finally:
+            await server.stop()
+
+        logger.success("Event-loop profiler test passed")
+        return True
+
+    except Exception as e:
+        logger.error(f"Event-loop profiler test failed: {e}")
+        return False
+
+
 async def main():
     """Run all tests."""
     logger.info("Starting service tests...")
@@ -108,6 +1860,31 @@ async def main():
         "Doubao STT": await test_doubao_stt(),
         "Doubao TTS": await test_doubao_tts(),
         "Zhipu GLM": await test_zhipu_glm(),
+        "HTTP Pool": await test_http_pool(),
+        "Zhipu GLM Stream": await test_zhipu_glm_stream(),
+        "Sentence TTS Pipeline": await test_sentence_tts_pipeline(),
+        "Doubao STT Stream": await test_doubao_stt_stream(),
+        "STT Result Poller": await test_result_poller(),
+        "TTS Cache": await test_tts_cache(),
+        "Session Manager": await test_session_manager(),
+        "Supervisor": await test_supervisor(),
+        "Turn Latency": await test_turn_latency(),
+        "Benchmark": await test_benchmark(),
+        "TTS Stream": await test_tts_stream(),
+        "Interruption": await test_interruption(),
+        "VAD": await test_vad(),
+        "Conversation Context": await test_conversation_context(),
+        "Speculative LLM": await test_speculative_llm(),
+        "Response Cache": await test_response_cache(),
+        "LLM Router": await test_llm_router(),
+        "Rate Limiter": await test_rate_limiter(),
+        "Batch Transcribe": await test_batch_transcribe(),
+        "RTVI Dispatch": await test_rtvi_dispatch(),
+        "Audio Upload": await test_audio_upload(),
+        "Audio Convert": await test_audio_convert(),
+        "Prompt Audio": await test_prompt_audio(),
+        "Metrics Server": await test_metrics_server(),
+        "Profiler": await test_profiler(),
     }
 
     logger.info("\n=== Test Results ===")
@@ -0,0 +1,70 @@
+"""
+Transcript Text Normalization
+识别文本归一化
+
+Folds away differences that do not change what the user said: full-width
+vs half-width forms, letter case, punctuation, whitespace and traditional vs
+simplified Chinese characters.
+消除不影响语义的差异：全角/半角、大小写、标点、空白与繁简字形。
+"""
+
+import unicodedata
+from difflib import SequenceMatcher
+
+# Common traditional characters and their simplified forms (one-to-one by position).
+# Covers everyday conversational vocabulary; rare characters pass through unchanged.
+_TRADITIONAL = (
+    "這個們來說時會為國學對過麼裡後還於與發見將經點樣開關頭問題長東車門電話氣習業實現當從讓應認識號碼錢買"
+    "賣價幫請謝歡覺聽寫讀記憶體驗機場飛務網絡線給無環變動產員處條規則預約訂單貨運輸視頻聲樂歲嗎麗愛傳統區"
+    "醫療藥陽陰雲風陣熱凍溫濕兩萬億幾費戶帳辦證護圖書館訊錄節檢測試數據庫類報紙鐘週幣銀戲劇廳飯湯麵雞魚豬"
+    "鳥馬龍鳳義權歷紀獎勵師範課練聯係繫邊遠進達隊際陸島灣華漢語詞譯聞導專職農礦鐵鋼廠設計劃畫藝術診斷狀態"
+    "況準備確決議論調轉換舊親戀婦兒孫媽爺貓蘋葉藍綠紅黃顏髮臉腦膽腸臟膚嚴厲險難壞錯緊張鬆靜聰穩簡雜亂齊歸"
+    "辭舉擇選項須順顧願顯響虛覽觀勞輕較載軟輪遲遺郵鄉鄰醬釋針鈴鍵鎖鏡閉間閱隨雖雙離靈韓頁領顆額飲飽餓養驚"
+    "麥黨齒龜優儀儲兌內冊劉創勝協參啟喚嘆團園圍壓壽夢夾奮寧寶屆層屬廣強徑復憂懷戰擁擔擊攝敗敵晝曆棄榮槍樹"
+    "橋檔歐殺沒滅漲灑災煙爭獨獲畢異盡監盤礎稅稱窮競筆築糧純級細終組結絕維綜緒編績總織罰聖肅脫興艱莊萊蘇蟲"
+    "衛補製複觸討訓許評詢詳誌誤談諾謀講豐貝負財貢責貴貸資賓賽贊贏趕趙跡蹤躍軍輛適遷違遞銷鋪錦鍋鎮閃閒階隱"
+    "韻頂頓鬥極樓牆營蓋鹽攤擺擴勢禮爾彈彎標橫櫃濟濱瀏燈爐牽猶瑪盜礙禍積穀粵糾紛繼續繩羅膠臨艦蘭虧衝襪誰謎"
+    "譽讚貧販購賬賠賴質趨軌輔辯遙邏醜釣鈔鉛銅鋒錶鏈閘闆闊陳霧韋頌頸顛飄餅饒騎騙驅驕鬧鴨鵝鹹黴龐"
+)
+_SIMPLIFIED = (
+    "这个们来说时会为国学对过么里后还于与发见将经点样开关头问题长东车门电话气习业实现当从让应认识号码钱买"
+    "卖价帮请谢欢觉听写读记忆体验机场飞务网络线给无环变动产员处条规则预约订单货运输视频声乐岁吗丽爱传统区"
+    "医疗药阳阴云风阵热冻温湿两万亿几费户账办证护图书馆讯录节检测试数据库类报纸钟周币银戏剧厅饭汤面鸡鱼猪"
+    "鸟马龙凤义权历纪奖励师范课练联系系边远进达队际陆岛湾华汉语词译闻导专职农矿铁钢厂设计划画艺术诊断状态"
+    "况准备确决议论调转换旧亲恋妇儿孙妈爷猫苹叶蓝绿红黄颜发脸脑胆肠脏肤严厉险难坏错紧张松静聪稳简杂乱齐归"
+    "辞举择选项须顺顾愿显响虚览观劳轻较载软轮迟遗邮乡邻酱释针铃键锁镜闭间阅随虽双离灵韩页领颗额饮饱饿养惊"
+    "麦党齿龟优仪储兑内册刘创胜协参启唤叹团园围压寿梦夹奋宁宝届层属广强径复忧怀战拥担击摄败敌昼历弃荣枪树"
+    "桥档欧杀没灭涨洒灾烟争独获毕异尽监盘础税称穷竞笔筑粮纯级细终组结绝维综绪编绩总织罚圣肃脱兴艰庄莱苏虫"
+    "卫补制复触讨训许评询详志误谈诺谋讲丰贝负财贡责贵贷资宾赛赞赢赶赵迹踪跃军辆适迁违递销铺锦锅镇闪闲阶隐"
+    "韵顶顿斗极楼墙营盖盐摊摆扩势礼尔弹弯标横柜济滨浏灯炉牵犹玛盗碍祸积谷粤纠纷继续绳罗胶临舰兰亏冲袜谁谜"
+    "誉赞贫贩购账赔赖质趋轨辅辩遥逻丑钓钞铅铜锋表链闸板阔陈雾韦颂颈颠飘饼饶骑骗驱骄闹鸭鹅咸霉庞"
+)
+TRADITIONAL_TO_SIMPLIFIED = str.maketrans(_TRADITIONAL, _SIMPLIFIED)
+
+
+def to_simplified(text: str) -> str:
+    """Map traditional Chinese characters to simplified ones."""
+    return text.translate(TRADITIONAL_TO_SIMPLIFIED)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a transcript for comparison.
+    归一化识别文本以便比较
+
+    NFKC folds full-width letters, digits and punctuation to half-width;
+    punctuation, symbols and whitespace are then dropped, case is folded and
+    traditional characters become simplified.
+    """
+    folded = to_simplified(unicodedata.normalize("NFKC", text).casefold())
+    return "".join(
+        char for char in folded
+        if not char.isspace() and unicodedata.category(char)[0] not in ("P", "S")
+    )
+
+
+def text_similarity(a: str, b: str) -> float:
+    """Similarity ratio (0-1) of two already-normalized texts."""
+    if a == b:
+        return 1.0
+    return SequenceMatcher(None, a, b).ratio()
@@ -0,0 +1,223 @@
+"""
+TTS Audio Cache
+TTS 音频缓存
+
+Content-addressed cache for synthesized audio. A byte-bounded in-memory LRU
+tier sits in front of an optional on-disk tier whose entries are read through
+memory-mapped files, so disk hits are served from the page cache without
+copying the audio into the Python heap.
+按内容寻址的合成音频缓存：内存 LRU 层（按字节数限制）+ 可选磁盘层（mmap 零拷贝读取）。
+"""
+
+import hashlib
+import json
+import mmap
+import os
+from collections import OrderedDict
+from typing import List, Optional, Union
+
+from dotenv import load_dotenv
+from loguru import logger
+
+# Load environment variables
+load_dotenv()
+
+TTS_CACHE_MEMORY_BYTES = int(os.getenv("TTS_CACHE_MEMORY_BYTES", str(32 * 1024 * 1024)))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "")
+TTS_CACHE_DISK_BYTES = int(os.getenv("TTS_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+TTS_PREWARM_PHRASES = os.getenv("TTS_PREWARM_PHRASES", "")
+
+AudioData = Union[bytes, memoryview]
+
+
+def cache_key(
+    text: str,
+    voice: str,
+    speed_ratio: float = 1.0,
+    volume_ratio: float = 1.0,
+    pitch_ratio: float = 1.0,
+    encoding: str = "mp3",
+) -> str:
+    """Build the content address for one synthesis request."""
+    material = json.dumps(
+        [text, voice, float(speed_ratio), float(volume_ratio), float(pitch_ratio), encoding],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def load_phrases(path: str) -> List[str]:
+    """
+    Load a pre-warm phrase list (one phrase per line, '#' starts a comment).
+    加载预热短语列表
+    """
+    phrases = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            phrase = line.strip()
+            if phrase and not phrase.startswith("#"):
+                phrases.append(phrase)
+    return phrases
+
+
+class TTSAudioCache:
+    """Two-tier (memory LRU + mmap disk) cache for synthesized audio."""
+
+    def __init__(
+        self,
+        max_memory_bytes: int = TTS_CACHE_MEMORY_BYTES,
+        disk_dir: Optional[str] = TTS_CACHE_DIR or None,
+        max_disk_bytes: int = TTS_CACHE_DISK_BYTES,
+    ):
+        """Initialize the cache.
+
+        Args:
+            max_memory_bytes: Byte budget of the in-memory tier
+            disk_dir: Directory for the disk tier (None disables it)
+            max_disk_bytes: Byte budget of the disk tier
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def get(self, key: str) -> Optional[AudioData]:
+        """
+        Look up audio by key.
+        按键查找音频
+
+        Returns:
+            bytes from the memory tier, a read-only memoryview over an mmap
+            from the disk tier, or None on a miss
+        """
+        audio = self._memory.get(key)
+        if audio is not None:
+            self._memory.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return audio
+
+        if key in self._disk:
+            audio = self._read_disk(key)
+            if audio is not None:
+                self._disk.move_to_end(key)
+                self._stats["disk_hits"] += 1
+                return audio
+
+        self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, audio: bytes) -> None:
+        """
+        Store audio in both tiers, evicting least recently used entries.
+        写入缓存并按 LRU 淘汰
+        """
+        size = len(audio)
+        if size <= self.max_memory_bytes:
+            if key in self._memory:
+                self._memory_bytes -= len(self._memory.pop(key))
+            self._memory[key] = audio
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+                self._stats["memory_evictions"] += 1
+
+        if self.disk_dir and size and key not in self._disk and size <= self.max_disk_bytes:
+            self._write_disk(key, audio)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._memory or key in self._disk
+
+    def get_stats(self) -> dict:
+        """
+        Get hit/miss/eviction counters and tier sizes.
+        获取命中/未命中/淘汰计数及各层大小
+        """
+        stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["memory_entries"] = len(self._memory)
+        stats["memory_bytes"] = self._memory_bytes
+        stats["disk_entries"] = len(self._disk)
+        stats["disk_bytes"] = self._disk_bytes
+        return stats
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.audio")
+
+    def _load_disk_index(self) -> None:
+        """Index existing disk entries, oldest first, and trim to the byte budget."""
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith(".audio"):
+                continue
+            stat = os.stat(os.path.join(self.disk_dir, name))
+            entries.append((stat.st_mtime, name[:-len(".audio")], stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+        logger.info(f"TTS disk cache loaded: {len(self._disk)} entries, {self._disk_bytes} bytes")
+
+    def _read_disk(self, key: str) -> Optional[memoryview]:
+        try:
+            with open(self._path(key), "rb") as f:
+                # The mapping stays valid after the file is closed
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return memoryview(mapped)
+        except (OSError, ValueError) as e:
+            logger.warning(f"TTS disk cache read failed for {key}: {e}")
+            self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+
+    def _write_disk(self, key: str, audio: bytes) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"TTS disk cache write failed for {key}: {e}")
+            return
+        self._disk[key] = len(audio)
+        self._disk_bytes += len(audio)
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self._stats["disk_evictions"] += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+# Singleton instance
+_instance = None
+
+
+def get_cache() -> "TTSAudioCache":
+    """Get or create the singleton instance of TTSAudioCache."""
+    global _instance
+    if _instance is None:
+        _instance = TTSAudioCache()
+    return _instance
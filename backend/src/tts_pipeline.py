@@ -0,0 +1,360 @@
+"""
+Sentence-level LLM-to-TTS Pipelining
+句子级 LLM 到 TTS 流水线
+
+Splits the streamed LLM reply on sentence boundaries and synthesizes each
+sentence as soon as it is complete, so playback starts after the first
+sentence instead of after the whole reply.
+按句子边界切分 LLM 流式输出，每句完成即送 TTS 合成，首句合成完即可开始播放。
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
+
+from loguru import logger
+
+# Sentence terminators that always end a segment
+SENTENCE_TERMINATORS = "。！？!?；;…\n"
+# English period only ends a sentence when followed by whitespace ("3.14" must not split)
+AMBIGUOUS_TERMINATORS = "."
+# Preferred split points when a segment hits the length cap
+SOFT_BREAKS = "，,、：: "
+# Closing quotes/brackets that belong to the sentence they close
+CLOSING_MARKS = "”’\"')）」』】"
+
+
+class SentenceSegmenter:
+    """Incremental sentence segmenter for streamed Chinese/English text."""
+
+    def __init__(self, max_chars: int = 80, min_chars: int = 2):
+        """Initialize segmenter.
+
+        Args:
+            max_chars: Length cap; longer runs are split at a soft break or hard-cut
+            min_chars: Segments shorter than this are merged into the next one
+        """
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def push(self, text: str) -> List[str]:
+        """
+        Add streamed text and return any segments completed by it.
+        追加文本并返回已完成的句子
+
+        Args:
+            text: Text delta from the LLM
+
+        Returns:
+            Completed segments, in order
+        """
+        self._buffer += text
+        segments = []
+
+        start = 0
+        i = 0
+        while i < len(self._buffer):
+            char = self._buffer[i]
+            end = None
+
+            if char in SENTENCE_TERMINATORS:
+                end = i + 1
+            elif char in AMBIGUOUS_TERMINATORS:
+                if i + 1 >= len(self._buffer):
+                    break  # Wait for the next delta to decide
+                if self._buffer[i + 1].isspace() or self._buffer[i + 1] in CLOSING_MARKS:
+                    end = i + 1
+
+            if end is not None:
+                while end < len(self._buffer) and self._buffer[end] in CLOSING_MARKS:
+                    end += 1
+                if len(self._buffer[start:end].strip()) >= self.min_chars:
+                    segments.append(self._buffer[start:end])
+                    start = end
+                i = end
+                continue
+
+            if i + 1 - start >= self.max_chars:
+                end = self._find_soft_break(start, i + 1)
+                segments.append(self._buffer[start:end])
+                start = end
+                i = end
+                continue
+
+            i += 1
+
+        self._buffer = self._buffer[start:]
+        return [s.strip() for s in segments if s.strip()]
+
+    def flush(self) -> Optional[str]:
+        """
+        Return whatever text remains at the end of the reply.
+        返回回复结束时剩余的文本
+        """
+        remaining = self._buffer.strip()
+        self._buffer = ""
+        return remaining or None
+
+    def _find_soft_break(self, start: int, end: int) -> int:
+        """Find the last soft break in the second half of buffer[start:end]."""
+        for j in range(end - 1, start + (end - start) // 2, -1):
+            if self._buffer[j] in SOFT_BREAKS:
+                return j + 1
+        return end
+
+
+@dataclass
+class SpeechSegment:
+    """One synthesized sentence of a bot reply."""
+    index: int
+    text: str
+    audio: bytes
+
+
+class SentenceTTSPipeline:
+    """Pipeline stage that pipelines sentence segments from the LLM into TTS."""
+
+    def __init__(
+        self,
+        tts,
+        voice: str = "zh_female_qingxin",
+        max_concurrency: int = 3,
+        max_chars: int = 80,
+        on_audio: Optional[Callable[[SpeechSegment], Awaitable[None]]] = None,
+        on_audio_frame: Optional[Callable[[Any], Awaitable[None]]] = None,
+    ):
+        """Initialize the pipeline stage.
+
+        Args:
+            tts: TTS service exposing ``async synthesize(text, voice) -> bytes``
+                (and ``synthesize_stream`` for streaming output)
+            voice: Voice type passed to the TTS service
+            max_concurrency: Max sentences synthesized at the same time
+            max_chars: Segment length cap
+            on_audio: Callback receiving each segment, in playback order (frame mode)
+            on_audio_frame: Callback receiving streamed TTS audio frames (frame mode);
+                takes precedence over ``on_audio``
+        """
+        self.tts = tts
+        self.voice = voice
+        self.max_concurrency = max_concurrency
+        self.max_chars = max_chars
+        self.on_audio = on_audio
+        self.on_audio_frame = on_audio_frame
+
+        self._text_queue: Optional[asyncio.Queue] = None
+        self._frame_task: Optional[asyncio.Task] = None
+
+    async def synthesize_stream(self, text_stream: AsyncIterator[str]) -> AsyncIterator[SpeechSegment]:
+        """
+        Segment a stream of text deltas and yield synthesized sentences in order.
+        切分流式文本并按顺序返回合成后的句子
+
+        Synthesis of later sentences overlaps with playback of earlier ones,
+        bounded by ``max_concurrency``.
+
+        Args:
+            text_stream: Async iterator of LLM text deltas
+
+        Yields:
+            SpeechSegment objects in playback order
+        """
+        segmenter = SentenceSegmenter(max_chars=self.max_chars)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Bounded so a fast LLM cannot run arbitrarily far ahead of playback
+        pending: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrency * 2)
+
+        async def synthesize(index: int, text: str) -> SpeechSegment:
+            async with semaphore:
+                logger.debug(f"TTS segment {index}: {text}")
+                audio = await self.tts.synthesize(text, voice=self.voice)
+                return SpeechSegment(index=index, text=text, audio=audio)
+
+        async def produce():
+            index = 0
+            try:
+                async for delta in text_stream:
+                    for text in segmenter.push(delta):
+                        await pending.put(asyncio.create_task(synthesize(index, text)))
+                        index += 1
+                tail = segmenter.flush()
+                if tail:
+                    await pending.put(asyncio.create_task(synthesize(index, tail)))
+            except Exception:
+                await pending.put(None)
+                raise
+            await pending.put(None)
+
+        producer = asyncio.create_task(produce())
+        task = None
+        try:
+            while True:
+                task = await pending.get()
+                if task is None:
+                    break
+                yield await task
+            await producer  # Surface errors raised by the text stream
+        finally:
+            producer.cancel()
+            tasks = [task] if task is not None else []
+            while not pending.empty():
+                item = pending.get_nowait()
+                if item is not None:
+                    tasks.append(item)
+            for item in tasks:
+                item.cancel()
+            await asyncio.gather(producer, *tasks, return_exceptions=True)
+
+    async def stream_audio(self, text_stream: AsyncIterator[str]) -> AsyncIterator[bytes]:
+        """
+        Segment a stream of text deltas and yield streamed audio chunks in order.
+        切分流式文本并按顺序返回流式音频块
+
+        Each sentence is streamed from the TTS service as soon as it is
+        complete. Up to ``max_concurrency`` sentences stream at once, each
+        reading at most the service's bounded buffer ahead of playback.
+
+        Args:
+            text_stream: Async iterator of LLM text deltas
+
+        Yields:
+            Audio chunks in playback order
+        """
+        segmenter = SentenceSegmenter(max_chars=self.max_chars)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        pending: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrency * 2)
+
+        async def stream(index: int, text: str, chunks: asyncio.Queue) -> None:
+            async with semaphore:
+                logger.debug(f"TTS stream segment {index}: {text}")
+                try:
+                    async for chunk in self.tts.synthesize_stream(text, voice=self.voice):
+                        await chunks.put(chunk)
+                except Exception as e:
+                    await chunks.put(e)
+                    return
+                await chunks.put(None)
+
+        async def start(index: int, text: str) -> None:
+            # Per-sentence queue stays small; the service bounds its own read-ahead
+            chunks: asyncio.Queue = asyncio.Queue(maxsize=2)
+            await pending.put((chunks, asyncio.create_task(stream(index, text, chunks))))
+
+        async def produce():
+            index = 0
+            try:
+                async for delta in text_stream:
+                    for text in segmenter.push(delta):
+                        await start(index, text)
+                        index += 1
+                tail = segmenter.flush()
+                if tail:
+                    await start(index, tail)
+            except Exception:
+                await pending.put(None)
+                raise
+            await pending.put(None)
+
+        producer = asyncio.create_task(produce())
+        current = None
+        try:
+            while True:
+                current = await pending.get()
+                if current is None:
+                    break
+                chunks, _ = current
+                while True:
+                    chunk = await chunks.get()
+                    if chunk is None:
+                        break
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    yield chunk
+            await producer  # Surface errors raised by the text stream
+        finally:
+            producer.cancel()
+            tasks = [current[1]] if current is not None else []
+            while not pending.empty():
+                item = pending.get_nowait()
+                if item is not None:
+                    tasks.append(item[1])
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(producer, *tasks, return_exceptions=True)
+
+    async def handle_frame(self, frame, direction) -> None:
+        """Feed LLM frames into the stage; audio is delivered via ``on_audio``."""
+        from pipecat.frames.frames import LLMFullResponseEndFrame, LLMTextFrame
+
+        if isinstance(frame, LLMTextFrame):
+            if self._text_queue is None:
+                # New reply; it plays only after the previous reply has finished
+                self._text_queue = asyncio.Queue()
+                self._frame_task = asyncio.create_task(
+                    self._run_frames(self._text_queue, previous=self._frame_task)
+                )
+            await self._text_queue.put(frame.text)
+
+        elif isinstance(frame, LLMFullResponseEndFrame):
+            if self._text_queue is not None:
+                await self._text_queue.put(None)
+                self._text_queue = None
+
+    async def interrupt(self) -> None:
+        """
+        Drop the reply being received as frames and any audio not yet delivered.
+        丢弃正在接收的回复及尚未输出的音频
+        """
+        self._text_queue = None
+        task, self._frame_task = self._frame_task, None
+        if task is not None:
+            # Each reply awaits the previous one, so this cancels the whole chain
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run_frames(self, text_queue: asyncio.Queue, previous: Optional[asyncio.Task] = None) -> None:
+        """Run one reply received as frames through the pipeline."""
+
+        async def texts():
+            while True:
+                text = await text_queue.get()
+                if text is None:
+                    return
+                yield text
+
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+
+        try:
+            if self.on_audio_frame is not None:
+                sample_rate = getattr(self.tts, "stream_sample_rate", 24000)
+                async for frame in audio_frames(self.stream_audio(texts()), sample_rate):
+                    await self.on_audio_frame(frame)
+                return
+
+            async for segment in self.synthesize_stream(texts()):
+                if self.on_audio is not None:
+                    await self.on_audio(segment)
+        except Exception as e:
+            logger.error(f"Sentence TTS pipeline error: {e}")
+
+
+async def audio_frames(chunks: AsyncIterator[bytes], sample_rate: int, num_channels: int = 1):
+    """
+    Wrap streamed PCM chunks as pipecat TTS frames for the output transport.
+    将流式 PCM 音频块封装为 pipecat TTS 音频帧
+
+    Yields:
+        TTSStartedFrame, one TTSAudioRawFrame per chunk, then TTSStoppedFrame
+    """
+    from pipecat.frames.frames import TTSAudioRawFrame, TTSStartedFrame, TTSStoppedFrame
+
+    yield TTSStartedFrame()
+    try:
+        async for chunk in chunks:
+            yield TTSAudioRawFrame(audio=chunk, sample_rate=sample_rate, num_channels=num_channels)
+    except Exception:
+        yield TTSStoppedFrame()
+        raise
+    yield TTSStoppedFrame()
@@ -0,0 +1,261 @@
+"""
+Voice Activity Detection and Endpointing
+语音活动检测与断句
+
+CPU-only VAD ahead of STT: per-frame energy and zero-crossing features are
+computed with NumPy over whole chunks, an adaptive noise floor sets the
+threshold, and a small state machine confirms speech onsets and detects the
+end of a turn. Only speech (plus a short pre-roll and hangover) is passed on,
+so silence never reaches Doubao.
+STT 之前的纯 CPU 语音检测：NumPy 批量计算每帧能量与过零率，自适应噪声基底，
+状态机确认开口与判定说完；只把语音（含少量前后余量）送往豆包，静音不上送。
+"""
+
+import os
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from loguru import logger
+
+# Load environment variables
+load_dotenv()
+
+VAD_SAMPLE_RATE = int(os.getenv("VAD_SAMPLE_RATE", "16000"))
+VAD_FRAME_MS = int(os.getenv("VAD_FRAME_MS", "20"))
+# Minimum speech level; the adaptive threshold never drops below it
+VAD_ENERGY_THRESHOLD_DB = float(os.getenv("VAD_ENERGY_THRESHOLD_DB", "-45"))
+# Required margin above the tracked noise floor
+VAD_SNR_DB = float(os.getenv("VAD_SNR_DB", "10"))
+# Continuous speech needed before the user counts as speaking
+VAD_START_MS = int(os.getenv("VAD_START_MS", "60"))
+# Silence after speech that ends the turn
+VAD_STOP_MS = int(os.getenv("VAD_STOP_MS", "600"))
+VAD_PRE_ROLL_MS = int(os.getenv("VAD_PRE_ROLL_MS", "200"))
+# Trailing silence kept after the last speech frame
+VAD_HANGOVER_MS = int(os.getenv("VAD_HANGOVER_MS", "100"))
+VAD_MAX_UTTERANCE_MS = int(os.getenv("VAD_MAX_UTTERANCE_MS", "30000"))
+
+# Frames above this zero-crossing rate are treated as noise unless clearly loud
+ZCR_MAX = 0.35
+LOUD_MARGIN_DB = 10.0
+# Noise floor smoothing per non-speech frame
+NOISE_FLOOR_ALPHA = 0.05
+# dBFS of digital silence
+SILENCE_DB = -100.0
+
+EVENT_STARTED = "started"
+EVENT_AUDIO = "audio"
+EVENT_STOPPED = "stopped"
+
+
+@dataclass
+class VADEvent:
+    """Output of the VAD: a speaking state change or trimmed speech audio."""
+    kind: str
+    audio: bytes = b""
+
+
+def frame_features(samples: np.ndarray, frame_len: int) -> tuple:
+    """
+    Per-frame RMS level (dBFS) and zero-crossing rate for int16 PCM.
+    计算每帧能量（dBFS）与过零率
+
+    Args:
+        samples: int16 samples, a whole number of frames long
+        frame_len: Samples per frame
+
+    Returns:
+        (levels_db, zcr) arrays with one value per frame
+    """
+    frames = samples.reshape(-1, frame_len).astype(np.float32) / 32768.0
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    levels_db = 20.0 * np.log10(np.maximum(rms, 1e-5))
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frame_len - 1)
+    return levels_db, zcr
+
+
+class VADProcessor:
+    """Energy/zero-crossing VAD with endpointing for 16-bit mono PCM."""
+
+    def __init__(
+        self,
+        sample_rate: int = VAD_SAMPLE_RATE,
+        frame_ms: int = VAD_FRAME_MS,
+        energy_threshold_db: float = VAD_ENERGY_THRESHOLD_DB,
+        snr_db: float = VAD_SNR_DB,
+        start_ms: int = VAD_START_MS,
+        stop_ms: int = VAD_STOP_MS,
+        pre_roll_ms: int = VAD_PRE_ROLL_MS,
+        hangover_ms: int = VAD_HANGOVER_MS,
+        max_utterance_ms: int = VAD_MAX_UTTERANCE_MS,
+        on_frame: Optional[Callable[[object], Awaitable[None]]] = None,
+    ):
+        """Initialize VAD.
+
+        Args:
+            sample_rate: Input sample rate
+            frame_ms: Analysis frame duration
+            energy_threshold_db: Minimum speech level in dBFS
+            snr_db: Margin above the adaptive noise floor
+            start_ms: Speech needed to confirm the user started speaking
+            stop_ms: Silence needed to end the turn
+            pre_roll_ms: Audio kept from before the confirmed onset
+            hangover_ms: Trailing silence kept after the last speech
+            max_utterance_ms: Force an end of turn after this much audio
+            on_frame: Callback receiving output frames (frame mode)
+        """
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.frame_len = sample_rate * frame_ms // 1000
+        self.frame_bytes = self.frame_len * 2
+        self.energy_threshold_db = energy_threshold_db
+        self.snr_db = snr_db
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.stop_frames = max(1, stop_ms // frame_ms)
+        self.hangover_frames = hangover_ms // frame_ms
+        self.max_utterance_frames = max_utterance_ms // frame_ms
+        self.on_frame = on_frame
+
+        self.speaking = False
+        self.noise_floor_db = energy_threshold_db - snr_db
+        self._remainder = b""
+        self._pre_roll: deque = deque(maxlen=max(self.start_frames, pre_roll_ms // frame_ms))
+        self._onset = 0
+        self._silence: List[bytes] = []
+        self._utterance_frames = 0
+        self._stats = {"frames": 0, "speech_frames": 0, "bytes_in": 0, "bytes_out": 0, "utterances": 0}
+
+    def process(self, pcm: bytes) -> List[VADEvent]:
+        """
+        Feed PCM and return the resulting events.
+        输入 PCM 并返回检测事件
+
+        Args:
+            pcm: 16-bit little-endian mono PCM of any length
+
+        Returns:
+            Events in order; consecutive speech audio is merged into one event
+        """
+        self._stats["bytes_in"] += len(pcm)
+        data = self._remainder + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self._remainder = data[usable:]
+        if not usable:
+            return []
+
+        samples = np.frombuffer(data[:usable], dtype="<i2")
+        levels_db, zcr = frame_features(samples, self.frame_len)
+
+        events: List[VADEvent] = []
+        out = bytearray()
+
+        def emit(kind: str) -> None:
+            if out:
+                events.append(VADEvent(EVENT_AUDIO, bytes(out)))
+                self._stats["bytes_out"] += len(out)
+                out.clear()
+            events.append(VADEvent(kind))
+
+        for i in range(len(levels_db)):
+            frame = data[i * self.frame_bytes:(i + 1) * self.frame_bytes]
+            is_speech = self._is_speech(levels_db[i], zcr[i])
+            self._stats["frames"] += 1
+            if is_speech:
+                self._stats["speech_frames"] += 1
+
+            if not self.speaking:
+                self._pre_roll.append(frame)
+                self._onset = self._onset + 1 if is_speech else 0
+                if self._onset >= self.start_frames:
+                    self.speaking = True
+                    self._utterance_frames = len(self._pre_roll)
+                    self._stats["utterances"] += 1
+                    emit(EVENT_STARTED)
+                    out.extend(b"".join(self._pre_roll))
+                    self._pre_roll.clear()
+                continue
+
+            self._utterance_frames += 1
+            if is_speech:
+                # Pauses inside the utterance are kept
+                for silent in self._silence:
+                    out.extend(silent)
+                self._silence.clear()
+                out.extend(frame)
+            else:
+                self._silence.append(frame)
+
+            if len(self._silence) >= self.stop_frames or self._utterance_frames >= self.max_utterance_frames:
+                for silent in self._silence[:self.hangover_frames]:
+                    out.extend(silent)
+                self._end_utterance()
+                emit(EVENT_STOPPED)
+
+        if out:
+            events.append(VADEvent(EVENT_AUDIO, bytes(out)))
+            self._stats["bytes_out"] += len(out)
+        return events
+
+    def flush(self) -> List[VADEvent]:
+        """
+        End an utterance still open when the input stream ends.
+        输入结束时关闭未结束的语音段
+        """
+        if not self.speaking:
+            return []
+        audio = b"".join(self._silence[:self.hangover_frames])
+        self._end_utterance()
+        events = [VADEvent(EVENT_AUDIO, audio)] if audio else []
+        self._stats["bytes_out"] += len(audio)
+        return events + [VADEvent(EVENT_STOPPED)]
+
+    async def handle_frame(self, frame, direction) -> None:
+        """
+        Frame mode: turn input audio frames into speaking frames plus trimmed audio.
+        帧模式：将输入音频帧转换为开口/说完帧与裁剪后的音频
+
+        Other frames are passed through to ``on_frame`` unchanged.
+        """
+        from pipecat.frames.frames import InputAudioRawFrame, UserStartedSpeakingFrame, UserStoppedSpeakingFrame
+
+        if self.on_frame is None:
+            return
+        if not isinstance(frame, InputAudioRawFrame):
+            await self.on_frame(frame)
+            return
+
+        for event in self.process(frame.audio):
+            if event.kind == EVENT_STARTED:
+                await self.on_frame(UserStartedSpeakingFrame())
+            elif event.kind == EVENT_STOPPED:
+                await self.on_frame(UserStoppedSpeakingFrame())
+            else:
+                await self.on_frame(InputAudioRawFrame(
+                    audio=event.audio, sample_rate=self.sample_rate, num_channels=1,
+                ))
+
+    def get_stats(self) -> dict:
+        """Get frame and byte counters; ``trimmed_ratio`` is the share of audio not sent on."""
+        stats = dict(self._stats)
+        stats["noise_floor_db"] = round(self.noise_floor_db, 1)
+        stats["trimmed_ratio"] = 1 - stats["bytes_out"] / stats["bytes_in"] if stats["bytes_in"] else 0.0
+        return stats
+
+    def _is_speech(self, level_db: float, zcr: float) -> bool:
+        threshold = max(self.energy_threshold_db, self.noise_floor_db + self.snr_db)
+        is_speech = level_db >= threshold and (zcr <= ZCR_MAX or level_db >= threshold + LOUD_MARGIN_DB)
+        if not is_speech and not self.speaking:
+            # Track the background level only outside speech
+            self.noise_floor_db += NOISE_FLOOR_ALPHA * (max(level_db, SILENCE_DB) - self.noise_floor_db)
+        return is_speech
+
+    def _end_utterance(self) -> None:
+        self.speaking = False
+        self._silence.clear()
+        self._onset = 0
+        self._utterance_frames = 0
+        logger.debug("VAD end of turn")
@@ -4,11 +4,16 @@ Zhipu GLM LLM Service (OpenAI Compatible)
 """
 
 import os
-import aiohttp
 import json
+from typing import AsyncIterator, Optional
 from loguru import logger
 from dotenv import load_dotenv
 
+from http_client import get_session
+from metrics import mark, track_upstream
+from profiler import profiled
+from rate_limiter import RESOURCE_CHAT, get_limiter
+
 # Load environment variables
 load_dotenv()
 
@@ -20,15 +25,20 @@ GLM_MODEL = os.getenv("GLM_MODEL", "glm-4")
 class ZhipuGLMService:
     """Zhipu GLM LLM Service - OpenAI Compatible interface."""
 
-    def __init__(self, api_key: str = None, model: str = "glm-4"):
+    # Upstream name in request metrics
+    service_name = "zhipu_llm"
+
+    def __init__(self, api_key: str = None, model: str = "glm-4", base_url: str = None):
         """Initialize Zhipu GLM LLM service.
 
         Args:
             api_key: Zhipu AI API key
             model: GLM model ID (default: glm-4)
+            base_url: OpenAI-compatible API base URL (default: ZHIPU_BASE_URL)
         """
         self.api_key = api_key or ZHIPU_API_KEY
         self.model = model or GLM_MODEL
+        self.base_url = base_url or ZHIPU_BASE_URL
         logger.info(f"Initializing Zhipu GLM service with model: {self.model}")
 
     async def get_llm_config(self) -> dict:
@@ -41,19 +51,28 @@ class ZhipuGLMService:
             ]
         }]
 
-    async def chat(self, messages: list, system_prompt: str = None) -> str:
-        """Send chat request to LLM.
+    def _build_messages(self, messages: list, system_prompt: str = None) -> list:
+        """Prepend the system prompt unless the caller already supplied one."""
+        if system_prompt and not (messages and messages[0].get("role") == "system"):
+            return [{"role": "system", "content": system_prompt}] + list(messages)
+        return list(messages)
+
+    @profiled("zhipu_llm.chat_stream")
+    async def chat_stream(self, messages: list, system_prompt: str = None) -> AsyncIterator[str]:
+        """Stream a chat completion, yielding text deltas as they arrive.
+        流式对话，逐段返回增量文本
 
         Args:
             messages: Conversation messages
             system_prompt: System prompt
 
-        Returns:
-            LLM response text
+        Yields:
+            Incremental response text
         """
-        logger.info(f"Sending chat request to Zhipu GLM...")
+        logger.info(f"Sending streaming chat request to Zhipu GLM...")
         headers = {
             "Content-Type": "application/json",
+            "Accept": "text/event-stream",
             "Authorization": f"Bearer {self.api_key}",
             "X-Api-Resource-Id": "volc.bigmodel.cn",
             "X-Api-Request-Id": self._generate_request_id(),
@@ -61,34 +80,73 @@ class ZhipuGLMService:
 
         data = {
             "model": self.model,
-            "messages": messages,
+            "messages": self._build_messages(messages, system_prompt),
             "stream": True,
         }
 
         try:
-            async with aiohttp.ClientSession(headers=headers) as session:
-                response = await session.post(
-                    f"{ZHIPU_BASE_URL}/chat/completions",
-                    json=data
-                )
-
-                if response.status == 200:
-                    result = await response.json()
-                    logger.success(f"Zhipu GLM chat successful")
-                    return result.get("choices", [{}]).get("message", {}).get("content", "")
-                else:
-                    logger.error(f"Zhipu GLM chat failed: {response.status}")
+            mark("llm_request")
+            session = await get_session()
+            async with get_limiter(RESOURCE_CHAT).slot(), track_upstream(self.service_name), session.post(
+                f"{self.base_url.rstrip('/')}/chat/completions",
+                json=data,
+                headers=headers,
+            ) as response:
+                if response.status != 200:
+                    body = await response.text()
+                    logger.error(f"Zhipu GLM chat failed: {response.status} {body[:200]}")
                     raise Exception(f"Zhipu GLM chat error: {response.status}")
+
+                async for raw_line in response.content:
+                    payload = _parse_sse_line(raw_line)
+                    if payload is None:
+                        continue
+                    if payload == "[DONE]":
+                        break
+
+                    chunk = json.loads(payload)
+                    for choice in chunk.get("choices", []):
+                        delta = choice.get("delta", {}).get("content")
+                        if delta:
+                            mark("llm_first_token")
+                            yield delta
+
+                mark("llm_last_token")
+                logger.success(f"Zhipu GLM chat stream completed")
         except Exception as e:
             logger.error(f"Zhipu GLM chat exception: {e}")
             raise Exception(f"Zhipu GLM chat error: {e}")
 
-    async def _generate_request_id(self) -> str:
+    @profiled("zhipu_llm.chat")
+    async def chat(self, messages: list, system_prompt: str = None) -> str:
+        """Send chat request to LLM and wait for the full reply.
+
+        Args:
+            messages: Conversation messages
+            system_prompt: System prompt
+
+        Returns:
+            LLM response text
+        """
+        parts = []
+        async for delta in self.chat_stream(messages, system_prompt):
+            parts.append(delta)
+        return "".join(parts)
+
+    def _generate_request_id(self) -> str:
         """Generate a unique request ID."""
         import uuid
         return str(uuid.uuid4())
 
 
+def _parse_sse_line(raw_line: bytes) -> Optional[str]:
+    """Return the payload of an SSE ``data:`` line, or None for any other line."""
+    line = raw_line.decode("utf-8").strip()
+    if not line.startswith("data:"):
+        return None
+    return line[len("data:"):].strip()
+
+
 # Singleton instance
 _instance = None
 